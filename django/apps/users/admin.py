@@ -1,10 +1,103 @@
+import json
+
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.utils.functional import cached_property
+
 from .models import CustomUser, Company
+from .search import match_team_members
+from .sync import deferred_tombstones
+
+# Changelists count matching rows exactly up to this many; past it, the
+# count is the planner's estimate, so a broad filter never counts millions
+# of rows on each page load
+EXACT_COUNT_LIMIT = 10000
+# Companies offered in the changelist's company filter, largest first
+COMPANY_FILTER_CHOICES = 20
+
+
+def _table_estimate(queryset):
+    # Rows in the whole table, from the statistics; -1 until first analyzed
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    return row[0] if row and row[0] >= 0 else None
+
+
+def _plan_estimate(queryset):
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that stops counting at EXACT_COUNT_LIMIT rows.
+
+    Below the limit the count is exact. Above it PostgreSQL's estimate is
+    used (table statistics unfiltered, the query plan filtered), and other
+    databases report the limit; the last pages of a huge result are then
+    approximate, which the admin tolerates.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        postgresql = connections[queryset.db].vendor == 'postgresql'
+        if postgresql and not queryset.query.where:
+            estimate = _table_estimate(queryset)
+            if estimate is not None and estimate > EXACT_COUNT_LIMIT:
+                return estimate
+        counted = queryset.order_by()[:EXACT_COUNT_LIMIT + 1].count()
+        if counted <= EXACT_COUNT_LIMIT or not postgresql:
+            return min(counted, EXACT_COUNT_LIMIT)
+        return max(_plan_estimate(queryset), counted)
+
+
+class CompanyListFilter(admin.SimpleListFilter):
+    # The default related filter lists every company; this offers the
+    # largest ones, read from the headcount counters, and any other through
+    # ?company=<id>
+    title = 'company'
+    parameter_name = 'company'
+
+    def lookups(self, request, model_admin):
+        companies = list(
+            Company.objects.filter(deleting=False).order_by('-member_count', 'name')
+            .only('name')[:COMPANY_FILTER_CHOICES]
+        )
+        selected = self.value()
+        if selected and selected.isdigit() and int(selected) not in {company.pk for company in companies}:
+            companies += list(Company.objects.filter(pk=selected).only('name'))
+        return [(str(company.pk), company.name) for company in companies]
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if value and value.isdigit():
+            return queryset.filter(company_id=value)
+        return queryset
+
 
 class CustomUserAdmin(UserAdmin):
     model = CustomUser
     list_display = ['username', 'email', 'first_name', 'last_name', 'role', 'company']
+    # One join instead of a company query per row
+    list_select_related = ['company']
+    list_filter = [CompanyListFilter, 'role', 'is_staff', 'is_superuser', 'is_active', 'groups']
+    # The search itself is match_team_members, served by the search indexes;
+    # these only switch the search box on
+    search_fields = ['username']
+    search_help_text = 'Exact username, or part of a name, email or phone number.'
+    autocomplete_fields = ['company']
+    paginator = EstimatedCountPaginator
+    # Skip the second, unfiltered count behind "N total"
+    show_full_result_count = False
     fieldsets = UserAdmin.fieldsets + (
         (None, {'fields': ('role', 'company', 'phone_number')}),
     )
@@ -12,5 +105,27 @@ class CustomUserAdmin(UserAdmin):
         (None, {'fields': ('role', 'company', 'phone_number')}),
     )
 
+    def get_search_results(self, request, queryset, search_term):
+        return match_team_members(queryset, search_term), False
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic(), deferred_tombstones():
+            super().delete_queryset(request, queryset)
+
+
+class CompanyAdmin(admin.ModelAdmin):
+    list_display = ['name', 'member_count', 'admin_count', 'regular_count', 'active_count']
+    readonly_fields = ['member_count', 'admin_count', 'regular_count', 'active_count']
+    # Needed by the company autocomplete on the user form
+    search_fields = ['name']
+    ordering = ['name']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def delete_queryset(self, request, queryset):
+        # Deleting a company cascades to its members
+        with transaction.atomic(), deferred_tombstones():
+            super().delete_queryset(request, queryset)
+
 admin.site.register(CustomUser, CustomUserAdmin)
-admin.site.register(Company)
\ No newline at end of file
+admin.site.register(Company, CompanyAdmin)
@@ -0,0 +1,124 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.decorators import classonlymethod
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .instrumentation import note_user, timed
+
+ASYNC_READ_METHODS = ('get', 'head')
+
+
+class AsyncReadMixin:
+    """
+    Serve a viewset's hot read actions as native async views.
+
+    For each action named in ``async_actions``, a GET or HEAD is dispatched to
+    ``a<action>`` on the event loop: authentication awaits the auth state,
+    and the queryset is read with the async ORM, so only the cache and
+    database calls themselves leave the loop. Writes, other actions and
+    non-JSON renderers (the browsable API) still go through the sync view.
+
+    Permissions and the other DRF hooks run unchanged; only
+    authenticators with an ``aauthenticate`` method avoid a thread. Only
+    used when ASYNC_READ_VIEWS is on, which it is not by default.
+    """
+    async_actions = ()
+
+    @classonlymethod
+    def as_view(cls, actions=None, **initkwargs):
+        sync_view = super().as_view(actions, **initkwargs)
+        if not settings.ASYNC_READ_VIEWS:
+            return sync_view
+        async_methods = {
+            method: action for method, action in actions.items()
+            if method in ASYNC_READ_METHODS and action in cls.async_actions
+        }
+        if not async_methods:
+            return sync_view
+        if 'get' in async_methods:
+            async_methods.setdefault('head', async_methods['get'])
+
+        async def view(request, *args, **kwargs):
+            action = async_methods.get(request.method.lower())
+            if action is not None:
+                self = cls(**initkwargs)
+                self.action_map = actions
+                self.request = request
+                self.args = args
+                self.kwargs = kwargs
+                response = await self.adispatch(request, action, *args, **kwargs)
+                if response is not None:
+                    return response
+            return await sync_to_async(sync_view)(request, *args, **kwargs)
+
+        for attribute in ('cls', 'initkwargs', 'actions', 'csrf_exempt'):
+            setattr(view, attribute, getattr(sync_view, attribute))
+        # For callers already on a thread, such as the batch endpoint
+        view.sync_view = sync_view
+        view.__name__ = sync_view.__name__
+        view.__doc__ = sync_view.__doc__
+        return view
+
+    async def adispatch(self, request, action, *args, **kwargs):
+        """
+        Async counterpart of ``dispatch()`` for a single read action.
+
+        Returns None, without handling the request, when the negotiated
+        renderer is not JSON, so the caller can fall back to the sync view.
+        """
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        # HEAD is not always in the action map
+        self.action = action
+        self.headers = self.default_response_headers
+
+        try:
+            self.format_kwarg = self.get_format_suffix(**kwargs)
+            request.accepted_renderer, request.accepted_media_type = self.perform_content_negotiation(request)
+            if not isinstance(request.accepted_renderer, JSONRenderer):
+                return None
+            request.version, request.versioning_scheme = self.determine_version(request, *args, **kwargs)
+            await self.aperform_authentication(request)
+            self.check_permissions(request)
+            self.check_throttles(request)
+            response = await getattr(self, f'a{action}')(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        response = self.finalize_response(request, response, *args, **kwargs)
+        # Render here rather than leave it to Django, which would render a
+        # TemplateResponse from an async view on a thread
+        response.render()
+        rendered = HttpResponse(response.content, status=response.status_code)
+        for header, value in response.items():
+            rendered[header] = value
+        return rendered
+
+    async def aperform_authentication(self, request):
+        # Request._authenticate(), awaiting authenticators that support it
+        with timed('auth'):
+            for authenticator in request.authenticators:
+                authenticate = getattr(authenticator, 'aauthenticate', None)
+                if authenticate is None:
+                    authenticate = sync_to_async(authenticator.authenticate)
+                try:
+                    user_auth_tuple = await authenticate(request)
+                except APIException:
+                    request._not_authenticated()
+                    raise
+                if user_auth_tuple is not None:
+                    request._authenticator = authenticator
+                    request.user, request.auth = user_auth_tuple
+                    note_user(request.user)
+                    return
+            request._not_authenticated()
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.paginator is not None:
+            page = await self.paginator.apaginate_queryset(queryset, request, view=self)
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer([obj async for obj in queryset], many=True).data)
@@ -0,0 +1,216 @@
+import atexit
+import fcntl
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import AuditEvent
+
+logger = logging.getLogger(__name__)
+
+# Member fields whose changes are recorded; a password change is recorded
+# without its value
+AUDITED_FIELDS = ('username', 'email', 'first_name', 'last_name', 'phone_number', 'role', 'is_active')
+REDACTED = '***'
+AUDIT_INSERT_BATCH_SIZE = 1000
+SEGMENT_SUFFIX = '.wal'
+
+
+class AuditLog:
+    """
+    Buffer audit events in memory and insert them in batches from a thread.
+
+    Each event is first appended to this process's write-ahead segment, so a
+    crash loses nothing that was recorded. A flush swaps in a new segment,
+    inserts the buffered events and deletes the old segment. Segments are
+    flock()ed while in use; one nobody holds belongs to a dead process or a
+    failed insert and is replayed. Event ids make replays idempotent.
+    """
+
+    def __init__(self):
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        # Also runs in a forked child, which must not share the parent's
+        # segment or rely on its thread
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._lines = []
+        self._directory = settings.AUDIT_LOG_DIR
+        os.makedirs(self._directory, exist_ok=True)
+        self._segment = self._open_segment()
+        threading.Thread(target=self._run, name='audit-log', daemon=True).start()
+        atexit.register(self.close)
+        self._pid = os.getpid()
+
+    def _open_segment(self):
+        name = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}{SEGMENT_SUFFIX}'
+        segment = open(os.path.join(self._directory, name), 'a', encoding='utf-8')
+        fcntl.flock(segment, fcntl.LOCK_EX)
+        return segment
+
+    def record(self, action, actor_id, target, changes):
+        """Log ``action`` by ``actor_id`` on the member ``target``."""
+        line = json.dumps({
+            'event_id': uuid.uuid4().hex,
+            'action': action,
+            'company_id': target.company_id,
+            'actor_id': actor_id,
+            'target_id': target.pk,
+            'changes': changes,
+            'created_at': timezone.now().isoformat(),
+        }, cls=DjangoJSONEncoder)
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._start()
+        with self._lock:
+            self._segment.write(line + '\n')
+            self._segment.flush()
+            if settings.AUDIT_LOG_FSYNC:
+                os.fsync(self._segment.fileno())
+            self._lines.append(line)
+            full = len(self._lines) >= settings.AUDIT_FLUSH_SIZE
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """Insert the buffered events now."""
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            if not self._lines:
+                return
+            lines, self._lines = self._lines, []
+            segment, self._segment = self._segment, self._open_segment()
+        try:
+            _insert(lines)
+        except Exception:
+            # Unlocked, the segment is replayed on a later pass
+            logger.exception('Could not write %d audit events; they will be retried', len(lines))
+        else:
+            # Removed while still locked, so no replay picks it up
+            os.remove(segment.name)
+        segment.close()
+
+    def close(self):
+        """Flush, then remove this process's segment if nothing was logged since; runs at exit."""
+        self.flush()
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            if not self._lines:
+                os.remove(self._segment.name)
+                self._segment.close()
+
+    def replay(self):
+        """Insert and remove the segments no live process holds."""
+        for name in sorted(os.listdir(self._directory)):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            path = os.path.join(self._directory, name)
+            try:
+                segment = open(path, 'r', encoding='utf-8')
+            except FileNotFoundError:
+                continue
+            with segment:
+                try:
+                    fcntl.flock(segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                if not os.path.exists(path):
+                    # Removed by its writer between listing and locking
+                    continue
+                lines = segment.read().splitlines()
+                if lines:
+                    _insert(lines)
+                    logger.info('Replayed %d audit events from %s', len(lines), name)
+                os.remove(path)
+
+    def _run(self):
+        while True:
+            self._wake.wait(settings.AUDIT_FLUSH_SECONDS)
+            self._wake.clear()
+            close_old_connections()
+            try:
+                self.flush()
+                self.replay()
+            except Exception:
+                logger.exception('Audit log flush failed')
+                connection.close()
+
+
+def _insert(lines):
+    events = []
+    for line in lines:
+        try:
+            data = json.loads(line)
+        except ValueError:
+            # The tail of a segment whose process died mid-write
+            logger.warning('Skipping a truncated audit event: %r', line[:200])
+            continue
+        data['created_at'] = parse_datetime(data['created_at'])
+        events.append(AuditEvent(**data))
+    AuditEvent.objects.bulk_create(events, batch_size=AUDIT_INSERT_BATCH_SIZE, ignore_conflicts=True)
+
+
+audit_log = AuditLog()
+
+
+def member_values(user, created=True):
+    """``{field: [None, value]}`` for a new member, ``[value, None]`` for a deleted one."""
+    return {
+        field: [None, value] if created else [value, None]
+        for field in AUDITED_FIELDS
+        if (value := getattr(user, field)) not in (None, '')
+    }
+
+
+def changed_values(user, data):
+    """``{field: [old, new]}`` for what applying ``data`` to ``user`` would change."""
+    changes = {
+        field: [getattr(user, field), value]
+        for field, value in data.items()
+        if field in AUDITED_FIELDS and getattr(user, field) != value
+    }
+    if data.get('password'):
+        changes['password'] = [REDACTED, REDACTED]
+    return changes
+
+
+def record_member_events(action, actor_id, users_changes):
+    """
+    Log ``action`` for each ``(user, changes)`` once the current transaction commits.
+
+    A role change is logged as its own ``user.role_changed`` event, and an
+    update that changed nothing is not logged.
+    """
+    events = []
+    for user, changes in users_changes:
+        if action == 'user.updated' and 'role' in changes:
+            events.append(('user.role_changed', user, {'role': changes.pop('role')}))
+            if not changes:
+                continue
+        if changes or action != 'user.updated':
+            events.append((action, user, changes))
+    if not events:
+        return
+
+    def record():
+        for event_action, user, changes in events:
+            try:
+                audit_log.record(event_action, actor_id, user, changes)
+            except Exception:
+                logger.exception('Could not log %s for user %s', event_action, user.pk)
+
+    transaction.on_commit(record)
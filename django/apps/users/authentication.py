@@ -0,0 +1,149 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import Company, CustomUser
+
+TOKEN_VERSION_CLAIM = 'tv'
+
+
+def _auth_state_key(user_id):
+    return f'auth:state:{user_id}'
+
+
+def get_auth_state(user_id):
+    """
+    Return ``(token_version, is_active)`` for a user, or None if it no longer exists.
+
+    Served from the cache for AUTH_STATE_CACHE_TIMEOUT seconds so the common
+    request path does not query the users table.
+    """
+    key = _auth_state_key(user_id)
+    state = cache.get(key)
+    if state is None:
+        # Always the primary: a lagging replica could re-cache a revoked version
+        state = CustomUser.objects.using(DEFAULT_DB_ALIAS).filter(pk=user_id).values_list('token_version', 'is_active').first()
+        if state is None:
+            return None
+        cache.set(key, tuple(state), settings.AUTH_STATE_CACHE_TIMEOUT)
+    return state
+
+
+async def aget_auth_state(user_id):
+    """Async version of get_auth_state(), for async views."""
+    key = _auth_state_key(user_id)
+    state = await cache.aget(key)
+    if state is None:
+        state = await CustomUser.objects.using(DEFAULT_DB_ALIAS).filter(pk=user_id).values_list('token_version', 'is_active').afirst()
+        if state is None:
+            return None
+        await cache.aset(key, tuple(state), settings.AUTH_STATE_CACHE_TIMEOUT)
+    return state
+
+
+def clear_auth_state(user_ids):
+    # Cleared after commit so a concurrent request cannot re-cache the old row
+    keys = [_auth_state_key(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+class TeamRefreshToken(RefreshToken):
+    """Refresh token that also carries the claims a request is authorized on."""
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token.set_user_claims(user)
+        return token
+
+    def set_user_claims(self, user):
+        self['username'] = user.username
+        self['role'] = user.role
+        self['company_id'] = user.company_id
+        self['is_superuser'] = user.is_superuser
+        self['is_staff'] = user.is_staff
+        self[TOKEN_VERSION_CLAIM] = user.token_version
+
+
+class TokenPrincipal(TokenUser):
+    """
+    request.user built from access token claims instead of a CustomUser row.
+
+    Exposes what the permission classes and views read; ``company`` is only
+    fetched when a view actually needs the instance.
+    """
+
+    @cached_property
+    def role(self):
+        return self.token.get('role')
+
+    @cached_property
+    def company_id(self):
+        return self.token.get('company_id')
+
+    @property
+    def is_company_admin(self):
+        return self.role == 'admin'
+
+    @cached_property
+    def company(self):
+        if self.company_id is None:
+            return None
+        return Company.objects.filter(pk=self.company_id).first()
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that trusts the signed claims instead of loading the user.
+
+    The only per-request check is that the token version still matches the
+    user's, read through the short-lived auth state cache. Changing a user's
+    role, company, superuser or active status, or their password, bumps the
+    version and clears that cache, which revokes their outstanding tokens. Tokens issued without
+    a version claim fall back to the stock database lookup.
+    """
+
+    def get_user(self, validated_token):
+        if TOKEN_VERSION_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+        return self.check_auth_state(validated_token, get_auth_state(self.get_user_id(validated_token)))
+
+    async def aauthenticate(self, request):
+        """Async version of authenticate(), for async views."""
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        if TOKEN_VERSION_CLAIM not in validated_token:
+            return await sync_to_async(super().get_user)(validated_token)
+        return self.check_auth_state(validated_token, await aget_auth_state(self.get_user_id(validated_token)))
+
+    def get_user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+    def check_auth_state(self, validated_token, state):
+        if state is None:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        token_version, is_active = state
+        if not is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        if validated_token[TOKEN_VERSION_CLAIM] != token_version:
+            raise AuthenticationFailed("Token has been revoked", code="token_revoked")
+
+        return TokenPrincipal(validated_token)
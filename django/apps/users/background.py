@@ -0,0 +1,102 @@
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from rest_framework.exceptions import PermissionDenied
+
+from .bulk import bulk_create_users, bulk_delete_users, bulk_update_users, created_users_data
+from .export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, stream_roster
+from .jobs import JobRequest, complete_job, merge_rows, report_progress
+from .models import CustomUser
+from .views import CanManageCompanyUsers, CustomUserViewSet
+
+# Handlers for the heavy roster operations the bulk and export endpoints
+# run in the background with ?background=true. Each acts for the user who
+# queued it, through the same viewset, scoping and permission checks as the
+# request would have had. Hashing passwords is the slow part of an import,
+# so it reports progress, and renews the lease, after every chunk. The bulk
+# handlers record their outcome in the transaction that makes their writes,
+# so a worker dying after the commit can't have them applied twice.
+
+
+def _view_for(job, method):
+    user = CustomUser.objects.select_related('company').filter(pk=job.created_by_id, is_active=True).first()
+    if user is None:
+        raise PermissionDenied('The user who started this job no longer exists or is inactive.')
+    if method != 'GET' and not user.is_superuser and not user.is_company_admin:
+        raise PermissionDenied("You don't have permission to perform this action.")
+    return CustomUserViewSet(request=JobRequest(user, method), format_kwarg=None, action=job.kind, kwargs={})
+
+
+def _rows(job):
+    return merge_rows(job.payload['rows'], (job.secrets or {}).get('passwords'))
+
+
+def _can_manage(view):
+    permission = CanManageCompanyUsers()
+
+    def can_manage(user):
+        return permission.has_object_permission(view.request, view, user)
+
+    return can_manage
+
+
+def bulk_create(job):
+    view = _view_for(job, 'POST')
+    rows = _rows(job)
+    invite = job.payload.get('invite', False)
+    report_progress(job, 0, total=len(rows) if isinstance(rows, list) else None)
+    context = view.get_serializer_context()
+    bulk_create_users(
+        rows, view.request.user.company, context, invite=invite, progress=lambda hashed: report_progress(job, hashed),
+        finish=lambda users: complete_job(job, created_users_data(users, context, invite), progress=len(users)),
+    )
+    return job.result
+
+
+def bulk_update(job):
+    view = _view_for(job, 'PATCH')
+    rows = _rows(job)
+    report_progress(job, 0, total=len(rows) if isinstance(rows, list) else None)
+    context = view.get_serializer_context()
+    bulk_update_users(
+        view.get_queryset(), rows, _can_manage(view), context, progress=lambda hashed: report_progress(job, hashed),
+        finish=lambda users: complete_job(job, view.get_serializer(users, many=True).data, progress=len(users)),
+    )
+    return job.result
+
+
+def bulk_delete(job):
+    view = _view_for(job, 'DELETE')
+    ids = job.payload['ids']
+    report_progress(job, 0, total=len(ids) if isinstance(ids, list) else None)
+    bulk_delete_users(
+        view.get_queryset(), ids, _can_manage(view), actor_id=job.created_by_id,
+        finish=lambda deleted: complete_job(job, {'deleted': deleted}, progress=deleted),
+    )
+    return job.result
+
+
+def export(job):
+    """Write the caller's roster to default storage; the job's download link serves it."""
+    view = _view_for(job, 'GET')
+    export_format = job.payload['file_format']
+    queryset = view.get_queryset()
+    report_progress(job, 0, total=queryset.count())
+
+    name = f'exports/roster-{job.pk}.{export_format}'
+    rows = 0
+    with tempfile.TemporaryFile() as buffer:
+        for line in stream_roster(queryset, export_format):
+            buffer.write(line if isinstance(line, bytes) else line.encode('utf-8'))
+            rows += 1
+            if rows % EXPORT_CHUNK_SIZE == 0:
+                report_progress(job, rows)
+        buffer.seek(0)
+        # A retry replaces whatever an earlier attempt left
+        default_storage.delete(name)
+        name = default_storage.save(name, File(buffer))
+    # Nor are the CSV header and the JSON array's closing line
+    members = rows - 1 if export_format in ('csv', 'json') else rows
+    report_progress(job, members)
+    return {'file': name, 'file_format': export_format, 'content_type': EXPORT_FORMATS[export_format], 'rows': members}
@@ -0,0 +1,168 @@
+import io
+import logging
+import math
+
+from django.db import transaction
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+from rest_framework.exceptions import ValidationError
+
+from .bulk import BulkValidationError
+from .renderers import dumps, loads
+from .sync import deferred_tombstones
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_REQUESTS = 20
+# A batch may cost up to BATCH_MAX_COST: a read costs 1, a write
+# BATCH_WRITE_COST, and a list body (a bulk call) one more per
+# BATCH_ROWS_PER_COST rows, so one batch can't tie up a worker for long
+BATCH_MAX_COST = 60
+BATCH_WRITE_COST = 3
+BATCH_ROWS_PER_COST = 100
+BATCH_METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+BATCH_PATH_PREFIX = '/api/'
+
+NOT_RUN = {'detail': 'Not run: an earlier request in this atomic batch failed.'}
+
+
+class SubRequest(HttpRequest):
+    """One request of a batch, inheriting the batch request's headers, cookies and scheme."""
+
+    def __init__(self, parent, method, path, body):
+        super().__init__()
+        path, _, query = path.partition('?')
+        content = dumps(body) if body is not None else b''
+        self.method = method
+        self.path = self.path_info = path
+        self.META = {
+            **parent.META,
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(content)),
+            'HTTP_ACCEPT': 'application/json',
+        }
+        self.GET = QueryDict(query)
+        self.COOKIES = parent.COOKIES
+        self._stream = io.BytesIO(content)
+        self._read_started = False
+        self._scheme = parent.scheme
+
+    def _get_scheme(self):
+        return self._scheme
+
+
+def _row_count(body):
+    if isinstance(body, dict):
+        body = body.get('ids')
+    return len(body) if isinstance(body, list) else 0
+
+
+def request_cost(method, body):
+    cost = 1 if method == 'GET' else BATCH_WRITE_COST
+    return cost + math.ceil(_row_count(body) / BATCH_ROWS_PER_COST)
+
+
+def validate_batch(items, batch_view):
+    """Check the batch's shape and limits before anything runs; returns the requests with methods normalized."""
+    if not isinstance(items, list):
+        raise ValidationError({'requests': ['Expected a list of requests.']})
+    if not items:
+        raise ValidationError({'requests': ['This list may not be empty.']})
+    if len(items) > BATCH_MAX_REQUESTS:
+        raise ValidationError({'requests': [f'Ensure this list has no more than {BATCH_MAX_REQUESTS} requests.']})
+
+    requests = []
+    errors = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({'index': index, 'errors': {'detail': 'Expected an object with a method and a path.'}})
+            continue
+        method = str(item.get('method', 'GET')).upper()
+        path = item.get('path')
+        if method not in BATCH_METHODS:
+            errors.append({'index': index, 'errors': {'method': [f'Must be one of: {", ".join(BATCH_METHODS)}.']}})
+        elif not isinstance(path, str) or not path.startswith(BATCH_PATH_PREFIX):
+            errors.append({'index': index, 'errors': {'path': [f'Must be a path under {BATCH_PATH_PREFIX}.']}})
+        elif getattr(getattr(_resolve(path), 'func', None), 'cls', None) is batch_view:
+            errors.append({'index': index, 'errors': {'path': ['Batches cannot be nested.']}})
+        else:
+            requests.append((method, path, item.get('body')))
+    if errors:
+        raise BulkValidationError(errors)
+
+    cost = sum(request_cost(method, body) for method, _, body in requests)
+    if cost > BATCH_MAX_COST:
+        raise ValidationError({'requests': [f'This batch costs {cost}; the limit is {BATCH_MAX_COST}.']})
+    return requests
+
+
+def _resolve(path):
+    try:
+        return resolve(path.partition('?')[0])
+    except Resolver404:
+        return None
+
+
+def _result(response):
+    if response.streaming:
+        # Exports and downloads write straight to the client; nothing to
+        # embed in a batch
+        response.close()
+        return {'status': 400, 'body': {'detail': 'Streamed responses cannot be batched; request this one on its own.'}}
+    if hasattr(response, 'render'):
+        response.render()
+    body = None
+    if response.content:
+        if response.get('Content-Type', '').startswith('application/json'):
+            body = loads(response.content)
+        else:
+            body = response.content.decode(response.charset)
+    return {'status': response.status_code, 'body': body}
+
+
+def run_request(request, method, path, body):
+    match = _resolve(path)
+    if match is None:
+        return {'status': 404, 'body': {'detail': 'Not found.'}}
+    sub_request = SubRequest(request._request, method, path, body)
+    sub_request.resolver_match = match
+    # The batch's authentication stands for every request in it, so tokens
+    # are checked once rather than once per request
+    sub_request._force_auth_user = request.user
+    sub_request._force_auth_token = request.auth
+    # The batch endpoint runs on a thread already; call async views' sync side
+    view = getattr(match.func, 'sync_view', match.func)
+    try:
+        response = view(sub_request, *match.args, **match.kwargs)
+        return _result(response)
+    except Exception:
+        logger.exception('Batched %s %s failed', method, path)
+        return {'status': 500, 'body': {'detail': 'A server error occurred.'}}
+
+
+def run_batch(request, requests, atomic=False):
+    """
+    Run ``requests`` in order and return one ``{status, body}`` per request.
+
+    Each runs through the same view, permissions and validation as it would
+    on its own. Failures don't stop the batch, unless it is ``atomic``: then
+    the first failure rolls back every request before it and the rest are
+    not run.
+    """
+    if not atomic:
+        return [run_request(request, *item) for item in requests]
+
+    results = []
+    # One transaction, so the tombstones of every delete in it go in as one insert
+    with transaction.atomic(), deferred_tombstones():
+        for item in requests:
+            result = run_request(request, *item)
+            results.append(result)
+            if result['status'] >= 400:
+                transaction.set_rollback(True)
+                results.extend({'status': 424, 'body': NOT_RUN} for _ in requests[len(results):])
+                break
+    return results
@@ -0,0 +1,300 @@
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.tokens import default_token_generator
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from rest_framework.exceptions import ValidationError
+
+from .audit import changed_values, member_values, record_member_events
+from .authentication import clear_auth_state
+from .cache import bump_roster_versions
+from .deletion import check_company_accepts_members
+from .events import publish_roster_events
+from .hashing import hash_passwords
+from .models import CustomUser
+from .serializers import CustomUserSerializer, allocate_usernames
+from .stats import apply_stat_deltas, deferred_stats, stat_deltas
+from .sync import deferred_tombstones
+
+BULK_MAX_ITEMS = 5000
+BULK_BATCH_SIZE = 1000
+
+
+class BulkValidationError(ValidationError):
+    # Keeps row indexes and ids as numbers; ValidationError would otherwise
+    # coerce every leaf of the detail to a string
+    def __init__(self, errors):
+        self.detail = {'errors': errors}
+
+
+def _raise_row_errors(errors):
+    raise BulkValidationError(errors)
+
+
+def _check_batch(rows):
+    if not isinstance(rows, list):
+        raise ValidationError({'detail': 'Expected a list of items.'})
+    if not rows:
+        raise ValidationError({'detail': 'This list may not be empty.'})
+    if len(rows) > BULK_MAX_ITEMS:
+        raise ValidationError({'detail': f'Ensure this list has no more than {BULK_MAX_ITEMS} items.'})
+
+
+def _taken_usernames(usernames, exclude_ids=()):
+    return set(
+        CustomUser.objects.filter(username__in=usernames)
+        .exclude(id__in=exclude_ids)
+        .values_list('username', flat=True)
+    )
+
+
+def bulk_create_users(rows, company, context, invite=False, progress=None, finish=None):
+    """
+    Validate and insert a list of new team members in one transaction.
+
+    Either every row is created or none is; on failure the per-row errors are
+    raised as a ValidationError keyed by the row's position in ``rows``.
+
+    Supplied passwords are hashed in parallel before the insert, calling
+    ``progress`` with the number hashed so far after each chunk. With
+    ``invite`` no password is hashed at all: members are created with an
+    unusable password and choose one on first login.
+
+    ``finish`` is called with the new users inside the insert's transaction,
+    for a background job to record its outcome in the same commit.
+    """
+    _check_batch(rows)
+    check_company_accepts_members(company)
+    serializer = CustomUserSerializer(data=rows, many=True, context=context)
+    serializer.is_valid()
+    errors = [
+        {'index': index, 'errors': row_errors}
+        for index, row_errors in enumerate(serializer.errors or [])
+        if row_errors
+    ]
+    if errors:
+        _raise_row_errors(errors)
+
+    validated_rows = [dict(data) for data in serializer.validated_data]
+    requested = {}
+    for index, data in enumerate(validated_rows):
+        if data.get('username'):
+            data['username'] = CustomUser.normalize_username(data['username'])
+            requested.setdefault(data['username'], []).append(index)
+    taken = _taken_usernames(list(requested))
+    for username, indexes in requested.items():
+        if username in taken or len(indexes) > 1:
+            errors.extend(
+                {'index': index, 'errors': {'username': ['A user with that username already exists.']}}
+                for index in indexes
+            )
+    if errors:
+        _raise_row_errors(sorted(errors, key=lambda error: error['index']))
+
+    generated = iter(allocate_usernames(sum(1 for data in validated_rows if not data.get('username'))))
+    passwords = [data.pop('password', None) for data in validated_rows]
+    if invite:
+        # Invited members get an unusable password, as create_user gives
+        # when none is supplied
+        password_hashes = [make_password(None)] * len(validated_rows)
+    else:
+        password_hashes = hash_passwords(passwords, progress=progress)
+    users = []
+    for data, password_hash in zip(validated_rows, password_hashes):
+        if not data.get('username'):
+            data['username'] = next(generated)
+        if 'email' in data:
+            data['email'] = CustomUser.objects.normalize_email(data['email'])
+        users.append(CustomUser(company=company, password=password_hash, **data))
+
+    try:
+        with transaction.atomic():
+            CustomUser.objects.bulk_create(users, batch_size=BULK_BATCH_SIZE)
+            # bulk_create sends no post_save, so invalidate the roster and
+            # count the new members here
+            bump_roster_versions([company.pk if company else None])
+            with deferred_stats():
+                for user in users:
+                    apply_stat_deltas(stat_deltas(None, user._current_claims()))
+            publish_roster_events('user.created', users)
+            record_member_events(
+                'user.created', context['request'].user.pk, [(user, member_values(user)) for user in users],
+            )
+            if finish:
+                finish(users)
+    except IntegrityError:
+        raise ValidationError({'detail': 'Some usernames were taken while the request was processed. Please retry.'})
+    return users
+
+
+def created_users_data(users, context, invite=False):
+    """Serialize the result of bulk_create_users, with each invitation when ``invite``."""
+    data = CustomUserSerializer(users, many=True, context=context).data
+    if invite:
+        for row, user in zip(data, users):
+            row['invitation'] = {
+                'uid': urlsafe_base64_encode(force_bytes(user.pk)),
+                'token': default_token_generator.make_token(user),
+            }
+    return data
+
+
+def _load_targets(queryset, ids, can_manage):
+    targets = queryset.in_bulk(ids)
+    errors = []
+    for index, user_id in enumerate(ids):
+        user = targets.get(user_id)
+        if user is None:
+            errors.append({'index': index, 'id': user_id, 'errors': {'detail': 'Not found.'}})
+        elif not can_manage(user):
+            errors.append({'index': index, 'id': user_id, 'errors': {'detail': 'You do not have permission to perform this action.'}})
+    return targets, errors
+
+
+def _collect_ids(rows, key=None):
+    ids = []
+    errors = []
+    for index, row in enumerate(rows):
+        if key and not isinstance(row, dict):
+            ids.append(None)
+            errors.append({'index': index, 'errors': {'detail': 'Expected an object.'}})
+            continue
+        value = row.get(key) if key else row
+        try:
+            ids.append(int(value))
+        except (TypeError, ValueError):
+            ids.append(None)
+            errors.append({'index': index, 'errors': {'id': ['A valid integer is required.']}})
+    return ids, errors
+
+
+def bulk_update_users(queryset, rows, can_manage, context, progress=None, finish=None):
+    """
+    Apply a list of partial updates (each carrying its ``id``) in one transaction.
+
+    Only users visible through ``queryset`` and accepted by ``can_manage`` can
+    be changed, and the same role rule as CustomUserSerializer.update applies.
+    New passwords are hashed as bulk_create_users hashes them, with the same
+    ``progress`` and ``finish`` callbacks.
+    """
+    _check_batch(rows)
+    ids, errors = _collect_ids(rows, key='id')
+    if errors:
+        _raise_row_errors(errors)
+    if len(set(ids)) != len(ids):
+        raise ValidationError({'detail': 'Each id may only appear once.'})
+
+    targets, errors = _load_targets(queryset, ids, can_manage)
+    request_user = context['request'].user
+    changes = []
+    for index, (user_id, row) in enumerate(zip(ids, rows)):
+        user = targets.get(user_id)
+        if user is None:
+            continue
+        data = {key: value for key, value in row.items() if key != 'id'}
+        serializer = CustomUserSerializer(user, data=data, partial=True, context=context)
+        if not serializer.is_valid():
+            errors.append({'index': index, 'id': user_id, 'errors': serializer.errors})
+            continue
+        validated = dict(serializer.validated_data)
+        if 'role' in validated and not (request_user.is_superuser or request_user.role == 'admin'):
+            errors.append({'index': index, 'id': user_id, 'errors': {'role': ['Only admins can change user roles.']}})
+            continue
+        if validated.get('username'):
+            validated['username'] = CustomUser.normalize_username(validated['username'])
+        if 'email' in validated:
+            validated['email'] = CustomUser.objects.normalize_email(validated['email'])
+        changes.append((index, user, validated))
+
+    renamed = [
+        (data['username'], index, user)
+        for index, user, data in changes
+        if data.get('username', user.username) != user.username
+    ]
+    if renamed:
+        taken = _taken_usernames([username for username, _, _ in renamed], exclude_ids=[user.id for _, _, user in renamed])
+        requested = [username for username, _, _ in renamed]
+        errors.extend(
+            {'index': index, 'id': user.id, 'errors': {'username': ['A user with that username already exists.']}}
+            for username, index, user in renamed
+            if username in taken or requested.count(username) > 1
+        )
+    if errors:
+        _raise_row_errors(sorted(errors, key=lambda error: error['index']))
+
+    new_passwords = [validated for _, _, validated in changes if 'password' in validated]
+    for validated, password_hash in zip(new_passwords, hash_passwords([validated['password'] for validated in new_passwords], progress=progress)):
+        validated['password'] = password_hash
+
+    fields = set()
+    revoked = []
+    audited = []
+    for _, user, validated in changes:
+        audited.append((user, changed_values(user, validated)))
+        for attr, value in validated.items():
+            setattr(user, attr, value)
+        fields.update(validated)
+        # bulk_update skips CustomUser.save, so bump the token version here
+        if user.token_claims_changed() or 'password' in validated:
+            user.token_version += 1
+            revoked.append(user.pk)
+    if revoked:
+        fields.add('token_version')
+    users = [user for _, user, _ in changes]
+    if fields:
+        # bulk_update does not apply auto_now, and delta sync relies on it
+        now = timezone.now()
+        for user in users:
+            user.updated_at = now
+        fields.add('updated_at')
+        try:
+            with transaction.atomic():
+                CustomUser.objects.bulk_update(users, sorted(fields), batch_size=BULK_BATCH_SIZE)
+                bump_roster_versions({user.company_id for user in users})
+                with deferred_stats():
+                    for user in users:
+                        current = user._current_claims()
+                        apply_stat_deltas(stat_deltas({**current, **user._loaded_claims}, current))
+                clear_auth_state(revoked)
+                publish_roster_events('user.updated', users)
+                record_member_events('user.updated', request_user.pk, audited)
+                if finish:
+                    finish(users)
+        except IntegrityError:
+            raise ValidationError({'detail': 'Some usernames were taken while the request was processed. Please retry.'})
+    elif finish:
+        # Nothing to write, so nothing a second run could repeat
+        finish(users)
+    return users
+
+
+def bulk_delete_users(queryset, ids, can_manage, actor_id=None, finish=None):
+    """
+    Delete the listed users in one transaction, or none of them if any row fails.
+
+    ``actor_id`` is the user the deletions are logged against. ``finish`` is
+    called with the number deleted inside the transaction, as for
+    bulk_create_users.
+    """
+    _check_batch(ids)
+    ids, errors = _collect_ids(ids)
+    if errors:
+        _raise_row_errors(errors)
+    ids = list(dict.fromkeys(ids))
+
+    targets, errors = _load_targets(queryset, ids, can_manage)
+    if errors:
+        _raise_row_errors(errors)
+
+    # post_delete adjusts the counters and records a tombstone row by row;
+    # apply them as one update and one insert
+    with transaction.atomic(), deferred_stats(), deferred_tombstones():
+        queryset.filter(id__in=ids).delete()
+        publish_roster_events('user.deleted', targets.values())
+        record_member_events(
+            'user.deleted', actor_id, [(user, member_values(user, created=False)) for user in targets.values()],
+        )
+        if finish:
+            finish(len(ids))
+    return len(ids)
@@ -0,0 +1,158 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .routers import REPLICA_ALIASES, use_primary
+
+ALL_COMPANIES = 'all'
+
+
+def roster_scope(user):
+    # Superusers list every company, everyone else only their own, so these
+    # are the two kinds of roster a response can be built from
+    if user.is_superuser:
+        return ALL_COMPANIES
+    return f'company:{user.company_id}'
+
+
+def _version_key(scope):
+    return f'roster:version:{scope}'
+
+
+def get_roster_version(scope):
+    key = _version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock rather than 1 so a counter that was evicted
+        # never comes back at a version an old cached response was stored under
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_roster_version(scope):
+    key = _version_key(scope)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def _changed_key(scope):
+    return f'roster:changed:{scope}'
+
+
+def _bump(scope):
+    key = _version_key(scope)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+
+
+def bump_roster_versions(company_ids):
+    """
+    Invalidate cached rosters for ``company_ids`` and the all-companies view.
+
+    The bump is deferred until the current transaction commits, so a reader
+    can never cache pre-commit data under the new version. With replicas, the
+    roster is also flagged as changed for REPLICA_PIN_SECONDS, during which
+    it is read from the primary so a lagging replica's copy is never cached
+    under the new version either.
+    """
+    scopes = {f'company:{company_id}' for company_id in company_ids}
+    scopes.add(ALL_COMPANIES)
+
+    def bump():
+        for scope in scopes:
+            _bump(scope)
+        if REPLICA_ALIASES:
+            cache.set_many(dict.fromkeys(map(_changed_key, scopes), True), settings.REPLICA_PIN_SECONDS)
+
+    transaction.on_commit(bump)
+
+
+def client_etags(request):
+    # If-None-Match compares weakly, and a compressed response's ETag comes
+    # back marked weak (W/"...")
+    return {etag.removeprefix('W/') for etag in parse_etags(request.headers.get('If-None-Match', ''))}
+
+
+class RosterCacheMixin:
+    """
+    Cache serialized list and detail responses under the caller's roster version.
+
+    Each response carries a strong ETag derived from the version and the
+    request, so ``If-None-Match`` is answered with 304 from the cache alone.
+    """
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.acached_response(request, super().alist, *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.acached_response(request, super().aretrieve, *args, **kwargs)
+
+    def cached_response(self, request, view, *args, **kwargs):
+        if transaction.get_connection().in_atomic_block:
+            # Inside an atomic batch the response may show writes that are
+            # not committed yet, and could still be rolled back
+            return view(request, *args, **kwargs)
+        scope = roster_scope(request.user)
+        if REPLICA_ALIASES and cache.get(_changed_key(scope)):
+            use_primary(request)
+        etag, cache_key = self.get_cache_keys(request, scope, get_roster_version(scope))
+        if etag in client_etags(request):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            data = cache.get(cache_key)
+            if data is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(cache_key, response.data, settings.ROSTER_CACHE_TIMEOUT)
+            else:
+                response = Response(data)
+        return self.finalize_cached_response(response, etag)
+
+    async def acached_response(self, request, view, *args, **kwargs):
+        scope = roster_scope(request.user)
+        if REPLICA_ALIASES and await cache.aget(_changed_key(scope)):
+            use_primary(request)
+        etag, cache_key = self.get_cache_keys(request, scope, await aget_roster_version(scope))
+        if etag in client_etags(request):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            data = await cache.aget(cache_key)
+            if data is None:
+                response = await view(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                await cache.aset(cache_key, response.data, settings.ROSTER_CACHE_TIMEOUT)
+            else:
+                response = Response(data)
+        return self.finalize_cached_response(response, etag)
+
+    def get_cache_keys(self, request, scope, version):
+        # Returns the response's ETag and the key its body is cached under
+        request_key = f'{scope}:{version}:{request.accepted_renderer.format}:{request.build_absolute_uri()}'
+        digest = hashlib.sha256(request_key.encode('utf-8')).hexdigest()
+        return f'"{digest[:32]}"', f'roster:response:{digest}'
+
+    def finalize_cached_response(self, response, etag):
+        response['ETag'] = etag
+        # Rosters are private to the company; make clients revalidate each time
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
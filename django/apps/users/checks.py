@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, Tags, Warning, register
+
+
+@register(Tags.caches, deploy=True)
+def check_auth_state_cache(app_configs, **kwargs):
+    # Token revocation clears the cached auth state in the process that made
+    # the change; a per-process cache leaves the other workers serving the
+    # old state until it times out
+    if isinstance(caches['default'], LocMemCache):
+        return [Warning(
+            'The default cache is local to each process, so a revoked token stays valid in '
+            f'other workers for up to AUTH_STATE_CACHE_TIMEOUT ({settings.AUTH_STATE_CACHE_TIMEOUT}s).',
+            hint='Set REDIS_URL to share the cache between workers.',
+            id='users.W001',
+        )]
+    return []
+
+
+@register('jobs', deploy=True)
+def check_worker_shares_state(app_configs, **kwargs):
+    # The job worker is a process of its own: what its jobs write must
+    # reach the web processes through the cache and the event broker, which
+    # per-process ones can't do (revoked tokens stay valid, roster caches go
+    # stale and live clients never see the changes). run_jobs refuses to
+    # start on these.
+    errors = []
+    if isinstance(caches['default'], LocMemCache):
+        errors.append(Error(
+            'The default cache is local to each process, so the web processes never see what '
+            'background jobs invalidate.',
+            hint='Set REDIS_URL to share the cache between the web processes and the worker.',
+            id='users.E001',
+        ))
+    if settings.ROSTER_EVENT_BROKER.endswith('.InProcessBroker'):
+        errors.append(Error(
+            'ROSTER_EVENT_BROKER delivers events within one process, so clients never receive '
+            'the events of background jobs.',
+            hint='Set REDIS_URL, or ROSTER_EVENT_BROKER to a broker shared between processes.',
+            id='users.E002',
+        ))
+    return errors
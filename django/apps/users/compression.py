@@ -0,0 +1,107 @@
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Brotli's quality scale runs 0-11; 4 compresses better than gzip's default
+# level at a similar speed, which suits responses built per request
+BROTLI_QUALITY = 4
+# Event streams must reach the client event by event, not in compressed blocks
+UNCOMPRESSED_CONTENT_TYPES = ('text/event-stream',)
+
+
+def accepted_encodings(header):
+    """Map each content coding in an Accept-Encoding header to its q-value."""
+    encodings = {}
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        encodings[coding] = quality
+    return encodings
+
+
+def choose_encoding(header):
+    """The coding to compress with: brotli if installed and preferred at least as much as gzip, else gzip, else None."""
+    encodings = accepted_encodings(header)
+    candidates = [coding for coding in ('br', 'gzip') if coding != 'br' or brotli is not None]
+    best = max(candidates, key=lambda coding: encodings.get(coding, 0.0))
+    return best if encodings.get(best, 0.0) > 0 else None
+
+
+def _brotli_sequence(sequence):
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    for item in sequence:
+        data = compressor.process(item)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+async def _abrotli_sequence(sequence):
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    async for item in sequence:
+        data = compressor.process(item)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compress responses of at least COMPRESSION_MIN_BYTES with brotli or gzip.
+
+    The coding is negotiated from Accept-Encoding: brotli when the Brotli
+    package is installed and the client takes it, otherwise gzip through
+    Django's GZipMiddleware. Streamed responses such as exports are
+    compressed as they are sent; event streams are left alone.
+    """
+
+    def process_response(self, request, response):
+        if response.get('Content-Type', '').startswith(UNCOMPRESSED_CONTENT_TYPES):
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_BYTES:
+            return response
+        if response.has_header('Content-Encoding'):
+            return response
+
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding == 'gzip':
+            return super().process_response(request, response)
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = _abrotli_sequence(response.streaming_content)
+            else:
+                response.streaming_content = _brotli_sequence(response.streaming_content)
+            del response.headers['Content-Length']
+        else:
+            compressed = brotli.compress(response.content, quality=BROTLI_QUALITY)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # As GZipMiddleware does: the compressed body is a different
+        # representation, so a strong ETag becomes weak
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
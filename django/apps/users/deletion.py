@@ -0,0 +1,68 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from .events import publish_roster_events
+from .jobs import enqueue_job, report_progress
+from .models import Company, CustomUser, Job
+from .stats import deferred_stats
+from .sync import deferred_tombstones
+
+logger = logging.getLogger(__name__)
+
+
+def check_company_accepts_members(company):
+    """Reject adding members to ``company`` once its deletion has been scheduled."""
+    if company is not None and company.deleting:
+        raise ValidationError({'detail': 'This company is being deleted.'})
+
+
+def schedule_company_deletion(company, created_by_id=None):
+    """
+    Hide ``company`` and queue a job that deletes it and its members in batches.
+
+    Returns the deletion job, the one already queued if another request got
+    there first.
+    """
+    with transaction.atomic():
+        if Company.objects.filter(pk=company.pk, deleting=False).update(deleting=True):
+            return enqueue_job(
+                'company.delete', {'company_id': company.pk}, total=company.member_count, created_by_id=created_by_id,
+            )
+    return Job.objects.filter(kind='company.delete', payload__company_id=company.pk).order_by('-pk').first()
+
+
+def delete_company(job):
+    """
+    Job handler: delete a company's members COMPANY_DELETE_BATCH_SIZE at a time, then the company.
+
+    Each batch is its own transaction, so locks are held and rows loaded for
+    one batch only. After a crash the job starts over on whatever members
+    are left, keeping the count it had reached.
+    """
+    company_id = job.payload['company_id']
+    deleted = job.progress
+    while True:
+        with transaction.atomic(), deferred_stats(), deferred_tombstones():
+            users = list(
+                CustomUser.objects.filter(company_id=company_id)
+                .order_by('pk').only('id', 'company_id')[:settings.COMPANY_DELETE_BATCH_SIZE]
+            )
+            if not users:
+                break
+            # The deletion collector also removes the members' group,
+            # permission and admin log rows, and post_delete records the
+            # tombstones delta sync reports, inserted together at the end
+            CustomUser.objects.filter(pk__in=[user.pk for user in users]).delete()
+            publish_roster_events('user.deleted', users)
+            # Committed with the batch, so a resumed run counts from exactly
+            # what was deleted
+            deleted += len(users)
+            report_progress(job, deleted)
+        logger.info('%s: deleted %d of %s members', job, deleted, job.total)
+
+    # Only members added since the last batch are left to cascade
+    with transaction.atomic(), deferred_tombstones():
+        Company.objects.filter(pk=company_id).delete()
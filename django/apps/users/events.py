@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .cache import ALL_COMPANIES
+
+logger = logging.getLogger(__name__)
+
+# Events a subscriber may fall behind by before it is told to resync
+EVENT_QUEUE_SIZE = 256
+RESYNC_EVENT = {'type': 'resync'}
+
+
+def _deliver(queue, event):
+    # Runs on the subscriber's event loop
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        # A stalled client has missed events; drop the backlog and have it
+        # fetch the changes instead
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(RESYNC_EVENT)
+
+
+class Subscription:
+    def __init__(self, broker, scope):
+        self.broker = broker
+        self.scope = scope
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+
+    async def next(self, timeout):
+        """Return the next event, or None if none arrives within ``timeout`` seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """
+    Fan roster events out to subscribers in this process.
+
+    Subscribers are asyncio queues, so an idle connection costs a queue and
+    no thread. ``publish`` is safe to call from any thread, including the
+    sync views that produce the events.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, scope):
+        subscription = Subscription(self, scope)
+        with self._lock:
+            self._subscriptions.setdefault(scope, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.scope)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.scope]
+
+    def publish(self, scope, event):
+        self.deliver_local(scope, event)
+
+    def deliver_local(self, scope, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(scope, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(_deliver, subscription.queue, event)
+            except RuntimeError:
+                # The loop has closed; the subscriber is gone
+                self.unsubscribe(subscription)
+
+
+class RedisBroker(InProcessBroker):
+    """
+    Share roster events between nodes through Redis pub/sub.
+
+    Each process keeps one pattern subscription to Redis and fans incoming
+    events out locally, so Redis sees one connection per process rather
+    than one per client.
+    """
+    channel_prefix = 'roster-events:'
+
+    def __init__(self):
+        super().__init__()
+        import redis
+        self._client = redis.Redis.from_url(settings.REDIS_URL)
+        self._listener = None
+
+    def subscribe(self, scope):
+        subscription = super().subscribe(scope)
+        if self._listener is None or self._listener.done():
+            self._listener = subscription.loop.create_task(self._listen())
+        return subscription
+
+    def publish(self, scope, event):
+        self._client.publish(f'{self.channel_prefix}{scope}', json.dumps(event))
+
+    async def _listen(self):
+        import redis.asyncio
+        while True:
+            client = redis.asyncio.Redis.from_url(settings.REDIS_URL)
+            try:
+                pubsub = client.pubsub()
+                await pubsub.psubscribe(f'{self.channel_prefix}*')
+                async for message in pubsub.listen():
+                    if message['type'] != 'pmessage':
+                        continue
+                    scope = message['channel'].decode()[len(self.channel_prefix):]
+                    self.deliver_local(scope, json.loads(message['data']))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Roster event listener lost its Redis connection; reconnecting')
+                await asyncio.sleep(1)
+            finally:
+                await client.aclose()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.ROSTER_EVENT_BROKER)()
+        return _broker
+
+
+def publish_roster_events(event_type, users):
+    """
+    Broadcast a compact change event for ``users`` to each affected company's
+    stream and the superusers' stream once the current transaction commits.
+    """
+    by_company = {}
+    for user in users:
+        by_company.setdefault(user.company_id, []).append(user.pk)
+    events = [
+        (f'company:{company_id}', {'type': event_type, 'company_id': company_id, 'ids': ids})
+        for company_id, ids in by_company.items()
+    ]
+
+    def publish():
+        broker = get_broker()
+        for scope, event in events:
+            try:
+                broker.publish(scope, event)
+                broker.publish(ALL_COMPANIES, event)
+            except Exception:
+                # Live updates are best effort; the write has already committed
+                logger.exception('Could not publish roster event %s', event_type)
+
+    if events:
+        transaction.on_commit(publish)
@@ -0,0 +1,80 @@
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+
+# Below this many passwords the cost of shipping work to the pool outweighs
+# running make_password on the calling thread
+PARALLEL_THRESHOLD = 8
+# Largest chunk of passwords hashed between progress reports; at roughly
+# half a second a hash, one chunk stays well inside a job's lease
+MAX_CHUNK_SIZE = 64
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _init_worker(settings_module):
+    # Spawned workers start from a clean interpreter and need Django
+    # configured before make_password can read PASSWORD_HASHERS
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+def _hash_chunk(passwords):
+    return [make_password(password) for password in passwords]
+
+
+def get_worker_count():
+    workers = getattr(settings, 'PASSWORD_HASHING_WORKERS', 0)
+    return workers or os.cpu_count() or 1
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn rather than fork: the callers are often threaded (gunicorn
+            # threads, job workers) and forking those is not safe
+            _executor = ProcessPoolExecutor(
+                max_workers=get_worker_count(),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'backend.settings'),),
+            )
+            atexit.register(_executor.shutdown, wait=False, cancel_futures=True)
+        return _executor
+
+
+def hash_passwords(passwords, progress=None):
+    """
+    Return make_password() of every item in ``passwords``, preserving order.
+
+    Work is spread over a process pool sized by PASSWORD_HASHING_WORKERS so
+    large imports use every core. ``None`` entries produce unusable passwords
+    without touching the pool. ``progress``, if given, is called with the
+    number of passwords hashed so far after each chunk.
+    """
+    passwords = list(passwords)
+    to_hash = [index for index, password in enumerate(passwords) if password is not None]
+    hashed = [make_password(None) if password is None else None for password in passwords]
+
+    workers = get_worker_count()
+    parallel = workers > 1 and len(to_hash) >= PARALLEL_THRESHOLD
+    chunk_size = min(MAX_CHUNK_SIZE, max(1, -(-len(to_hash) // (workers * 4))))
+    chunks = [to_hash[start:start + chunk_size] for start in range(0, len(to_hash), chunk_size)]
+    run = _get_executor().map if parallel else map
+    results = run(_hash_chunk, [[passwords[index] for index in chunk] for chunk in chunks])
+    done = 0
+    for chunk, chunk_hashes in zip(chunks, results):
+        for index, password_hash in zip(chunk, chunk_hashes):
+            hashed[index] = password_hash
+        done += len(chunk)
+        if progress is not None:
+            progress(done)
+    return hashed
@@ -0,0 +1,257 @@
+import bisect
+import contextvars
+import heapq
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework import permissions, serializers
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in milliseconds of the latency histogram buckets
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float('inf'))
+SLOW_REQUEST_TOP_QUERIES = 5
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    __slots__ = ('started', 'query_count', 'query_time', 'slowest_queries', 'phases', 'staff')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.staff = False
+        self.query_count = 0
+        self.query_time = 0.0
+        self.slowest_queries = []
+        self.phases = {}
+
+    def add_query(self, sql, duration):
+        self.query_count += 1
+        self.query_time += duration
+        # A bounded min-heap keeps the slowest few without sorting every query
+        entry = (duration, self.query_count, sql)
+        if len(self.slowest_queries) < SLOW_REQUEST_TOP_QUERIES:
+            heapq.heappush(self.slowest_queries, entry)
+        elif duration > self.slowest_queries[0][0]:
+            heapq.heapreplace(self.slowest_queries, entry)
+
+    def add_phase(self, name, duration):
+        self.phases[name] = self.phases.get(name, 0.0) + duration
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to ``phase`` of the current request, if any."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_phase(phase, time.perf_counter() - started)
+
+
+def note_user(user):
+    """Record whether the current request is a staff member's, who may see its Server-Timing header."""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.staff = bool(getattr(user, 'is_staff', False))
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(sql, time.perf_counter() - started)
+
+
+def _install_query_recorder(connection, **kwargs):
+    # Installed once per connection object and left in place: it is a no-op
+    # outside an instrumented request, and being permanent means queries run
+    # from sync_to_async threads are counted too
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class LatencyHistogram:
+    """Per-route request counts bucketed by total time, kept in process memory."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def observe(self, route, duration_ms, query_count):
+        index = bisect.bisect_left(HISTOGRAM_BUCKETS_MS, duration_ms)
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = {'count': 0, 'total_ms': 0.0, 'queries': 0, 'buckets': [0] * len(HISTOGRAM_BUCKETS_MS)}
+            stats['count'] += 1
+            stats['total_ms'] += duration_ms
+            stats['queries'] += query_count
+            stats['buckets'][index] += 1
+
+    def snapshot(self):
+        with self._lock:
+            routes = {route: {**stats, 'buckets': list(stats['buckets'])} for route, stats in self._routes.items()}
+        bounds = ['+Inf' if bound == float('inf') else bound for bound in HISTOGRAM_BUCKETS_MS]
+        return {
+            route: {
+                'count': stats['count'],
+                'mean_ms': round(stats['total_ms'] / stats['count'], 3),
+                'mean_queries': round(stats['queries'] / stats['count'], 2),
+                'buckets': dict(zip(map(str, bounds), stats['buckets'])),
+            }
+            for route, stats in routes.items()
+        }
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+histogram = LatencyHistogram()
+
+
+class PerformanceMiddleware:
+    """
+    Time every request and report where the time went.
+
+    Feeds the in-process histogram and logs requests slower than
+    SLOW_REQUEST_THRESHOLD_MS with their slowest queries. Staff requests, or
+    every request with PERF_SERVER_TIMING on, also get a Server-Timing header
+    (db, auth, perm, ser and total); it tells anyone else too much about the
+    backend. Should sit first in MIDDLEWARE so ``total`` covers the whole
+    stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        connection_created.connect(_install_query_recorder)
+        for connection in connections.all(initialized_only=True):
+            _install_query_recorder(connection)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.report(request, response, metrics)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.report(request, response, metrics)
+        return response
+
+    def report(self, request, response, metrics):
+        total_ms = (time.perf_counter() - metrics.started) * 1000
+        db_ms = metrics.query_time * 1000
+        timings = [f'db;dur={db_ms:.2f};desc="{metrics.query_count} queries"']
+        timings.extend(f'{name};dur={duration * 1000:.2f}' for name, duration in metrics.phases.items())
+        timings.append(f'total;dur={total_ms:.2f}')
+        if settings.PERF_SERVER_TIMING or metrics.staff:
+            response['Server-Timing'] = ', '.join(timings)
+
+        match = request.resolver_match
+        if match:
+            # Router routes are regexes; drop the anchors for readable names
+            route = f"{request.method} /{match.route.replace('^', '').replace('$', '')}"
+        else:
+            route = f'{request.method} <unresolved>'
+        histogram.observe(route, total_ms, metrics.query_count)
+
+        if total_ms >= settings.SLOW_REQUEST_THRESHOLD_MS:
+            logger.warning('slow request %s', json.dumps({
+                'route': route,
+                'path': request.path,
+                'status': response.status_code,
+                'total_ms': round(total_ms, 2),
+                'db_ms': round(db_ms, 2),
+                'queries': metrics.query_count,
+                'phases_ms': {name: round(duration * 1000, 2) for name, duration in metrics.phases.items()},
+                'slowest_queries': [
+                    {'ms': round(duration * 1000, 2), 'sql': sql[:500]}
+                    for duration, _, sql in sorted(metrics.slowest_queries, reverse=True)
+                ],
+            }))
+
+
+class InstrumentedViewMixin:
+    """Attribute DRF authentication and permission time to the auth and perm phases."""
+
+    def perform_authentication(self, request):
+        with timed('auth'):
+            super().perform_authentication(request)
+        note_user(request.user)
+
+    def check_permissions(self, request):
+        with timed('perm'):
+            super().check_permissions(request)
+
+    def check_object_permissions(self, request, obj):
+        with timed('perm'):
+            super().check_object_permissions(request, obj)
+
+
+class TimedListSerializer(serializers.ListSerializer):
+    @property
+    def data(self):
+        with timed('ser'):
+            return super().data
+
+
+class TimedSerializerMixin:
+    """
+    Attribute time spent producing ``serializer.data`` to the ser phase.
+
+    Pair with ``list_serializer_class = TimedListSerializer`` in Meta so
+    many=True output is timed as well; nested serializers are covered by
+    their parent's timing.
+    """
+
+    @property
+    def data(self):
+        with timed('ser'):
+            return super().data
+
+
+class RequestMetricsView(APIView):
+    # Staff-only snapshot of the in-process latency histogram; ?reset=1
+    # clears it after reading
+    permission_classes = [permissions.IsAuthenticated, permissions.IsAdminUser]
+
+    def get(self, request):
+        data = histogram.snapshot()
+        if request.query_params.get('reset') in ('1', 'true'):
+            histogram.reset()
+        return Response(data)
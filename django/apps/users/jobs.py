@@ -0,0 +1,205 @@
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import APIException
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Handler for each job kind, called with the Job; it must be safe to run
+# again from the start after a crash. What it returns is stored as the
+# job's result, unless it recorded the outcome itself with complete_job().
+# An APIException (a validation or permission error) fails the job at once;
+# any other exception is retried.
+JOB_HANDLERS = {
+    'company.delete': 'apps.users.deletion.delete_company',
+    'users.bulk_create': 'apps.users.background.bulk_create',
+    'users.bulk_update': 'apps.users.background.bulk_update',
+    'users.bulk_delete': 'apps.users.background.bulk_delete',
+    'users.export': 'apps.users.background.export',
+}
+
+
+class JobRequest:
+    """Stands in for the request in serializer context when a job acts for a user."""
+
+    def __init__(self, user, method):
+        self.user = user
+        self.method = method
+
+
+def enqueue_job(kind, payload, total=None, created_by_id=None, secrets=None):
+    """
+    Queue a job of ``kind``; workers see it once the current transaction commits.
+
+    ``secrets`` are arguments the job needs but must not be kept, such as
+    passwords: they are cleared as soon as the job is done.
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind}')
+    return Job.objects.create(kind=kind, payload=payload, secrets=secrets, total=total, created_by_id=created_by_id)
+
+
+def split_rows(rows, field='password'):
+    """
+    Take ``field`` out of each row of ``rows``, for rows to queue without it.
+
+    Returns the rows without the field and, by position, the values taken
+    (None where a row had none), or None when no row had one. Anything
+    other than a list of objects is left for the handler to reject.
+    """
+    if not isinstance(rows, list):
+        return rows, None
+    values = [row.get(field) if isinstance(row, dict) else None for row in rows]
+    if all(value is None for value in values):
+        return rows, None
+    stripped = [
+        {key: value for key, value in row.items() if key != field} if isinstance(row, dict) else row
+        for row in rows
+    ]
+    return stripped, values
+
+
+def merge_rows(rows, values, field='password'):
+    """Put back into ``rows`` the values split_rows() took out of them."""
+    if not values:
+        return rows
+    return [
+        {**row, field: value} if value is not None else row
+        for row, value in zip(rows, values)
+    ]
+
+
+def _lease_expiry():
+    return timezone.now() + timedelta(seconds=settings.JOB_LEASE_SECONDS)
+
+
+def retry_delay(attempts):
+    """Seconds to wait before attempt ``attempts + 1``: exponential, with jitter so retries spread out."""
+    delay = settings.JOB_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1)
+    return delay * random.uniform(0.5, 1.5)
+
+
+def claim_job():
+    """
+    Take the oldest job that is due, or a running one whose worker stopped renewing its lease.
+
+    Workers skip rows another worker has locked instead of waiting on them.
+    Returns None when there is nothing to run.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status=Job.QUEUED, run_after__isnull=True)
+                | Q(status=Job.QUEUED, run_after__lte=now)
+                | Q(status=Job.RUNNING, locked_until__lt=now)
+            )
+            .order_by('pk')
+        )
+        for job in jobs[:10]:
+            if job.status == Job.RUNNING:
+                if job.attempts >= settings.JOB_MAX_ATTEMPTS:
+                    # Its worker died on every attempt; don't take another one down
+                    logger.error('Giving up on %s after its worker stopped %d times', job, job.attempts)
+                    job.status = Job.FAILED
+                    job.error = 'The worker stopped while running the job.'
+                    job.finished_at = now
+                    job.locked_until = None
+                    job.secrets = None
+                    job.save(update_fields=['status', 'error', 'finished_at', 'locked_until', 'secrets'])
+                    continue
+                logger.warning('Resuming %s after its lease expired', job)
+            job.status = Job.RUNNING
+            job.attempts += 1
+            job.started_at = job.started_at or now
+            job.locked_until = _lease_expiry()
+            job.save(update_fields=['status', 'attempts', 'started_at', 'locked_until'])
+            return job
+    return None
+
+
+def report_progress(job, progress, total=None):
+    """
+    Record ``progress`` and renew the job's lease; handlers call this after each step.
+
+    A step must take well under JOB_LEASE_SECONDS, or another worker takes
+    the job over while it still runs. Calls made inside a transaction only
+    renew the lease once it commits.
+    """
+    job.progress = progress
+    if total is not None:
+        job.total = total
+    job.locked_until = _lease_expiry()
+    Job.objects.filter(pk=job.pk).update(progress=job.progress, total=job.total, locked_until=job.locked_until)
+
+
+def complete_job(job, result, progress=None):
+    """
+    Record ``job`` as succeeded with ``result``, in the caller's transaction.
+
+    A handler whose writes must not be made twice calls this inside the
+    transaction that makes them: if the worker then dies before run_job()
+    saves the outcome, the job is already finished instead of being run
+    again when its lease expires.
+    """
+    if progress is not None:
+        job.progress = progress
+    job.status = Job.SUCCEEDED
+    job.result = result
+    job.error = ''
+    job.finished_at = timezone.now()
+    job.locked_until = None
+    job.run_after = None
+    job.secrets = None
+    job.save(update_fields=['status', 'result', 'error', 'progress', 'finished_at', 'locked_until', 'run_after', 'secrets'])
+
+
+def run_job(job):
+    """Run ``job``'s handler and record the outcome, queueing a retry if it failed and has attempts left."""
+    handler = import_string(JOB_HANDLERS[job.kind])
+    fields = ['status', 'result', 'error', 'finished_at', 'locked_until', 'run_after']
+    job.locked_until = None
+    try:
+        result = handler(job)
+    except APIException as e:
+        logger.info('%s was rejected: %s', job, e.detail)
+        job.status = Job.FAILED
+        job.result = e.detail
+        job.error = str(e.default_detail if isinstance(e.detail, (dict, list)) else e.detail)
+    except Exception as e:
+        if Job.objects.filter(pk=job.pk, status=Job.SUCCEEDED).exists():
+            # It failed after complete_job() committed; the work is done
+            logger.warning('%s failed after recording its outcome', job, exc_info=True)
+            job.refresh_from_db()
+            return job
+        job.error = f'{type(e).__name__}: {e}'
+        if job.attempts < settings.JOB_MAX_ATTEMPTS:
+            delay = retry_delay(job.attempts)
+            logger.warning('%s failed on attempt %d; retrying in %.0fs', job, job.attempts, delay, exc_info=True)
+            job.status = Job.QUEUED
+            job.run_after = timezone.now() + timedelta(seconds=delay)
+            job.save(update_fields=fields)
+            return job
+        logger.exception('%s failed on its last attempt', job)
+        job.status = Job.FAILED
+    else:
+        if job.status == Job.SUCCEEDED:
+            # Recorded by the handler with complete_job()
+            return job
+        job.status = Job.SUCCEEDED
+        job.result = result
+        job.error = ''
+    job.finished_at = timezone.now()
+    job.run_after = None
+    job.secrets = None
+    job.save(update_fields=[*fields, 'secrets'])
+    return job
@@ -0,0 +1,166 @@
+import io
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .cache import bump_roster_versions
+from .models import Company, CustomUser
+from .stats import recount_company_stats
+
+LOAD_TEST_PASSWORD = 'password'
+FIRST_NAMES = ['Ayla', 'Sam', 'Chris', 'Pat', 'Jordan', 'Reshav', 'Adam', 'Sol', 'Maria', 'Wei', 'Fatima', 'Ivan', 'Noor', 'Diego', 'Kenji']
+LAST_NAMES = ['Pham', 'Miller', 'Wilson', 'Moore', 'Taylor', 'Singla', 'Stepinski', 'Tran', 'Garcia', 'Chen', 'Khan', 'Petrov', 'Okafor', 'Silva', 'Sato']
+
+# Columns written for every generated user, in COPY order
+COPY_COLUMNS = (
+    'password', 'is_superuser', 'username', 'first_name', 'last_name', 'email', 'is_staff',
+    'is_active', 'date_joined', 'company_id', 'role', 'phone_number', 'token_version', 'updated_at',
+)
+
+
+def company_name(index):
+    return f'Load Test Company {index:05d}'
+
+
+def company_sizes(companies, users, distribution, skew):
+    """
+    Split ``users`` over ``companies`` and return one size per company, largest first.
+
+    zipf gives company i a share proportional to 1 / (i + 1) ** skew, which
+    matches the long tail seen in production: a few very large tenants and
+    many small ones. Every company gets at least one member.
+    """
+    if distribution == 'uniform':
+        weights = [1.0] * companies
+    else:
+        weights = [1.0 / (index + 1) ** skew for index in range(companies)]
+    spare = max(users - companies, 0)
+    total = sum(weights)
+    sizes = [1 + int(spare * weight / total) for weight in weights]
+    # Hand out what rounding down left over, starting with the largest
+    for index in range(users - sum(sizes)):
+        sizes[index % companies] += 1
+    return sizes
+
+
+def _generate_users(company_index, company_id, start, size, seed, admin_ratio, password, joined):
+    # Each company has its own RNG so a resumed run regenerates exactly the
+    # rows it has not inserted yet
+    rng = random.Random(f'{seed}:{company_index}')
+    for member in range(size):
+        first_name = rng.choice(FIRST_NAMES)
+        last_name = rng.choice(LAST_NAMES)
+        is_admin = member == 0 or rng.random() < admin_ratio
+        phone_number = f'+1{rng.randint(1000000000, 9999999999)}'
+        if member < start:
+            continue
+        username = f'lt{company_index:05d}_{member}'
+        yield CustomUser(
+            password=password,
+            is_superuser=False,
+            username=username,
+            first_name=first_name,
+            last_name=last_name,
+            email=f'{username}@company{company_index:05d}.example.com',
+            is_staff=False,
+            is_active=True,
+            date_joined=joined,
+            company_id=company_id,
+            role='admin' if is_admin else 'regular',
+            phone_number=phone_number,
+            token_version=0,
+            updated_at=joined,
+        )
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def _insert_batch(batch):
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            buffer = io.StringIO()
+            for user in batch:
+                buffer.write('\t'.join(_copy_value(getattr(user, column)) for column in COPY_COLUMNS))
+                buffer.write('\n')
+            buffer.seek(0)
+            with connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f'COPY {CustomUser._meta.db_table} ({", ".join(COPY_COLUMNS)}) FROM STDIN',
+                    buffer,
+                )
+        else:
+            CustomUser.objects.bulk_create(batch, batch_size=1000)
+
+
+def generate_load_test_data(companies, users, distribution, skew, admin_ratio, seed, batch_size, stdout):
+    """
+    Create a synthetic dataset of ``companies`` companies and ``users`` members.
+
+    The data is fully determined by the arguments, so running again with the
+    same ones is a no-op and an interrupted run resumes where it stopped:
+    each batch commits on its own and each company continues from the
+    members it already has. All users share one precomputed password hash.
+    """
+    started = time.perf_counter()
+    names = [company_name(index) for index in range(companies)]
+    Company.objects.bulk_create([Company(name=name) for name in names], batch_size=batch_size, ignore_conflicts=True)
+    company_ids = dict(Company.objects.filter(name__in=names).values_list('name', 'id'))
+    existing = dict(
+        CustomUser.objects.filter(company_id__in=company_ids.values())
+        .values('company_id').annotate(members=Count('id')).values_list('company_id', 'members')
+    )
+
+    sizes = company_sizes(companies, users, distribution, skew)
+    remaining = sum(max(size - existing.get(company_ids[name], 0), 0) for name, size in zip(names, sizes))
+    stdout.write(
+        f'{companies} companies, {users} users ({distribution}); '
+        f'{users - remaining} already present, {remaining} to insert'
+    )
+    if not remaining:
+        return
+
+    password = make_password(LOAD_TEST_PASSWORD)
+    joined = timezone.now()
+    inserted = 0
+    batch = []
+    touched = set()
+
+    def flush():
+        nonlocal inserted, batch
+        _insert_batch(batch)
+        inserted += len(batch)
+        batch = []
+        elapsed = time.perf_counter() - started
+        stdout.write(f'  {inserted}/{remaining} users, {inserted / elapsed:,.0f} rows/s')
+
+    for index, (name, size) in enumerate(zip(names, sizes)):
+        company_id = company_ids[name]
+        start = existing.get(company_id, 0)
+        if start >= size:
+            continue
+        touched.add(company_id)
+        for user in _generate_users(index, company_id, start, size, seed, admin_ratio, password, joined):
+            batch.append(user)
+            if len(batch) >= batch_size:
+                flush()
+    if batch:
+        flush()
+
+    # Inserted rows bypass save(), so invalidate the cached rosters and
+    # count the members here
+    bump_roster_versions(touched)
+    recount_company_stats(touched)
+    elapsed = time.perf_counter() - started
+    stdout.write(f'Inserted {inserted} users in {elapsed:.1f}s ({inserted / elapsed:,.0f} rows/s)')
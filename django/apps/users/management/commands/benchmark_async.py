@@ -0,0 +1,206 @@
+import asyncio
+import itertools
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.users.authentication import TeamRefreshToken
+from apps.users.models import CustomUser
+
+# How each stack is served: sync views on threads behind WSGI, the async
+# read views behind ASGI, and for reference the sync views behind ASGI
+SERVERS = {
+    'wsgi': {
+        'args': ['backend.wsgi:application', '--worker-class', 'gthread'],
+        'env': {'ASYNC_READ_VIEWS': 'False'},
+    },
+    'asgi': {
+        'args': ['backend.asgi:application', '--worker-class', 'uvicorn.workers.UvicornWorker'],
+        'env': {'ASYNC_READ_VIEWS': 'True'},
+    },
+    'asgi-sync': {
+        'args': ['backend.asgi:application', '--worker-class', 'uvicorn.workers.UvicornWorker'],
+        'env': {'ASYNC_READ_VIEWS': 'False'},
+    },
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares read throughput of the sync views under WSGI with the async views under ASGI at '
+        'high concurrency. Starts a gunicorn server for each stack against the configured database, '
+        'which must hold the setup_test_data --companies dataset.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=200, help='Concurrent keep-alive connections')
+        parser.add_argument('--requests', type=int, default=4000, help='Timed requests per route and server')
+        parser.add_argument('--workers', type=int, default=1, help='gunicorn worker processes per server')
+        parser.add_argument('--threads', type=int, default=16, help='Threads per WSGI worker')
+        parser.add_argument('--routes', default='', help='Comma-separated subset of routes to run')
+
+    def handle(self, *args, **options):
+        routes = self.routes()
+        if options['routes']:
+            names = options['routes'].split(',')
+            unknown = set(names) - set(routes)
+            if unknown:
+                raise CommandError(f'Unknown route(s): {", ".join(sorted(unknown))}')
+            routes = {name: routes[name] for name in names}
+
+        results = {}
+        for server in SERVERS:
+            port = self.free_port()
+            process = self.start_server(server, port, options['workers'], options['threads'])
+            try:
+                self.wait_for_port(port, process)
+                for name, (path_for, token) in routes.items():
+                    results[name, server] = asyncio.run(
+                        self.load(port, path_for, token, options['concurrency'], options['requests'])
+                    )
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+
+        self.stdout.write(
+            f'\n{options["concurrency"]} connections, {options["requests"]} requests, '
+            f'{options["workers"]} worker(s), {options["threads"]} WSGI threads'
+        )
+        self.stdout.write(f'{"route":<22}{"server":<11}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"errors":>8}')
+        for name in routes:
+            for server in SERVERS:
+                result = results[name, server]
+                self.stdout.write(
+                    f'{name:<22}{server:<11}{result["throughput"]:>10.1f}{result["p50"]:>10.2f}'
+                    f'{result["p95"]:>10.2f}{result["p99"]:>10.2f}{result["errors"]:>8}'
+                )
+            ratio = results[name, 'asgi']['throughput'] / results[name, 'wsgi']['throughput']
+            self.stdout.write(f'{"":<22}{"asgi/wsgi throughput":<33}{ratio:>8.2f}x')
+
+    def routes(self):
+        # Company 0 of the load test dataset is the largest; its member 0 is an admin
+        try:
+            admin = CustomUser.objects.get(username='lt00000_0')
+            member = CustomUser.objects.get(username='lt00000_1')
+        except CustomUser.DoesNotExist:
+            raise CommandError('No load test data; run setup_test_data --companies first.')
+        superuser = CustomUser.objects.filter(is_superuser=True, is_staff=True).first()
+        if superuser is None:
+            raise CommandError('No staff superuser to list companies with.')
+        admin_token = str(TeamRefreshToken.for_user(admin).access_token)
+        superuser_token = str(TeamRefreshToken.for_user(superuser).access_token)
+
+        # A unique query string gets past the roster cache, so the request
+        # reaches the database every time
+        return {
+            'users-list': (lambda n: f'/api/users/?n={n}', admin_token),
+            'users-list-cached': (lambda n: '/api/users/', admin_token),
+            'users-detail': (lambda n: f'/api/users/{member.pk}/?n={n}', admin_token),
+            'current-user-role': (lambda n: '/api/users/current_user_role/', admin_token),
+            'companies-list': (lambda n: '/api/companies/', superuser_token),
+        }
+
+    def start_server(self, server, port, workers, threads):
+        command = [
+            sys.executable, '-m', 'gunicorn', *SERVERS[server]['args'],
+            '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--threads', str(threads),
+            '--backlog', '4096', '--log-level', 'warning',
+        ]
+        env = {**os.environ, **SERVERS[server]['env']}
+        return subprocess.Popen(command, cwd=settings.BASE_DIR, env=env)
+
+    def free_port(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    def wait_for_port(self, port, process, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f'Server exited with status {process.returncode}')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f'Server did not start listening on port {port}')
+
+    async def load(self, port, path_for, token, concurrency, total):
+        # Warm every worker and connection up before timing
+        await self.drive(port, path_for, token, concurrency, concurrency * 2, [])
+        timings = []
+        started = time.perf_counter()
+        errors = await self.drive(port, path_for, token, concurrency, total, timings)
+        elapsed = time.perf_counter() - started
+
+        cut_points = statistics.quantiles(timings, n=100, method='inclusive') if len(timings) > 1 else [0.0] * 99
+        return {
+            'throughput': len(timings) / elapsed,
+            'p50': cut_points[49],
+            'p95': cut_points[94],
+            'p99': cut_points[98],
+            'errors': errors,
+        }
+
+    async def drive(self, port, path_for, token, concurrency, total, timings):
+        counter = itertools.count()
+        errors = 0
+
+        async def connection():
+            nonlocal errors
+            reader = writer = None
+            while (number := next(counter)) < total:
+                request = (
+                    f'GET {path_for(number)} HTTP/1.1\r\nHost: localhost\r\n'
+                    f'Authorization: Bearer {token}\r\nAccept: application/json\r\n\r\n'
+                ).encode()
+                started = time.perf_counter()
+                try:
+                    if writer is None:
+                        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                    writer.write(request)
+                    await writer.drain()
+                    status_code, keep_alive = await self.read_response(reader)
+                except (OSError, asyncio.IncompleteReadError, ValueError):
+                    errors += 1
+                    if writer is not None:
+                        writer.close()
+                    reader = writer = None
+                    continue
+                timings.append((time.perf_counter() - started) * 1000)
+                if status_code >= 400:
+                    errors += 1
+                if not keep_alive:
+                    writer.close()
+                    reader = writer = None
+            if writer is not None:
+                writer.close()
+
+        await asyncio.gather(*(connection() for _ in range(concurrency)))
+        return errors
+
+    async def read_response(self, reader):
+        head = await reader.readuntil(b'\r\n\r\n')
+        status_line, *header_lines = head.decode('latin-1').split('\r\n')
+        headers = {}
+        for line in header_lines:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip().lower()
+
+        if headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            await reader.readexactly(int(headers.get('content-length', 0)))
+        return int(status_line.split()[1]), headers.get('connection') != 'close'
@@ -0,0 +1,183 @@
+import json
+import statistics
+import time
+from pathlib import Path
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from rest_framework.test import APIClient
+
+from apps.users.loadtest import LOAD_TEST_PASSWORD, generate_load_test_data
+from apps.users.models import CustomUser
+
+DEFAULT_BUDGETS = Path(__file__).resolve().parents[2] / 'benchmark_budgets.json'
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks every users/companies/token route, and the users admin changelist, against '
+        'seeded datasets of increasing size in a throwaway test database, and fails when a route '
+        'exceeds its budget.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000',
+                            help='Comma-separated user counts to seed and benchmark, in increasing order')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed requests per route and size')
+        parser.add_argument('--budgets', default=str(DEFAULT_BUDGETS), help='JSON file of per-route budgets')
+        parser.add_argument('--no-budgets', action='store_true', help='Report only; do not enforce budgets')
+        parser.add_argument('--keepdb', action='store_true', help='Reuse the test database between runs')
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        budgets = {} if options['no_budgets'] else json.loads(Path(options['budgets']).read_text())
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            failures = []
+            for size in sizes:
+                failures.extend(self.run_size(size, options['iterations'], budgets))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        if failures:
+            raise CommandError('Over budget:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('All routes within budget' if budgets else 'Done'))
+
+    def run_size(self, size, iterations, budgets):
+        generate_load_test_data(
+            companies=max(1, size // 100), users=size, distribution='zipf', skew=1.1,
+            admin_ratio=0.05, seed=0, batch_size=10000, stdout=self.stdout,
+        )
+        self.stdout.write(f'\n== {CustomUser.objects.count()} users ==')
+        self.stdout.write(f'{"route":<24}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"queries":>9}')
+
+        failures = []
+        for name, route in self.routes().items():
+            result = self.measure(route, iterations)
+            self.stdout.write(
+                f'{name:<24}{result["throughput"]:>10.1f}{result["p50"]:>10.2f}'
+                f'{result["p95"]:>10.2f}{result["p99"]:>10.2f}{result["queries"]:>9}'
+            )
+            budget = budgets.get(name)
+            if budget is None:
+                continue
+            if result['queries'] > budget['queries']:
+                failures.append(f'{name} @ {size} users: {result["queries"]} queries (budget {budget["queries"]})')
+            if result['p95'] > budget['p95_ms']:
+                failures.append(f'{name} @ {size} users: p95 {result["p95"]:.2f} ms (budget {budget["p95_ms"]} ms)')
+        return failures
+
+    def measure(self, route, iterations):
+        prepare, send = route
+        for _ in range(3):
+            send(prepare())
+
+        timings = []
+        queries = 0
+        started = time.perf_counter()
+        for _ in range(iterations):
+            argument = prepare()
+            with CaptureQueriesContext(connection) as captured:
+                request_started = time.perf_counter()
+                response = send(argument)
+                timings.append((time.perf_counter() - request_started) * 1000)
+            if response.status_code >= 400:
+                raise CommandError(f'{response.request["PATH_INFO"]} returned {response.status_code}: {response.content[:200]}')
+            queries = max(queries, len(captured))
+        elapsed = time.perf_counter() - started
+
+        cut_points = statistics.quantiles(timings, n=100, method='inclusive')
+        return {
+            'throughput': iterations / elapsed,
+            'p50': cut_points[49],
+            'p95': cut_points[94],
+            'p99': cut_points[98],
+            'queries': queries,
+        }
+
+    def routes(self):
+        # Company 0 is the largest; its member 0 is always an admin
+        admin = CustomUser.objects.get(username='lt00000_0')
+        member = CustomUser.objects.get(username='lt00000_1')
+        superuser, _ = CustomUser.objects.get_or_create(
+            username='bench_superuser',
+            defaults={'password': admin.password, 'is_superuser': True, 'is_staff': True, 'role': 'admin'},
+        )
+
+        def client_for(user):
+            client = APIClient()
+            tokens = client.post('/api/token/', {'username': user.username, 'password': LOAD_TEST_PASSWORD}, format='json').data
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens["access"]}')
+            return client, tokens['refresh']
+
+        admin_client, refresh = client_for(admin)
+        superuser_client, _ = client_for(superuser)
+        staff_client = Client()
+        staff_client.force_login(superuser)
+        anonymous = APIClient()
+        counter = iter(range(10 ** 9))
+
+        def nothing():
+            return None
+
+        def cold():
+            # Drop cached rosters and auth state so the request does its full work
+            cache.clear()
+
+        def disposable_member():
+            number = next(counter)
+            return CustomUser.objects.create(
+                username=f'bench_delete_{number}', company_id=admin.company_id, password=admin.password,
+            ).pk
+
+        return {
+            'users-list': (cold, lambda _: admin_client.get('/api/users/')),
+            'users-list-cached': (nothing, lambda _: admin_client.get('/api/users/')),
+            'users-list-superuser': (cold, lambda _: superuser_client.get('/api/users/')),
+            'users-detail': (cold, lambda _: admin_client.get(f'/api/users/{member.pk}/')),
+            'users-create': (
+                lambda: next(counter),
+                lambda number: admin_client.post(
+                    '/api/users/', {'first_name': f'Bench{number}', 'last_name': 'Create'}, format='json'),
+            ),
+            'users-patch': (
+                lambda: next(counter),
+                lambda number: admin_client.patch(f'/api/users/{member.pk}/', {'first_name': f'Bench{number}'}, format='json'),
+            ),
+            'users-delete': (disposable_member, lambda pk: admin_client.delete(f'/api/users/{pk}/')),
+            'current-user-role': (nothing, lambda _: admin_client.get('/api/users/current_user_role/')),
+            'update-own-profile': (
+                lambda: next(counter),
+                lambda number: admin_client.patch(
+                    f'/api/users/{admin.pk}/update_own_profile/', {'last_name': f'Bench{number}'}, format='json'),
+            ),
+            'batch-startup': (
+                cold,
+                lambda _: admin_client.post('/api/batch/', {'requests': [
+                    {'path': '/api/users/current_user_role/'},
+                    {'path': '/api/users/'},
+                    {'path': f'/api/users/{member.pk}/'},
+                ]}, format='json'),
+            ),
+            'companies-list': (nothing, lambda _: superuser_client.get('/api/companies/')),
+            'companies-stats': (nothing, lambda _: superuser_client.get('/api/companies/stats/')),
+            'audit-events': (nothing, lambda _: admin_client.get('/api/audit-events/')),
+            'admin-users': (nothing, lambda _: staff_client.get('/admin/users/customuser/')),
+            'admin-users-company': (
+                nothing, lambda _: staff_client.get(f'/admin/users/customuser/?company={admin.company_id}')),
+            'admin-users-role': (nothing, lambda _: staff_client.get('/admin/users/customuser/?role__exact=admin')),
+            'admin-users-search': (nothing, lambda _: staff_client.get(f'/admin/users/customuser/?q={member.username}')),
+            'admin-user-change': (nothing, lambda _: staff_client.get(f'/admin/users/customuser/{member.pk}/change/')),
+            'token-obtain': (
+                nothing,
+                lambda _: anonymous.post('/api/token/', {'username': admin.username, 'password': LOAD_TEST_PASSWORD}, format='json'),
+            ),
+            'token-refresh': (nothing, lambda _: anonymous.post('/api/token/refresh/', {'refresh': refresh}, format='json')),
+        }
@@ -0,0 +1,99 @@
+import io
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.text import compress_string
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from apps.users.compression import BROTLI_QUALITY, brotli
+from apps.users.loadtest import FIRST_NAMES, LAST_NAMES, company_name
+from apps.users.models import Company, CustomUser
+from apps.users.renderers import FastJSONParser, FastJSONRenderer, orjson, stream_json_list
+from apps.users.serializers import CustomUserSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures how long a roster of --sizes members takes to render and parse with DRF\'s '
+        'JSON renderer and parser and with the fast ones the API uses, and how many bytes it '
+        'takes on the wire uncompressed, gzipped and brotli-compressed. Needs no database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000', help='Comma-separated roster sizes to measure')
+        parser.add_argument('--iterations', type=int, default=20, help='Timed runs per measurement')
+
+    def handle(self, *args, **options):
+        backend = f'orjson {orjson.__version__}' if orjson is not None else 'stdlib json (orjson not installed)'
+        self.stdout.write(f'JSON backend: {backend}; brotli: {"installed" if brotli else "not installed"}')
+        for size in sorted(int(size) for size in options['sizes'].split(',')):
+            self.run_size(size, options['iterations'])
+
+    def run_size(self, size, iterations):
+        data = CustomUserSerializer(self.roster(size), many=True).data
+        rendered = JSONRenderer().render(data)
+
+        self.stdout.write(f'\n== {size} members ==')
+        self.stdout.write(f'{"step":<32}{"median ms":>12}{"bytes":>14}')
+
+        def row(step, seconds, size_bytes=None):
+            time_text = f'{seconds * 1000:.2f}' if seconds is not None else ''
+            size_text = f'{size_bytes:,}' if size_bytes is not None else ''
+            self.stdout.write(f'{step:<32}{time_text:>12}{size_text:>14}')
+
+        row('render JSONRenderer', self.measure(lambda: JSONRenderer().render(data), iterations), len(rendered))
+        fast = FastJSONRenderer().render(data)
+        row('render FastJSONRenderer', self.measure(lambda: FastJSONRenderer().render(data), iterations), len(fast))
+        chunks = []
+
+        def stream():
+            chunks[:] = stream_json_list(data)
+
+        row('render streamed', self.measure(stream, iterations), sum(map(len, chunks)))
+        row('  largest chunk held', None, max(map(len, chunks)))
+
+        row('parse JSONParser', self.measure(lambda: JSONParser().parse(io.BytesIO(rendered)), iterations))
+        row('parse FastJSONParser', self.measure(lambda: FastJSONParser().parse(io.BytesIO(rendered)), iterations))
+
+        row('wire identity', None, len(fast))
+        # What CompressionMiddleware sends: gzip through GZipMiddleware's helper
+        gzipped = compress_string(fast, max_random_bytes=100)
+        row('wire gzip', self.measure(lambda: compress_string(fast, max_random_bytes=100), iterations), len(gzipped))
+        if brotli is not None:
+            compressed = brotli.compress(fast, quality=BROTLI_QUALITY)
+            row(f'wire br (quality {BROTLI_QUALITY})',
+                self.measure(lambda: brotli.compress(fast, quality=BROTLI_QUALITY), iterations), len(compressed))
+
+    def measure(self, run, iterations):
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings)
+
+    def roster(self, size):
+        # Unsaved members shaped like the load-test data; serializing them
+        # needs no queries
+        rng = random.Random(0)
+        company = Company(pk=1, name=company_name(0))
+        joined = timezone.now()
+        members = []
+        for member in range(size):
+            username = f'lt00000_{member}'
+            members.append(CustomUser(
+                pk=member + 1,
+                username=username,
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                email=f'{username}@company00000.example.com',
+                phone_number=f'+1{rng.randint(1000000000, 9999999999)}',
+                role='admin' if member == 0 or rng.random() < 0.05 else 'regular',
+                company=company,
+                date_joined=joined,
+            ))
+        return members
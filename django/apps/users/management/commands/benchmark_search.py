@@ -0,0 +1,45 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from apps.users.models import CustomUser
+from apps.users.search import SEARCH_DEFAULT_LIMIT, search_team_members
+
+
+class Command(BaseCommand):
+    help = 'Times team member search against the current database and checks that the search indexes are used'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, help='Company id to search in (default: the largest company)')
+        parser.add_argument('--runs', type=int, default=200, help='Timed runs per query')
+        parser.add_argument('queries', nargs='*', default=['sa', 'mil', 'jordn', 'user1', '+1555'])
+
+    def handle(self, *args, **options):
+        company_id = options['company']
+        if company_id is None:
+            largest = (
+                CustomUser.objects.exclude(company_id=None)
+                .values('company_id').annotate(members=Count('id')).order_by('-members').first()
+            )
+            if largest is None:
+                raise CommandError('No team members to search; seed some data first.')
+            company_id = largest['company_id']
+        queryset = CustomUser.objects.filter(company_id=company_id)
+        self.stdout.write(f'Searching company {company_id} ({queryset.count()} members)')
+
+        plan = search_team_members(queryset, options['queries'][0], SEARCH_DEFAULT_LIMIT).explain()
+        self.stdout.write(f'\nPlan for {options["queries"][0]!r}:\n{plan}\n')
+        if 'users_search_' not in plan:
+            raise CommandError('The search query does not use the users_search_* indexes.')
+
+        for query in options['queries']:
+            timings = []
+            for _ in range(options['runs']):
+                start = time.perf_counter()
+                list(search_team_members(queryset, query, SEARCH_DEFAULT_LIMIT))
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+            self.stdout.write(f'{query!r:>12}: p50 {statistics.median(timings):.2f} ms, p99 {p99:.2f} ms')
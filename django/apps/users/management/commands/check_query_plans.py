@@ -0,0 +1,107 @@
+import re
+from types import SimpleNamespace
+
+from django.contrib.admin import site as admin_site
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+
+from apps.users.export import roster_export_queryset
+from apps.users.models import CustomUser
+from apps.users.pagination import TeamMemberCursorPagination
+from apps.users.search import SEARCH_DEFAULT_LIMIT, match_team_members, search_team_members
+from apps.users.sync import SYNC_PAGE_SIZE
+from apps.users.views import CustomUserViewSet
+
+# "Seq Scan on users_customuser" on PostgreSQL, a bare "SCAN users_customuser"
+# (no index) on SQLite
+SEQUENTIAL_SCAN = re.compile(
+    r'Seq Scan on "?users_customuser"?|\bSCAN users_customuser\s*$',
+    re.MULTILINE,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs EXPLAIN on the queries behind CustomUserViewSet and the users admin changelist, and fails if any of them '
+        'scans the users table sequentially. Run it against a large seeded dataset: on a '
+        'small table the planner rightly prefers sequential scans.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-rows', type=int, default=100000,
+                            help='Warn when the users table is smaller than this')
+        parser.add_argument('--show-plans', action='store_true', help='Print every plan, not only failures')
+
+    def handle(self, *args, **options):
+        total = CustomUser.objects.count()
+        if total < options['min_rows']:
+            self.stdout.write(self.style.WARNING(
+                f'Only {total} users; plans may not reflect a large dataset (--min-rows {options["min_rows"]}).'
+            ))
+
+        failures = []
+        for name, queryset in self.viewset_queries():
+            plan = queryset.explain()
+            failed = SEQUENTIAL_SCAN.search(plan) is not None
+            if failed:
+                failures.append(name)
+            if failed or options['show_plans']:
+                self.stdout.write(f'\n{name}:\n{plan}')
+            status = self.style.ERROR('SEQ SCAN') if failed else self.style.SUCCESS('ok')
+            self.stdout.write(f'{status:>10}  {name}')
+
+        if failures:
+            raise CommandError(f'Sequential scan on users_customuser in: {", ".join(failures)}')
+
+    def viewset_queries(self):
+        largest = (
+            CustomUser.objects.exclude(company_id=None)
+            .values('company_id').annotate(members=Count('id')).order_by('-members').first()
+        )
+        if largest is None:
+            raise CommandError('No team members to check; seed some data first.')
+        company_id = largest['company_id']
+        admin = CustomUser(company_id=company_id, role='admin', is_superuser=False)
+        superuser = CustomUser(role='admin', is_superuser=True)
+        sample = CustomUser.objects.filter(company_id=company_id).order_by('id')
+        sample_ids = list(sample.values_list('id', flat=True)[:50])
+        middle = sample[len(sample_ids) // 2]
+
+        pagination = TeamMemberCursorPagination()
+        ordering = list(pagination.ordering)
+        reverse_ordering = [f'-{field}' for field in ordering]
+        position = pagination.get_position(middle)
+        page = pagination.page_size + 1
+
+        for label, user in (('company admin', admin), ('superuser', superuser)):
+            view = CustomUserViewSet()
+            view.request = SimpleNamespace(user=user)
+            queryset = view.get_queryset()
+            yield f'list first page ({label})', queryset.order_by(*ordering)[:page]
+            yield f'list next page ({label})', queryset.order_by(*ordering).filter(pagination.seek_filter(position, False))[:page]
+            yield f'list previous page ({label})', queryset.order_by(*reverse_ordering).filter(pagination.seek_filter(position, True))[:page]
+
+        view = CustomUserViewSet()
+        view.request = SimpleNamespace(user=admin)
+        queryset = view.get_queryset()
+        yield 'retrieve', queryset.filter(pk=middle.pk)
+        yield 'bulk targets', queryset.filter(pk__in=sample_ids)
+        yield 'role filter', queryset.filter(role='admin')
+        yield 'active members', queryset.filter(is_active=True)
+        yield 'search', search_team_members(queryset, middle.last_name[:3] or 'a', SEARCH_DEFAULT_LIMIT)
+        yield 'export', roster_export_queryset(queryset)
+        yield 'delta sync', queryset.filter(updated_at__gt=middle.updated_at).order_by('updated_at', 'id')[:SYNC_PAGE_SIZE + 1]
+        yield 'auth state', CustomUser.objects.filter(pk=middle.pk).values_list('token_version', 'is_active')
+
+        # The admin changelist pages through every company in its ordering
+        model_admin = admin_site._registry[CustomUser]
+        changelist = CustomUser.objects.select_related(*model_admin.list_select_related).order_by(*model_admin.ordering)
+        page = model_admin.list_per_page
+        yield 'admin changelist', changelist[:page]
+        yield 'admin company filter', changelist.filter(company_id=company_id)[:page]
+        yield 'admin role filter', changelist.filter(role='admin')[:page]
+        if connection.vendor == 'postgresql':
+            # Elsewhere the search indexes lead with company_id, so only
+            # company-scoped searches can use them
+            yield 'admin search', match_team_members(changelist, middle.last_name[:3] or 'a')[:page]
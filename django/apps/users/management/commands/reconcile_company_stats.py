@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from apps.users.stats import RECOUNT_BATCH_SIZE, recount_company_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Recounts the headcount and role counters of every company, or of those given with --company, '
+        'and corrects any that have drifted from the members actually stored.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, action='append', dest='companies', help='Company id; repeat for several')
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without correcting it')
+        parser.add_argument('--batch-size', type=int, default=RECOUNT_BATCH_SIZE, help='Companies locked and recounted per transaction')
+
+    def handle(self, *args, **options):
+        drifted = recount_company_stats(options['companies'], dry_run=options['dry_run'], batch_size=options['batch_size'])
+        for company, differences in drifted:
+            changes = ', '.join(f'{field} {stored} -> {counted}' for field, (stored, counted) in differences.items())
+            self.stdout.write(f'- {company.name} ({company.pk}): {changes}')
+        verb = 'would be corrected' if options['dry_run'] else 'corrected'
+        self.stdout.write(self.style.SUCCESS(f'{len(drifted)} companies {verb}'))
@@ -0,0 +1,79 @@
+import logging
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connection
+
+from apps.users.jobs import claim_job, run_job
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs queued background jobs, such as company deletions, bulk imports and exports, '
+        'on --workers threads. Polls the database for new jobs until stopped, or with --once '
+        'until the queue is empty. SIGTERM or Ctrl-C lets running jobs finish before exiting.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.JOB_WORKERS, help='Jobs to run at once')
+        parser.add_argument('--once', action='store_true', help='Exit when no job is left to run')
+        parser.add_argument('--poll', type=float, default=2.0, help='Seconds to wait between checks of an empty queue')
+
+    def handle(self, *args, **options):
+        # Jobs write from this process, so it fails without a shared cache
+        # and event broker rather than leave the web processes stale
+        self.check(tags=['jobs'], include_deployment_checks=True)
+        stopping = threading.Event()
+
+        def stop(signum, frame):
+            self.stdout.write('Stopping once the running jobs finish')
+            stopping.set()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        threads = [
+            threading.Thread(target=self.work, args=(stopping, options), name=f'job-worker-{number}')
+            for number in range(max(options['workers'], 1))
+        ]
+        for thread in threads:
+            thread.start()
+        # Joining with a timeout keeps the main thread free to take signals
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=0.5)
+
+    def work(self, stopping, options):
+        # Each thread has its own database connection
+        try:
+            while not stopping.is_set():
+                close_old_connections()
+                try:
+                    job = claim_job()
+                except DatabaseError:
+                    # Keep the worker alive through a database restart
+                    logger.exception('Could not claim a job')
+                    connection.close()
+                    stopping.wait(options['poll'])
+                    continue
+                if job is None:
+                    if options['once']:
+                        return
+                    stopping.wait(options['poll'])
+                    continue
+                self.stdout.write(f'Running {job}')
+                try:
+                    run_job(job)
+                except DatabaseError:
+                    # The job's lease runs out and another worker resumes it
+                    logger.exception('Could not record the outcome of %s', job)
+                    connection.close()
+                    continue
+                style = self.style.SUCCESS if job.status == job.SUCCEEDED else self.style.ERROR
+                self.stdout.write(style(f'Finished {job}{": " + job.error if job.error else ""}'))
+        finally:
+            connection.close()
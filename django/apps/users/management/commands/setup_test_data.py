@@ -1,15 +1,46 @@
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from django.apps import apps
+from apps.users.hashing import hash_passwords
+from apps.users.loadtest import generate_load_test_data
+from apps.users.stats import recount_company_stats
 CustomUser = apps.get_model('users', 'CustomUser')
 Company = apps.get_model('users', 'Company')
 import random
 
 class Command(BaseCommand):
-    help = 'Creates initial test data including superuser, companies, and users'
+    help = (
+        'Creates initial test data including superuser, companies, and users. '
+        'With --companies it instead generates a synthetic load-testing dataset.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--companies', type=int, help='Generate this many synthetic companies instead of the demo data')
+        parser.add_argument('--users', type=int, default=100000, help='Total synthetic users across all companies')
+        parser.add_argument('--distribution', choices=['zipf', 'uniform'], default='zipf',
+                            help='How users are spread over companies')
+        parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent for --distribution zipf')
+        parser.add_argument('--admin-ratio', type=float, default=0.05, help='Share of users with the admin role')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed always yields the same data')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows inserted per transaction')
+
+    def handle(self, *args, **options):
+        if options['companies'] is None:
+            self.seed_demo()
+        else:
+            generate_load_test_data(
+                companies=options['companies'],
+                users=options['users'],
+                distribution=options['distribution'],
+                skew=options['skew'],
+                admin_ratio=options['admin_ratio'],
+                seed=options['seed'],
+                batch_size=options['batch_size'],
+                stdout=self.stdout,
+            )
 
     @transaction.atomic
-    def handle(self, *args, **kwargs):
+    def seed_demo(self):
         self.stdout.write('Creating seed data...')
 
         # Create superuser
@@ -23,62 +54,72 @@ class Command(BaseCommand):
             )
             self.stdout.write(self.style.SUCCESS('Superuser created'))
 
-        # Create companies
+        # Create companies, reusing them when the command is run again
         companies = [
-            Company.objects.create(name='Instawork'),
-            Company.objects.create(name='SolTranCo'),
-            Company.objects.create(name='Rubrik'),
+            Company.objects.get_or_create(name='Instawork')[0],
+            Company.objects.get_or_create(name='SolTranCo')[0],
+            Company.objects.get_or_create(name='Rubrik')[0],
         ]
 
-        # Create users for each company
-        roles = ['admin', 'regular']
+        # Collect users for each company, then hash every password across
+        # the worker pool and insert them in one go
+        rows = []
         for company in companies:
-            # Create an admin for the company
-            CustomUser.objects.create_user(
-                f'{company.name.lower()}_admin',
-                f'reshav@{company.name.lower()}.com',
-                'password',
+            # An admin for the company
+            rows.append(dict(
+                username=f'{company.name.lower()}_admin',
+                email=f'reshav@{company.name.lower()}.com',
+                password='password',
                 role='admin',
                 company=company,
                 phone_number=f'+1{random.randint(1000000000, 9999999999)}',
                 first_name='Reshav',
                 last_name='Singla',
-            )
+            ))
 
-            CustomUser.objects.create_user(
-                f'{company.name.lower()}_adam',
-                f'adam@{company.name.lower()}.com',
-                'password',
+            rows.append(dict(
+                username=f'{company.name.lower()}_adam',
+                email=f'adam@{company.name.lower()}.com',
+                password='password',
                 role='regular',
                 company=company,
                 phone_number=f'+1{random.randint(1000000000, 9999999999)}',
                 first_name='Adam',
                 last_name='Stepinski',
-            )
+            ))
 
-            CustomUser.objects.create_user(
-                f'{company.name.lower()}_sol',
-                f'sol@{company.name.lower()}.com',
-                'password',
+            rows.append(dict(
+                username=f'{company.name.lower()}_sol',
+                email=f'sol@{company.name.lower()}.com',
+                password='password',
                 role='regular',
                 company=company,
                 phone_number=f'+1{random.randint(1000000000, 9999999999)}',
                 first_name='Sol',
                 last_name='Tran',
-            )
+            ))
 
-            # Create regular users for the company
+            # Regular users for the company
             for i in range(5):  # Create 5 regular users per company
-                CustomUser.objects.create_user(
-                    f'{company.name.lower()}_user{i+1}',
-                    f'user{i+1}@{company.name.lower()}.com',
-                    'password',
+                rows.append(dict(
+                    username=f'{company.name.lower()}_user{i+1}',
+                    email=f'user{i+1}@{company.name.lower()}.com',
+                    password='password',
                     role='regular',
                     company=company,
                     phone_number=f'+1{random.randint(1000000000, 9999999999)}',
                     first_name=random.choice(['Ayla', 'Sam', 'Chris', 'Pat', 'Jordan']),
                     last_name=random.choice(['Pham', 'Miller', 'Wilson', 'Moore', 'Taylor']),
-                )
+                ))
+
+        existing = set(CustomUser.objects.filter(username__in=[row['username'] for row in rows]).values_list('username', flat=True))
+        rows = [row for row in rows if row['username'] not in existing]
+        password_hashes = hash_passwords([row.pop('password') for row in rows])
+        CustomUser.objects.bulk_create([
+            CustomUser(password=password_hash, **row)
+            for row, password_hash in zip(rows, password_hashes)
+        ])
+        recount_company_stats([company.pk for company in companies])
 
         self.stdout.write(self.style.SUCCESS('Seed data created successfully'))
 
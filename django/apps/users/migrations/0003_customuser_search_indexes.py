@@ -0,0 +1,40 @@
+from django.db import migrations
+
+SEARCH_FIELDS = ('first_name', 'last_name', 'email', 'phone_number')
+
+
+def create_search_indexes(apps, schema_editor):
+    table = schema_editor.quote_name(apps.get_model('users', 'CustomUser')._meta.db_table)
+    if schema_editor.connection.vendor == 'postgresql':
+        # btree_gin lets company_id share the trigram index, so a company's
+        # search never scans other tenants' postings
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS btree_gin')
+        for field in SEARCH_FIELDS:
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS users_search_{field}_trgm ON {table} '
+                f'USING gin (company_id, {field} gin_trgm_ops)'
+            )
+    else:
+        for field in SEARCH_FIELDS:
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS users_search_{field}_prefix ON {table} '
+                f'(company_id, lower({field}))'
+            )
+
+
+def drop_search_indexes(apps, schema_editor):
+    suffix = 'trgm' if schema_editor.connection.vendor == 'postgresql' else 'prefix'
+    for field in SEARCH_FIELDS:
+        schema_editor.execute(f'DROP INDEX IF EXISTS users_search_{field}_{suffix}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_customuser_token_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.1.1 on 2026-10-17 18:05
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_members(apps, schema_editor):
+    # Start the counters from the current rosters; from here on they are
+    # maintained incrementally
+    Company = apps.get_model('users', 'Company')
+    CustomUser = apps.get_model('users', 'CustomUser')
+    rows = (
+        CustomUser.objects.filter(company__isnull=False)
+        .values('company_id')
+        .annotate(
+            member_count=Count('id'),
+            admin_count=Count('id', filter=Q(role='admin')),
+            regular_count=Count('id', filter=Q(role='regular')),
+            active_count=Count('id', filter=Q(is_active=True)),
+        )
+        .order_by()
+    )
+    companies = [Company(pk=row.pop('company_id'), **row) for row in rows]
+    Company.objects.bulk_update(
+        companies, ['member_count', 'admin_count', 'regular_count', 'active_count'], batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_delta_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='active_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='admin_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='member_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='regular_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_members, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.1 on 2026-10-17 18:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_job_retries'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='created_by',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.1 on 2026-10-17 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_job_created_by_no_constraint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.UUIDField(unique=True)),
+                ('action', models.CharField(max_length=30)),
+                ('company_id', models.BigIntegerField(null=True)),
+                ('actor_id', models.BigIntegerField(null=True)),
+                ('target_id', models.BigIntegerField(null=True)),
+                ('changes', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['company_id', 'created_at', 'id'], name='audit_company_idx'), models.Index(fields=['created_at', 'id'], name='audit_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.1 on 2026-10-17 18:42
+
+from django.db import migrations, models
+
+BULK_KINDS = ('users.bulk_create', 'users.bulk_update')
+
+
+def move_passwords(apps, schema_editor):
+    # Bulk jobs used to queue their rows with the passwords in the payload.
+    # Jobs still to run get them as secrets; finished ones drop them
+    Job = apps.get_model('users', 'Job')
+    for job in Job.objects.filter(kind__in=BULK_KINDS).iterator(chunk_size=100):
+        rows = job.payload.get('rows')
+        if not isinstance(rows, list) or not any(isinstance(row, dict) and 'password' in row for row in rows):
+            continue
+        if job.status in ('queued', 'running'):
+            job.secrets = {'passwords': [row.get('password') if isinstance(row, dict) else None for row in rows]}
+        job.payload['rows'] = [
+            {key: value for key, value in row.items() if key != 'password'} if isinstance(row, dict) else row
+            for row in rows
+        ]
+        job.save(update_fields=['payload', 'secrets'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_audit_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='secrets',
+            field=models.JSONField(null=True),
+        ),
+        migrations.RunPython(move_passwords, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,35 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, router, transaction
 from django.core.validators import RegexValidator
 
 class Company(models.Model):
     name = models.CharField(max_length=100, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    # Headcount by role, kept up to date in the transaction that changes a
+    # member (see apps.users.stats) and checked by reconcile_company_stats.
+    # Plain integers so a drifted counter never blocks a write.
+    member_count = models.IntegerField(default=0, editable=False)
+    admin_count = models.IntegerField(default=0, editable=False)
+    regular_count = models.IntegerField(default=0, editable=False)
+    active_count = models.IntegerField(default=0, editable=False)
+
+    # Set while a background job deletes the company's members in batches;
+    # the company is hidden from the API from then on
+    deleting = models.BooleanField(default=False, editable=False)
+
+    # Only ever moved by targeted UPDATEs, so a full save() of an instance
+    # loaded earlier must not write back its stale copy of them
+    UNSAVED_FIELDS = ('member_count', 'admin_count', 'regular_count', 'active_count', 'deleting')
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.UNSAVED_FIELDS
+            ]
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
@@ -22,6 +47,11 @@ class CustomUser(AbstractUser):
         message="Phone number must be entered in the format: '+999999999'. Up to 15 digits allowed."
     )
     phone_number = models.CharField(validators=[phone_regex], max_length=17, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Bumped whenever a claim carried in issued JWTs or the password changes,
+    # which revokes every token minted before the change
+    token_version = models.PositiveIntegerField(default=0, editable=False)
 
     # Override is_superuser field
     is_superuser = models.BooleanField(
@@ -30,9 +60,166 @@ class CustomUser(AbstractUser):
         help_text='Designates that this user has all permissions without explicitly assigning them.',
     )
 
+    # Fields mirrored into access token claims; changing any of them must
+    # revoke outstanding tokens
+    TOKEN_CLAIM_FIELDS = ('role', 'is_active', 'is_superuser', 'is_staff', 'company_id')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the values the row was loaded with so a move between
+        # companies can invalidate both rosters and claim changes can bump
+        # the token version
+        instance._loaded_claims = instance._current_claims()
+        return instance
+
+    def _current_claims(self):
+        return {name: self.__dict__[name] for name in self.TOKEN_CLAIM_FIELDS if name in self.__dict__}
+
+    def token_claims_changed(self):
+        loaded = getattr(self, '_loaded_claims', None)
+        if loaded is None:
+            return False
+        current = self._current_claims()
+        return any(current[name] != value for name, value in loaded.items() if name in current)
+
+    def save(self, *args, **kwargs):
+        claims_changed = self.token_claims_changed()
+        # A new password revokes the tokens issued under the old one too
+        if claims_changed or (self._password is not None and not self._state.adding):
+            self.token_version += 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'token_version'}
+        if self._state.adding or claims_changed:
+            # The company counters only follow claim fields; post_save moves
+            # them, in the same transaction as the row
+            using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+            with transaction.atomic(using=using, savepoint=False):
+                super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
+        self._loaded_claims = self._current_claims()
+
     def __str__(self):
         return f"{self.get_full_name()} ({self.company})"
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Role filters within a company
+            models.Index(fields=['company', 'role'], name='users_company_role_idx'),
+            # Keyset pagination of a company roster (TeamMemberCursorPagination)
+            models.Index(fields=['company', 'last_name', 'first_name', 'id'], name='users_company_name_idx'),
+            # The same ordering across every company, for superusers
+            models.Index(fields=['last_name', 'first_name', 'id'], name='users_name_idx'),
+            # Active members of a company
+            models.Index(fields=['company'], condition=models.Q(is_active=True), name='users_active_company_idx'),
+            # Delta sync reads changes in (updated_at, id) order per company,
+            # and across companies for superusers
+            models.Index(fields=['company', 'updated_at', 'id'], name='users_company_changes_idx'),
+            models.Index(fields=['updated_at', 'id'], name='users_changes_idx'),
+        ]
+
     @property
     def is_company_admin(self):
         return self.role == 'admin'
+
+
+class UserTombstone(models.Model):
+    """Record of a deleted CustomUser, kept so delta sync can report the delete."""
+    user_id = models.BigIntegerField()
+    # Plain integer rather than a foreign key: the company may be gone too
+    company_id = models.BigIntegerField(null=True)
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['company_id', 'deleted_at', 'id'], name='tombstones_company_idx'),
+            models.Index(fields=['deleted_at', 'id'], name='tombstones_deleted_idx'),
+        ]
+
+
+class AuditEvent(models.Model):
+    """
+    Durable record of a change to a team member: who did what to whom.
+
+    Written in batches by apps.users.audit, not in the request's transaction.
+    Ids are plain integers so the record outlives the users and company.
+    """
+    # Assigned when the event happens; makes replaying the write-ahead log
+    # after a crash idempotent
+    event_id = models.UUIDField(unique=True)
+    action = models.CharField(max_length=30)
+    company_id = models.BigIntegerField(null=True)
+    actor_id = models.BigIntegerField(null=True)
+    target_id = models.BigIntegerField(null=True)
+    # {field: [old, new]}; passwords only show that they changed
+    changes = models.JSONField(default=dict)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # A company's history newest first, and everything for superusers
+            models.Index(fields=['company_id', 'created_at', 'id'], name='audit_company_idx'),
+            models.Index(fields=['created_at', 'id'], name='audit_created_idx'),
+        ]
+
+
+class Job(models.Model):
+    """
+    A unit of background work, run by the run_jobs worker.
+
+    ``kind`` selects the handler in apps.users.jobs.JOB_HANDLERS and
+    ``payload`` holds its arguments, and ``secrets`` any that are sensitive.
+    A running job holds a lease until
+    ``locked_until``; a worker that dies lets it expire, and the next worker
+    picks the job up again, so handlers must be safe to resume. A job that
+    fails is retried, after ``run_after``, until it has had JOB_MAX_ATTEMPTS.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    # Arguments that must not outlive the job, such as the passwords of a
+    # bulk import; kept out of ``payload`` and cleared once the job is done
+    secrets = models.JSONField(null=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    # Units of work done out of ``total``, when the handler knows the total
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True)
+    # What the handler returned, e.g. the rows a bulk import created
+    result = models.JSONField(null=True)
+    error = models.TextField(blank=True)
+    # The user the job acts for; its permissions are checked again when it
+    # runs. Not enforced in the database, so deleting users never has to
+    # touch this table; a job left without its user fails that check.
+    created_by = models.ForeignKey(
+        CustomUser, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+',
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    # Not claimed before this time; set to back off after a failed attempt
+    run_after = models.DateTimeField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+    locked_until = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            # Workers scan only the jobs still to run, oldest first
+            models.Index(fields=['id'], condition=models.Q(status__in=['queued', 'running']), name='jobs_pending_idx'),
+            # A user's own jobs, for the status endpoint
+            models.Index(fields=['created_by', 'id'], name='jobs_created_by_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
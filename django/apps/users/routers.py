@@ -0,0 +1,195 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, InterfaceError, OperationalError, connections
+
+logger = logging.getLogger(__name__)
+
+REPLICA_ALIASES = [alias for alias in settings.DATABASES if alias.startswith('replica_')]
+# Holds the time until which the client's reads stay on the primary
+PIN_COOKIE = 'primary_until'
+READ_METHODS = ('GET', 'HEAD')
+
+# Seconds of replay lag, 0 when the replica has replayed all it received
+POSTGRESQL_LAG_SQL = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+'''
+
+_current_request = contextvars.ContextVar('replica_request', default=None)
+
+
+class ReplicaPool:
+    """
+    Pick a healthy replica, checking each at most every REPLICA_CHECK_SECONDS.
+
+    A replica is healthy when it accepts connections and, on PostgreSQL,
+    lags the primary by less than REPLICA_PIN_SECONDS; further behind, a
+    client's own write could be missing after its pin expires.
+    """
+
+    def __init__(self, aliases):
+        self.aliases = list(aliases)
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def choose(self):
+        aliases = random.sample(self.aliases, len(self.aliases))
+        for alias in aliases:
+            if self.is_healthy(alias):
+                return alias
+        return None
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        with self._lock:
+            healthy, checked_at = self._state.get(alias, (True, None))
+        if checked_at is not None and now - checked_at < settings.REPLICA_CHECK_SECONDS:
+            return healthy
+        healthy = self.check(alias)
+        with self._lock:
+            self._state[alias] = (healthy, now)
+        return healthy
+
+    def check(self, alias):
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                if connection.vendor != 'postgresql':
+                    cursor.execute('SELECT 1')
+                    return True
+                cursor.execute(POSTGRESQL_LAG_SQL)
+                lag = cursor.fetchone()[0]
+        except DatabaseError:
+            logger.warning('Replica %s is unreachable; reading from the primary', alias, exc_info=True)
+            return False
+        if lag is not None and lag >= settings.REPLICA_PIN_SECONDS:
+            logger.warning('Replica %s is %.1fs behind; reading from the primary', alias, lag)
+            return False
+        return True
+
+    def mark_down(self, alias):
+        with self._lock:
+            self._state[alias] = (False, time.monotonic())
+
+
+replicas = ReplicaPool(REPLICA_ALIASES)
+
+
+def _is_pinned(request):
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def _choose_read_database(request):
+    if not REPLICA_ALIASES or request.method not in READ_METHODS or _is_pinned(request):
+        return None
+    view = request.resolver_match.func if request.resolver_match else None
+    actions = getattr(view, 'actions', None) or {}
+    if actions.get('get') not in getattr(getattr(view, 'cls', None), 'replica_actions', ()):
+        return None
+    return replicas.choose()
+
+
+def read_database(request):
+    """The alias ``request`` reads from, None for the primary; chosen on first use."""
+    request = getattr(request, '_request', request)
+    if not hasattr(request, '_read_database'):
+        request._read_database = _choose_read_database(request)
+    return request._read_database
+
+
+def use_primary(request):
+    """Send the rest of ``request``'s reads to the primary."""
+    getattr(request, '_request', request)._read_database = None
+
+
+class ReplicaRouter:
+    """
+    Route roster reads to a replica and everything else to the primary.
+
+    Only GET and HEAD requests for actions a viewset lists in
+    ``replica_actions`` are routed, and only while the client is not pinned
+    to the primary by a recent write. Outside a request, such as in
+    management commands, and inside a transaction, every query goes to the
+    primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        request = _current_request.get()
+        if request is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # Inside a transaction, only the primary has what it wrote
+            return None
+        return read_database(request)
+
+    def db_for_write(self, model, **hints):
+        # Also covers saving an instance that was read from a replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every alias holds the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in REPLICA_ALIASES:
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Expose the request to ReplicaRouter and pin clients to the primary after writes.
+
+    A successful unsafe request sets a cookie that keeps the client's reads
+    on the primary for REPLICA_PIN_SECONDS, so it reads its own writes
+    whatever the replication lag. A replica that fails mid-request is taken
+    out of rotation until its next check.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _current_request.set(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_request.reset(token)
+        return self.pin_after_write(request, response)
+
+    async def __acall__(self, request):
+        token = _current_request.set(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_request.reset(token)
+        return self.pin_after_write(request, response)
+
+    def pin_after_write(self, request, response):
+        if REPLICA_ALIASES and request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            response.set_cookie(
+                PIN_COOKIE, str(time.time() + settings.REPLICA_PIN_SECONDS),
+                max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
+
+    def process_exception(self, request, exception):
+        alias = getattr(request, '_read_database', None)
+        if alias is not None and isinstance(exception, (OperationalError, InterfaceError)):
+            logger.warning('Replica %s failed during a request; reading from the primary', alias)
+            replicas.mark_down(alias)
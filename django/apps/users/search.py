@@ -0,0 +1,99 @@
+from django.contrib.postgres.lookups import TrigramWordSimilar
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connections
+from django.db.models import Case, F, FloatField, IntegerField, Lookup, Q, Value, When
+from django.db.models.functions import Greatest, Lower
+
+SEARCH_FIELDS = ('first_name', 'last_name', 'email', 'phone_number')
+SEARCH_DEFAULT_LIMIT = 10
+SEARCH_MAX_LIMIT = 50
+
+
+class ILike(Lookup):
+    # Django renders icontains as UPPER(col) LIKE UPPER(%s) on PostgreSQL,
+    # which the trigram indexes on the bare columns cannot serve
+    lookup_name = 'ilike'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} ILIKE {rhs}', [*lhs_params, *rhs_params]
+
+
+def normalize_term(query):
+    return ' '.join(query.split()).lower()
+
+
+def search_team_members(queryset, query, limit=SEARCH_DEFAULT_LIMIT):
+    """
+    Return up to ``limit`` members of ``queryset`` matching ``query``, best first.
+
+    On PostgreSQL this is a substring and fuzzy (word similarity) match served
+    by the trigram GIN indexes from migration 0003. Other databases fall back
+    to a prefix match on the lowercased columns, served by expression indexes.
+    """
+    term = normalize_term(query)
+    if not term:
+        return queryset.none()
+    if connections[queryset.db].vendor == 'postgresql':
+        queryset = _trigram_search(queryset, term)
+    else:
+        queryset = _prefix_search(queryset, term)
+    return queryset.order_by('-rank', 'last_name', 'first_name', 'id')[:limit]
+
+
+def match_team_members(queryset, query):
+    """
+    Filter ``queryset`` to the members matching ``query``, unranked and unordered.
+
+    The same index-served match as search_team_members, plus an exact
+    username match, for callers that order the results themselves such as
+    the admin changelist.
+    """
+    term = normalize_term(query)
+    if not term:
+        return queryset
+    if connections[queryset.db].vendor == 'postgresql':
+        matches = _trigram_matches(queryset, term)
+    else:
+        queryset, matches = _prefix_matches(queryset, term)
+    return queryset.filter(matches | Q(username=query.strip()))
+
+
+def _trigram_matches(queryset, term):
+    pattern = connections[queryset.db].ops.prep_for_like_query(term)
+    matches = Q()
+    for field in SEARCH_FIELDS:
+        matches |= Q(ILike(F(field), Value(f'%{pattern}%')))
+        matches |= Q(TrigramWordSimilar(F(field), Value(term)))
+    return matches
+
+
+def _trigram_search(queryset, term):
+    pattern = connections[queryset.db].ops.prep_for_like_query(term)
+    matches = _trigram_matches(queryset, term)
+    prefix_hits = [When(ILike(F(field), Value(f'{pattern}%')), then=Value(1.0)) for field in SEARCH_FIELDS]
+    # A prefix hit outranks any fuzzy score, which lies in [0, 1]
+    rank = (
+        Case(*prefix_hits, default=Value(0.0), output_field=FloatField())
+        + Greatest(*(TrigramWordSimilarity(term, field) for field in SEARCH_FIELDS))
+    )
+    return queryset.filter(matches).annotate(rank=rank)
+
+
+def _prefix_matches(queryset, term):
+    # lower(col) >= term AND lower(col) < next_term is the prefix match in a
+    # form any btree on lower(col) can serve as a range scan
+    upper = term[:-1] + chr(ord(term[-1]) + 1)
+    matches = Q()
+    for field in SEARCH_FIELDS:
+        matches |= Q(**{f'{field}_lower__gte': term, f'{field}_lower__lt': upper})
+        queryset = queryset.alias(**{f'{field}_lower': Lower(field)})
+    return queryset, matches
+
+
+def _prefix_search(queryset, term):
+    queryset, matches = _prefix_matches(queryset, term)
+    ranks = [When(**{f'{field}_lower': term}, then=Value(2)) for field in SEARCH_FIELDS]
+    rank = Case(*ranks, default=Value(1), output_field=IntegerField())
+    return queryset.filter(matches).annotate(rank=rank)
@@ -1,24 +1,77 @@
+import copy
 import uuid
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
-from .models import CustomUser, Company
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.reverse import reverse
+from .audit import changed_values, record_member_events
+from .authentication import TeamRefreshToken
+from .instrumentation import TimedListSerializer, TimedSerializerMixin
+from .models import AuditEvent, CustomUser, Company, Job
+from rest_framework.exceptions import AuthenticationFailed, PermissionDenied
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
 
-class CompanySerializer(serializers.ModelSerializer):
+class CompanySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Company
         fields = ['id', 'name']
+        list_serializer_class = TimedListSerializer
 
-class CustomUserSerializer(serializers.ModelSerializer):
+class CompanyStatsSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Company
+        fields = ['id', 'name', 'member_count', 'admin_count', 'regular_count', 'active_count']
+        list_serializer_class = TimedListSerializer
+
+class JobSerializer(serializers.ModelSerializer):
+    # Where a finished export can be fetched from
+    download = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'status', 'progress', 'total', 'result', 'error', 'attempts', 'run_after',
+            'created_at', 'started_at', 'finished_at', 'download',
+        ]
+
+    def get_download(self, job):
+        if job.kind != 'users.export' or job.status != Job.SUCCEEDED:
+            return None
+        return reverse('job-download', kwargs={'pk': job.pk}, request=self.context.get('request'))
+
+class AuditEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AuditEvent
+        fields = ['id', 'action', 'company_id', 'actor_id', 'target_id', 'changes', 'created_at']
+
+class CustomUserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     username = serializers.CharField(required=False)
     company = CompanySerializer(read_only=True)
 
     class Meta:
         model = CustomUser
-        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'phone_number', 'role', 'company']
+        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'phone_number', 'role', 'company', 'password']
         extra_kwargs = {
-            'password': {'write_only': True},  # Ensure password is write-only
+            'password': {'write_only': True, 'required': False},  # Ensure password is write-only
             'company': {'read_only': True}  # Make company read-only
         }
+        list_serializer_class = TimedListSerializer
+
+    def validate(self, attrs):
+        # Every create and update path, bulk rows included, holds passwords
+        # to AUTH_PASSWORD_VALIDATORS, checked against the member as saved
+        password = attrs.get('password')
+        if password is not None:
+            user = copy.copy(self.instance) if self.instance is not None else CustomUser()
+            for attr, value in attrs.items():
+                if attr != 'password':
+                    setattr(user, attr, value)
+            try:
+                validate_password(password, user)
+            except DjangoValidationError as e:
+                raise serializers.ValidationError({'password': list(e.messages)})
+        return attrs
 
     def create(self, validated_data):
         if 'username' not in validated_data or not validated_data['username']:
@@ -29,24 +82,60 @@ class CustomUserSerializer(serializers.ModelSerializer):
         return user
 
     def update(self, instance, validated_data):
+        request_user = self.context['request'].user
+        changes = changed_values(instance, validated_data)
         if 'password' in validated_data:
             password = validated_data.pop('password')
             instance.set_password(password)
         
         # Check if role is being updated
         if 'role' in validated_data:
-            # Assuming you have access to the request user
-            request_user = self.context['request'].user
             if request_user.is_superuser or request_user.role == 'admin':
                 instance.role = validated_data.pop('role')
             else:
                 raise PermissionDenied("Only admins can change user roles.")
         
-        return super().update(instance, validated_data)
+        user = super().update(instance, validated_data)
+        record_member_events('user.updated', request_user.pk, [(user, changes)])
+        return user
 
     def generate_unique_username(self):
-        # Generate a unique username based on UUID
-        while True:
-            username = f"user_{uuid.uuid4().hex[:8]}"
-            if not CustomUser.objects.filter(username=username).exists():
-                return username
+        return allocate_usernames(1)[0]
+
+
+def allocate_usernames(count):
+    # Generate unique usernames based on UUID, checking each round of
+    # candidates with a single query instead of one exists() per name
+    allocated = []
+    while len(allocated) < count:
+        candidates = {f"user_{uuid.uuid4().hex[:8]}" for _ in range(count - len(allocated))}
+        taken = set(CustomUser.objects.filter(username__in=candidates).values_list('username', flat=True))
+        allocated.extend(candidates - taken)
+    return allocated
+
+
+class TeamTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = TeamRefreshToken
+
+
+class TeamTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = TeamRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user = CustomUser.objects.filter(pk=refresh[api_settings.USER_ID_CLAIM]).first()
+        if user is None or not user.is_active:
+            raise AuthenticationFailed("No active account found for this token.", code="no_active_account")
+
+        # Refreshing is the one point that reads the user, so re-issue the
+        # claims from it; a role or company change shows up in the new token
+        refresh.set_user_claims(user)
+        data = {'access': str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data['refresh'] = str(refresh)
+
+        return data
@@ -0,0 +1,40 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import clear_auth_state
+from .cache import bump_roster_versions
+from .models import Company, CustomUser
+from .stats import apply_stat_deltas, member_state, stat_deltas
+from .sync import record_tombstone
+
+
+@receiver(post_save, sender=CustomUser)
+def user_saved(sender, instance, created=False, update_fields=None, **kwargs):
+    # Logins only touch last_login, which no roster response includes
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    clear_auth_state([instance.pk])
+    loaded = getattr(instance, '_loaded_claims', None)
+    if created or loaded is not None:
+        saved = member_state(instance, update_fields)
+        apply_stat_deltas(stat_deltas(None if created else {**saved, **loaded}, saved))
+    loaded_company_id = getattr(instance, '_loaded_claims', {}).get('company_id', instance.company_id)
+    if loaded_company_id != instance.company_id:
+        # To delta sync, leaving a company looks like being deleted from it
+        record_tombstone(instance.pk, loaded_company_id)
+    bump_roster_versions({instance.company_id, loaded_company_id})
+
+
+@receiver(post_delete, sender=CustomUser)
+def user_deleted(sender, instance, **kwargs):
+    clear_auth_state([instance.pk])
+    # Runs inside the delete's transaction
+    apply_stat_deltas(stat_deltas(getattr(instance, '_loaded_claims', None) or instance._current_claims(), None))
+    record_tombstone(instance.pk, instance.company_id)
+    bump_roster_versions([instance.company_id])
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+def company_changed(sender, instance, **kwargs):
+    bump_roster_versions([instance.pk])
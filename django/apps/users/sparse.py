@@ -0,0 +1,133 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import Http404
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from .instrumentation import timed
+from .models import CustomUser
+from .serializers import CustomUserSerializer
+
+# The fields CustomUserSerializer renders, in its output order
+READABLE_FIELDS = [
+    name for name in CustomUserSerializer.Meta.fields
+    if not CustomUserSerializer.Meta.extra_kwargs.get(name, {}).get('write_only')
+]
+EXPANDABLE = {'company'}
+
+
+class UserValuesSerializer:
+    """
+    Render users from ``.values()`` rows instead of model instances.
+
+    Produces exactly what CustomUserSerializer does for the same fields, so
+    with every field and ``company`` expanded the payload is unchanged; with
+    ``company`` requested but not expanded only its id is sent.
+    """
+
+    def __init__(self, fields=None, expand=()):
+        self.fields = list(fields or READABLE_FIELDS)
+        self.expand_company = fields is None or 'company' in expand
+
+    def columns(self, extra=()):
+        columns = dict.fromkeys(extra)
+        for name in self.fields:
+            if name == 'company':
+                columns['company_id'] = None
+                if self.expand_company:
+                    columns['company__name'] = None
+            else:
+                columns[name] = None
+        return list(columns)
+
+    def to_representation(self, row):
+        data = {}
+        for name in self.fields:
+            if name != 'company':
+                data[name] = row[name]
+            elif not self.expand_company:
+                data[name] = row['company_id']
+            elif row['company_id'] is None:
+                data[name] = None
+            else:
+                data[name] = {'id': row['company_id'], 'name': row['company__name']}
+        return data
+
+    def many(self, rows):
+        with timed('ser'):
+            return [self.to_representation(row) for row in rows]
+
+
+class SparseFieldsMixin:
+    """
+    Serve list and retrieve from ``.values()`` projections.
+
+    ``?fields=first_name,role`` limits the columns fetched and returned and
+    ``?expand=company`` nests the company instead of its id. Without
+    ``fields`` the full, unchanged payload is produced the same fast way.
+    """
+
+    def get_values_serializer(self):
+        params = self.request.query_params
+        fields = None
+        if params.get('fields'):
+            fields = [name.strip() for name in params['fields'].split(',') if name.strip()]
+            unknown = [name for name in fields if name not in READABLE_FIELDS]
+            if unknown:
+                raise ValidationError({'fields': [f"Unknown field(s): {', '.join(unknown)}."]})
+        expand = [name.strip() for name in params.get('expand', '').split(',') if name.strip()]
+        unknown = [name for name in expand if name not in EXPANDABLE]
+        if unknown:
+            raise ValidationError({'expand': [f"Cannot expand: {', '.join(unknown)}."]})
+        return UserValuesSerializer(fields, expand)
+
+    def list(self, request, *args, **kwargs):
+        serializer, rows = self.get_values_rows()
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(serializer.many(page))
+        return Response(serializer.many(rows))
+
+    async def alist(self, request, *args, **kwargs):
+        serializer, rows = self.get_values_rows()
+        if self.paginator is not None:
+            page = await self.paginator.apaginate_queryset(rows, request, view=self)
+            return self.get_paginated_response(serializer.many(page))
+        return Response(serializer.many([row async for row in rows]))
+
+    def retrieve(self, request, *args, **kwargs):
+        serializer = self.get_values_serializer()
+        try:
+            row = self.get_values_row(serializer, kwargs).first()
+        except (TypeError, ValueError, DjangoValidationError):
+            row = None
+        return self.retrieve_row(request, serializer, row, kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        serializer = self.get_values_serializer()
+        try:
+            row = await self.get_values_row(serializer, kwargs).afirst()
+        except (TypeError, ValueError, DjangoValidationError):
+            row = None
+        return self.retrieve_row(request, serializer, row, kwargs)
+
+    def get_values_rows(self):
+        serializer = self.get_values_serializer()
+        queryset = self.filter_queryset(self.get_queryset())
+        ordering = list(getattr(self.paginator, 'ordering', ()))
+        return serializer, queryset.values(*serializer.columns(extra=ordering))
+
+    def get_values_row(self, serializer, kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset())
+        return queryset.filter(**{self.lookup_field: kwargs[lookup_url_kwarg]}).values(
+            *serializer.columns(extra=['company_id'])
+        )
+
+    def retrieve_row(self, request, serializer, row, kwargs):
+        if row is None:
+            raise Http404
+        # Object permissions only look at the company, so an unsaved stand-in
+        # is enough to run them without loading the row as a model
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        self.check_object_permissions(request, CustomUser(pk=kwargs[lookup_url_kwarg], company_id=row['company_id']))
+        return Response(serializer.many([row])[0])
@@ -0,0 +1,155 @@
+import contextlib
+import contextvars
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from .models import Company, CustomUser
+
+# Counter fields on Company and the members each one counts
+STAT_FIELDS = {
+    'member_count': lambda role, is_active: True,
+    'admin_count': lambda role, is_active: role == 'admin',
+    'regular_count': lambda role, is_active: role == 'regular',
+    'active_count': lambda role, is_active: is_active,
+}
+RECOUNT_BATCH_SIZE = 1000
+
+_deferred = contextvars.ContextVar('company_stat_deltas', default=None)
+
+
+def _contribution(state):
+    if state is None or state.get('company_id') is None:
+        return None, {}
+    counted = {
+        field: 1 for field, counts in STAT_FIELDS.items()
+        if counts(state.get('role'), state.get('is_active'))
+    }
+    return state['company_id'], counted
+
+
+def stat_deltas(before, after):
+    """
+    Counter changes per company for a member going from ``before`` to ``after``.
+
+    Each state is a dict with ``company_id``, ``role`` and ``is_active``, as
+    CustomUser keeps in ``_loaded_claims``; None for a member that does not
+    exist (yet, or any more).
+    """
+    deltas = defaultdict(Counter)
+    for state, sign in ((before, -1), (after, 1)):
+        company_id, counted = _contribution(state)
+        for field, count in counted.items():
+            deltas[company_id][field] += sign * count
+    return {
+        company_id: {field: count for field, count in counted.items() if count}
+        for company_id, counted in deltas.items() if company_id is not None and any(counted.values())
+    }
+
+
+def apply_stat_deltas(deltas):
+    """
+    Add ``deltas`` to the company counters, one UPDATE per company.
+
+    The counters move by relative amounts (``F() + n``), so concurrent
+    writers never overwrite each other; callers run this in the transaction
+    that changes the members. Inside ``deferred_stats()`` the deltas are
+    collected and applied once at the end of the block instead.
+    """
+    pending = _deferred.get()
+    if pending is not None:
+        for company_id, counted in deltas.items():
+            pending[company_id].update(counted)
+        return
+    # A fixed order keeps concurrent multi-company updates from deadlocking
+    for company_id in sorted(deltas):
+        counted = {field: count for field, count in deltas[company_id].items() if count}
+        if counted:
+            Company.objects.filter(pk=company_id).update(
+                **{field: F(field) + count for field, count in counted.items()}
+            )
+
+
+@contextlib.contextmanager
+def deferred_stats():
+    """Collect counter changes made in the block and apply them together at its end."""
+    if _deferred.get() is not None:
+        yield
+        return
+    pending = defaultdict(Counter)
+    token = _deferred.set(pending)
+    try:
+        yield
+    finally:
+        _deferred.reset(token)
+    apply_stat_deltas(pending)
+
+
+def member_state(user, fields=None):
+    """The counted state of ``user``, limited to ``fields`` when only those were saved."""
+    state = user._current_claims()
+    loaded = getattr(user, '_loaded_claims', None)
+    if loaded is not None and fields is not None:
+        saved = {'company_id' if field == 'company' else field for field in fields}
+        state = {name: value if name in saved else loaded.get(name, value) for name, value in state.items()}
+    return state
+
+
+def count_company_stats(company_ids):
+    """Count the members of ``company_ids`` from scratch, in one grouped query."""
+    counts = {
+        company_id: dict.fromkeys(STAT_FIELDS, 0) for company_id in company_ids
+    }
+    rows = (
+        CustomUser.objects.filter(company_id__in=company_ids)
+        .values('company_id')
+        .annotate(
+            member_count=Count('id'),
+            admin_count=Count('id', filter=Q(role='admin')),
+            regular_count=Count('id', filter=Q(role='regular')),
+            active_count=Count('id', filter=Q(is_active=True)),
+        )
+        .order_by()
+    )
+    for row in rows:
+        counts[row.pop('company_id')] = row
+    return counts
+
+
+def recount_company_stats(company_ids=None, dry_run=False, batch_size=RECOUNT_BATCH_SIZE):
+    """
+    Recount the counters of ``company_ids`` (every company by default).
+
+    Each batch locks its companies before counting, so a member written
+    concurrently is either counted or still to apply its own delta, never
+    both. Returns the companies whose counters had drifted, as
+    ``(company, {field: (stored, counted)})`` pairs.
+    """
+    companies = Company.objects.order_by('pk')
+    if company_ids is not None:
+        companies = companies.filter(pk__in=company_ids)
+    pks = list(companies.values_list('pk', flat=True))
+    drifted = []
+    for start in range(0, len(pks), batch_size):
+        with transaction.atomic():
+            batch = list(
+                Company.objects.filter(pk__in=pks[start:start + batch_size])
+                .order_by('pk').select_for_update().only('name', *STAT_FIELDS)
+            )
+            counts = count_company_stats([company.pk for company in batch])
+            changed = []
+            for company in batch:
+                differences = {
+                    field: (getattr(company, field), count)
+                    for field, count in counts[company.pk].items()
+                    if getattr(company, field) != count
+                }
+                if differences:
+                    for field, (_, count) in differences.items():
+                        setattr(company, field, count)
+                    changed.append(company)
+                    drifted.append((company, differences))
+            if changed and not dry_run:
+                Company.objects.bulk_update(changed, list(STAT_FIELDS))
+    return drifted
@@ -0,0 +1,141 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import ClaimsJWTAuthentication
+from .cache import roster_scope
+from .events import get_broker
+
+ROSTER_EVENTS_PATH = '/api/users/events/'
+# Seconds between keep-alive comments on an idle stream, below the usual
+# 30-60s proxy idle timeouts
+ROSTER_EVENTS_HEARTBEAT = 25
+# Milliseconds an EventSource waits before reconnecting
+ROSTER_EVENTS_RETRY = 3000
+
+
+def _authenticate(authentication, validated_token):
+    try:
+        return authentication.get_user(validated_token)
+    finally:
+        # Runs on the shared executor; don't leave a cache miss's database
+        # connection behind on its thread
+        close_old_connections()
+
+
+def _cors_headers(headers):
+    origin = headers.get(b'origin', b'').decode('latin-1')
+    if origin in getattr(settings, 'CORS_ALLOWED_ORIGINS', ()):
+        return [(b'access-control-allow-origin', origin.encode('latin-1')), (b'vary', b'origin')]
+    return []
+
+
+async def _send_json(send, status_code, data, extra_headers):
+    body = json.dumps(data).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status_code,
+        'headers': [(b'content-type', b'application/json'), *extra_headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def roster_events(scope, receive, send):
+    """
+    Server-Sent Events stream of changes to the caller's roster.
+
+    A plain ASGI application rather than a Django view: Django's ASGI handler
+    keeps a thread for every request in flight, which an idle stream would
+    hold for hours. Here a connection costs a task and a queue.
+
+    Authenticates with the access token from the Authorization header or,
+    for EventSource clients that cannot set headers, ``?token=``. Each event
+    is ``user.created``, ``user.updated`` or ``user.deleted`` with the
+    affected ids, or ``resync`` if the client fell too far behind; clients
+    fetch the details through the changes endpoint.
+    """
+    headers = dict(scope['headers'])
+    cors_headers = _cors_headers(headers)
+    if scope['method'] != 'GET':
+        await _send_json(send, status.HTTP_405_METHOD_NOT_ALLOWED, {"detail": f'Method "{scope["method"]}" not allowed.'}, cors_headers)
+        return
+
+    authentication = ClaimsJWTAuthentication()
+    raw_token = parse_qs(scope['query_string'].decode('latin-1')).get('token', [None])[0]
+    if not raw_token:
+        header = headers.get(b'authorization')
+        raw_token = header and authentication.get_raw_token(header)
+    if not raw_token:
+        await _send_json(send, status.HTTP_401_UNAUTHORIZED, {"detail": "Authentication credentials were not provided."}, cors_headers)
+        return
+    try:
+        validated_token = authentication.get_validated_token(raw_token)
+        user = await sync_to_async(_authenticate, thread_sensitive=False)(authentication, validated_token)
+    except AuthenticationFailed as e:
+        detail = e.detail if isinstance(e.detail, dict) else {"detail": e.detail}
+        await _send_json(send, status.HTTP_401_UNAUTHORIZED, detail, cors_headers)
+        return
+
+    async def stream():
+        await send({
+            'type': 'http.response.start',
+            'status': status.HTTP_200_OK,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                # Stop nginx from buffering the stream
+                (b'x-accel-buffering', b'no'),
+                *cors_headers,
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': f'retry: {ROSTER_EVENTS_RETRY}\n\n'.encode(), 'more_body': True})
+        while True:
+            event = await subscription.next(ROSTER_EVENTS_HEARTBEAT)
+            if event is not None:
+                chunk = f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+            else:
+                # Recheck the token while idle so a revoked or deactivated
+                # user stops receiving events within a heartbeat
+                try:
+                    await sync_to_async(_authenticate, thread_sensitive=False)(authentication, validated_token)
+                except AuthenticationFailed:
+                    await send({'type': 'http.response.body', 'body': b'event: revoked\ndata: {}\n\n'})
+                    return
+                chunk = ': ping\n\n'
+            await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+
+    subscription = get_broker().subscribe(roster_scope(user))
+    streaming = asyncio.ensure_future(stream())
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        done, _ = await asyncio.wait({streaming, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        subscription.close()
+        for task in (streaming, disconnected):
+            task.cancel()
+    if streaming in done:
+        # Surface anything that went wrong while streaming
+        streaming.result()
+
+
+def route_roster_events(application):
+    """Serve the roster event stream in front of the Django ASGI ``application``."""
+
+    async def router(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == ROSTER_EVENTS_PATH:
+            await roster_events(scope, receive, send)
+        else:
+            await application(scope, receive, send)
+
+    return router
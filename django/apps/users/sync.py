@@ -0,0 +1,142 @@
+import base64
+import contextlib
+import contextvars
+import json
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from .models import UserTombstone
+
+SYNC_PAGE_SIZE = 500
+TOMBSTONE_BATCH_SIZE = 1000
+# Rows are stamped when written but only become visible at commit, so a
+# token never moves past now minus this window; clients may see a row twice
+# (they upsert by id) but never miss one
+SYNC_OVERLAP = timedelta(seconds=10)
+
+
+_deferred_tombstones = contextvars.ContextVar('user_tombstones', default=None)
+
+
+class SyncTokenExpired(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = 'Sync token has expired; fetch the full roster again.'
+    default_code = 'sync_token_expired'
+
+
+def record_tombstone(user_id, company_id):
+    """
+    Record that ``user_id`` left ``company_id``, for delta sync to report as a delete.
+
+    Callers run this in the transaction that deletes or moves the member.
+    Inside ``deferred_tombstones()`` the tombstone is collected and written
+    with the others at the end of the block instead.
+    """
+    tombstone = UserTombstone(user_id=user_id, company_id=company_id)
+    pending = _deferred_tombstones.get()
+    if pending is not None:
+        pending.append(tombstone)
+    else:
+        tombstone.save()
+
+
+@contextlib.contextmanager
+def deferred_tombstones():
+    """Collect the tombstones recorded in the block and insert them together at its end."""
+    if _deferred_tombstones.get() is not None:
+        yield
+        return
+    pending = []
+    token = _deferred_tombstones.set(pending)
+    try:
+        yield
+    finally:
+        _deferred_tombstones.reset(token)
+    # A block rolled back by set_rollback() has nothing to record, and may
+    # not run queries
+    if pending and not transaction.get_connection().needs_rollback:
+        UserTombstone.objects.bulk_create(pending, batch_size=TOMBSTONE_BATCH_SIZE)
+
+
+def encode_token(positions):
+    data = {
+        stream: [moment.isoformat(), pk]
+        for stream, (moment, pk) in positions.items()
+    }
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def decode_token(token):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        return {stream: (datetime.fromisoformat(moment), int(pk)) for stream, (moment, pk) in data.items()}
+    except (TypeError, ValueError, AttributeError):
+        raise ValidationError({'since': ['Invalid sync token.']})
+
+
+def _changed_since(queryset, field, position, limit):
+    # Keyset over (field, id): cost follows the number of changes since
+    # ``position``, not the size of the table
+    if position is not None:
+        moment, pk = position
+        queryset = queryset.filter(Q(**{f'{field}__gt': moment}) | Q(**{field: moment, 'id__gt': pk}))
+    rows = list(queryset.order_by(field, 'id')[:limit + 1])
+    return rows[:limit], len(rows) > limit
+
+
+def _advance(position, rows, has_more, field, horizon):
+    if has_more:
+        return (rows[-1][field], rows[-1]['id'])
+    # Everything up to now has been sent; stop short of now by the overlap
+    advanced = (horizon, 0)
+    return max(position, advanced) if position is not None else advanced
+
+
+def collect_changes(since, users, tombstones, companies, serializer):
+    """
+    Return users, deletions and companies changed after the ``since`` token.
+
+    ``users``, ``tombstones`` and ``companies`` must already be scoped to the
+    caller. Each is paged independently by SYNC_PAGE_SIZE; ``has_more`` means
+    the client should call again straight away with ``next``. Without a token
+    the whole roster is sent, but only deletions from now on.
+    """
+    now = timezone.now()
+    horizon = now - SYNC_OVERLAP
+    if since:
+        positions = decode_token(since)
+        if 'd' not in positions:
+            raise ValidationError({'since': ['Invalid sync token.']})
+        # Only the deletions position ages out: tombstones older than the
+        # retention are pruned. The row positions may be far older on a
+        # roster nobody has changed in a while, and still page fine
+        if positions['d'][0] < now - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS):
+            raise SyncTokenExpired()
+    else:
+        positions = {'d': (horizon, 0)}
+
+    user_rows, users_more = _changed_since(
+        users.values(*serializer.columns(extra=['id', 'updated_at'])), 'updated_at', positions.get('u'), SYNC_PAGE_SIZE)
+    deleted_rows, deleted_more = _changed_since(
+        tombstones.values('id', 'user_id', 'deleted_at'), 'deleted_at', positions.get('d'), SYNC_PAGE_SIZE)
+    company_rows, companies_more = _changed_since(
+        companies.values('id', 'name', 'updated_at'), 'updated_at', positions.get('c'), SYNC_PAGE_SIZE)
+
+    next_positions = {
+        'u': _advance(positions.get('u'), user_rows, users_more, 'updated_at', horizon),
+        'd': _advance(positions.get('d'), deleted_rows, deleted_more, 'deleted_at', horizon),
+        'c': _advance(positions.get('c'), company_rows, companies_more, 'updated_at', horizon),
+    }
+    return {
+        'users': serializer.many(user_rows),
+        'deleted': [row['user_id'] for row in deleted_rows],
+        'companies': [{'id': row['id'], 'name': row['name']} for row in company_rows],
+        'next': encode_token(next_positions),
+        'has_more': users_more or deleted_more or companies_more,
+    }
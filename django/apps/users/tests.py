@@ -0,0 +1,1132 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import tempfile
+import time
+import uuid
+from datetime import date, datetime, time as dt_time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.db import DatabaseError, connection, connections, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APITestCase
+
+from .audit import AuditLog
+from .authentication import TeamRefreshToken, get_auth_state
+from .batch import BATCH_MAX_COST, BATCH_MAX_REQUESTS, BATCH_ROWS_PER_COST, BATCH_WRITE_COST
+from .checks import check_worker_shares_state
+from .compression import CompressionMiddleware, choose_encoding
+from .deletion import schedule_company_deletion
+from .export import iter_roster_rows
+from .instrumentation import histogram
+from .jobs import JOB_HANDLERS, claim_job, report_progress, run_job
+from .models import AuditEvent, Company, CustomUser, Job, UserTombstone
+from .renderers import FastJSONRenderer
+from .routers import PIN_COOKIE, ReplicaPool, ReplicaRouter, _current_request
+from .stats import recount_company_stats
+from .sync import SYNC_OVERLAP
+from .views import CompanyViewSet
+
+
+class TeamAPITestCase(APITestCase):
+    """
+    Authenticates as a company admin with a real access token, as the app does.
+
+    The cache is cleared before each test. Every test runs inside a
+    transaction, where the roster response cache is bypassed, so the counts
+    below are for building each response; RosterCacheTests covers the cache.
+    ``warm_auth()`` caches the admin's auth state, which a client holds from
+    its first request on.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name='Acme')
+        cls.admin = CustomUser.objects.create_user(
+            username='admin', password='x', company=cls.company, role='admin', first_name='Ada', last_name='Admin',
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.authenticate(self.admin)
+
+    def authenticate(self, user):
+        token = TeamRefreshToken.for_user(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def warm_auth(self):
+        self.client.get('/api/users/current_user_role/')
+
+    @classmethod
+    def add_members(cls, count, company=None, **fields):
+        start = CustomUser.objects.count()
+        return CustomUser.objects.bulk_create([
+            CustomUser(
+                username=f'member{start + number}', company=company or cls.company,
+                first_name=f'First{number:04}', last_name=f'Last{number:04}', **fields,
+            )
+            for number in range(count)
+        ])
+
+
+class UserListQueryTests(TeamAPITestCase):
+    # The page, with its company joined, is the one query; the response
+    # cache is bypassed inside the test's transaction, so it is run each time
+    LIST_QUERIES = 1
+
+    def test_list_queries_do_not_grow_with_the_roster(self):
+        self.warm_auth()
+        with self.assertNumQueries(self.LIST_QUERIES):
+            response = self.client.get('/api/users/')
+        self.assertEqual(len(response.data['results']), 1)
+
+        self.add_members(120)
+        cache.clear()
+        self.warm_auth()
+        with self.assertNumQueries(self.LIST_QUERIES):
+            response = self.client.get('/api/users/')
+        self.assertEqual(len(response.data['results']), 50)
+        self.assertEqual(response.data['results'][0]['company'], {'id': self.company.pk, 'name': 'Acme'})
+
+    def test_list_is_scoped_to_the_company(self):
+        self.add_members(3, company=Company.objects.create(name='Other'))
+        response = self.client.get('/api/users/')
+        self.assertEqual([row['id'] for row in response.data['results']], [self.admin.pk])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class RosterCacheTests(TransactionTestCase):
+    """
+    The roster response cache and its ETags, outside a transaction as in production.
+
+    cached_response() skips the cache inside an atomic block, which a
+    TestCase wraps every test in.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.acme = Company.objects.create(name='Acme')
+        self.other = Company.objects.create(name='Other')
+        self.admin = CustomUser.objects.create_user(username='admin', password='x', company=self.acme, role='admin')
+        self.other_admin = CustomUser.objects.create_user(username='other', password='x', company=self.other, role='admin')
+        self.member = CustomUser.objects.create_user(username='member', password='x', company=self.acme)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {TeamRefreshToken.for_user(user).access_token}')
+        return client
+
+    def get(self, user, **headers):
+        return self.client_for(user).get('/api/users/', **headers)
+
+    def etag(self, user=None):
+        response = self.get(user or self.admin)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_response_carries_an_etag(self):
+        etag = self.etag()
+        self.assertTrue(etag.startswith('"'))
+        self.assertEqual(self.etag(), etag)
+
+    def test_matching_etag_is_answered_without_reading_users(self):
+        etag = self.etag()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(self.admin, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        table = CustomUser._meta.db_table
+        self.assertFalse([query['sql'] for query in queries if table in query['sql']])
+
+    def test_weak_etag_of_a_compressed_response_is_answered_with_304(self):
+        CustomUser.objects.bulk_create([
+            CustomUser(username=f'extra{number}', company=self.acme, first_name=f'First{number:04}') for number in range(40)
+        ])
+        response = self.get(self.admin, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        for encoding in ('gzip', 'br', 'identity'):
+            with self.subTest(encoding=encoding):
+                response = self.get(self.admin, HTTP_IF_NONE_MATCH=etag, HTTP_ACCEPT_ENCODING=encoding)
+                self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_after_a_patch(self):
+        etag = self.etag()
+        response = self.client_for(self.admin).patch(f'/api/users/{self.member.pk}/', {'first_name': 'Changed'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(self.etag(), etag)
+        self.assertEqual(self.get(self.admin, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_changes_after_a_bulk_update(self):
+        etag = self.etag()
+        response = self.client_for(self.admin).patch('/api/users/bulk/', [{'id': self.member.pk, 'last_name': 'Changed'}], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(self.etag(), etag)
+
+    def test_etag_changes_after_a_company_rename(self):
+        etag = self.etag()
+        staff = CustomUser.objects.create_user(username='staff', password='x', is_staff=True)
+        response = self.client_for(staff).patch(f'/api/companies/{self.acme.pk}/', {'name': 'Acme Ltd'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(self.etag(), etag)
+
+    def test_moving_a_member_invalidates_both_companies(self):
+        acme_etag, other_etag = self.etag(), self.etag(self.other_admin)
+        self.member.company = self.other
+        self.member.save()
+        self.assertNotEqual(self.etag(), acme_etag)
+        self.assertNotEqual(self.etag(self.other_admin), other_etag)
+        self.assertNotIn('member', [row['username'] for row in self.get(self.admin).data['results']])
+
+
+class KeysetPaginationTests(TeamAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Many members share a last name, and some a first name too, so the
+        # cursor has to carry the id to step over the ties
+        CustomUser.objects.bulk_create([
+            CustomUser(
+                username=f'tie{number}', company=cls.company,
+                first_name='Sam' if number % 3 else 'Alex', last_name='Smith' if number < 25 else 'Jones',
+            )
+            for number in range(40)
+        ])
+        cls.expected = list(
+            CustomUser.objects.filter(company=cls.company)
+            .order_by('last_name', 'first_name', 'id').values_list('id', flat=True)
+        )
+
+    def walk(self, url, link):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([row['id'] for row in response.data['results']])
+            url = response.data[link]
+        return pages
+
+    def test_forward_then_back_visits_every_member_once_in_order(self):
+        forward = self.walk('/api/users/?page_size=7', 'next')
+        self.assertEqual([user_id for page in forward for user_id in page], self.expected)
+        self.assertEqual([len(page) for page in forward], [7, 7, 7, 7, 7, 6])
+
+        last_page = self.client.get('/api/users/?page_size=7')
+        while last_page.data['next']:
+            last_page = self.client.get(last_page.data['next'])
+        back = self.walk(last_page.data['previous'], 'previous')
+        self.assertEqual(back, forward[-2::-1])
+
+    def test_page_queries_do_not_grow_with_depth(self):
+        self.warm_auth()
+        response = self.client.get('/api/users/?page_size=7')
+        for _ in range(4):
+            response = self.client.get(response.data['next'])
+        with self.assertNumQueries(UserListQueryTests.LIST_QUERIES):
+            self.client.get(response.data['next'])
+
+    def test_invalid_cursor_is_not_found(self):
+        self.assertEqual(self.client.get('/api/users/?cursor=bogus').status_code, 404)
+
+
+class EndpointQueryCountTests(TeamAPITestCase):
+    """
+    Query budgets for the hot roster endpoints, which must not grow with the roster.
+
+    benchmark_endpoints and check_query_plans measure latency and plans on
+    large seeded datasets; these are the query counts CI holds them to.
+    """
+
+    def assert_queries_constant(self, queries, url, read=lambda response: response):
+        for members in (0, 150):
+            self.add_members(members)
+            cache.clear()
+            self.warm_auth()
+            with self.assertNumQueries(queries):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                read(response)
+        return response
+
+    def test_list(self):
+        self.assert_queries_constant(1, '/api/users/')
+
+    def test_list_with_sparse_fields(self):
+        response = self.assert_queries_constant(1, '/api/users/?fields=id,last_name')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'last_name'})
+
+    def test_search(self):
+        response = self.assert_queries_constant(1, '/api/users/search/?q=last')
+        self.assertEqual(len(response.data['results']), 10)
+
+    def test_changes(self):
+        # One page each of members, deletions and companies
+        response = self.assert_queries_constant(3, '/api/users/changes/')
+        self.assertEqual(len(response.data['users']), 151)
+
+    def test_export(self):
+        # The rows are read while the response streams, in one query per chunk
+        content = []
+        self.assert_queries_constant(
+            1, '/api/users/export/?file_format=ndjson', lambda response: content.append(b''.join(response.streaming_content)),
+        )
+        self.assertEqual(len(content[-1].splitlines()), 151)
+
+
+class ExportTests(TeamAPITestCase):
+
+    def export(self, export_format):
+        response = self.client.get(f'/api/users/export/?file_format={export_format}')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_quotes_cells_a_spreadsheet_would_evaluate(self):
+        CustomUser.objects.filter(pk=self.admin.pk).update(
+            first_name='=HYPERLINK("http://example.com")', last_name='@SUM(A1)', phone_number='+15550001111',
+        )
+        header, row = csv.reader(io.StringIO(self.export('csv')))
+        values = dict(zip(header, row))
+        self.assertEqual(values['first_name'], '\'=HYPERLINK("http://example.com")')
+        self.assertEqual(values['last_name'], "'@SUM(A1)")
+        self.assertEqual(values['phone_number'], "'+15550001111")
+        self.assertEqual(values['username'], 'admin')
+
+    def test_ndjson_is_not_quoted(self):
+        CustomUser.objects.filter(pk=self.admin.pk).update(first_name='=1+1')
+        self.assertEqual(json.loads(self.export('ndjson'))['first_name'], '=1+1')
+
+
+class ASGIExportTests(TransactionTestCase):
+    """Reads an export through Django's ASGI handler, as uvicorn would."""
+
+    def setUp(self):
+        company = Company.objects.create(name='Acme')
+        self.admin = CustomUser.objects.create_user(username='admin', password='x', company=company, role='admin')
+        CustomUser.objects.bulk_create([
+            CustomUser(username=f'member{number}', company=company) for number in range(150)
+        ])
+        cache.clear()
+
+    def request(self, path, query_string):
+        token = TeamRefreshToken.for_user(self.admin).access_token
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+            'method': 'GET', 'path': path, 'query_string': query_string,
+            'headers': [(b'host', b'testserver'), (b'authorization', f'Bearer {token}'.encode())],
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        messages = []
+        received = []
+
+        async def receive():
+            if received:
+                # Stay connected until the handler has sent the response
+                await asyncio.Event().wait()
+            received.append(True)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append((message, len(self.rows_read)))
+
+        async_to_sync(ASGIHandler())(scope, receive, send)
+        return messages
+
+    def test_rows_are_sent_before_the_roster_has_been_read(self):
+        self.rows_read = []
+
+        def counted_rows(queryset):
+            for row in iter_roster_rows(queryset):
+                self.rows_read.append(row)
+                yield row
+
+        with mock.patch('apps.users.export.iter_roster_rows', counted_rows), \
+                mock.patch('apps.users.export.EXPORT_ASYNC_BATCH_SIZE', 10):
+            messages = self.request('/api/users/export/', b'file_format=ndjson')
+
+        (start, _), *bodies = messages
+        self.assertEqual(start['status'], 200)
+        # The first rows went out while most of the roster was still unread
+        rows_read = next(read for message, read in bodies if message.get('body'))
+        self.assertLess(rows_read, 151)
+        self.assertEqual(len(b''.join(message.get('body', b'') for message, _ in bodies).splitlines()), 151)
+
+
+class SearchTests(TeamAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.maria = CustomUser.objects.create(
+            username='maria', company=cls.company, first_name='Maria', last_name='Delgado',
+            email='maria.delgado@acme.example.com', phone_number='+15550001111',
+        )
+        cls.mario = CustomUser.objects.create(
+            username='mario', company=cls.company, first_name='Mario', last_name='Rossi',
+            email='mrossi@acme.example.com', phone_number='+15550002222',
+        )
+        other = Company.objects.create(name='Other')
+        CustomUser.objects.create(username='marianne', company=other, first_name='Marianne', last_name='Dupont')
+
+    def search(self, query):
+        response = self.client.get('/api/users/search/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.data['results']]
+
+    def test_prefix_of_any_field(self):
+        self.assertEqual(self.search('mari'), [self.maria.pk, self.mario.pk])
+        self.assertEqual(self.search('ross'), [self.mario.pk])
+        self.assertEqual(self.search('maria.del'), [self.maria.pk])
+        self.assertEqual(self.search('+1555000222'), [self.mario.pk])
+
+    def test_is_case_and_whitespace_insensitive(self):
+        self.assertEqual(self.search('  DELGADO '), [self.maria.pk])
+
+    def test_exact_match_ranks_first(self):
+        self.assertEqual(self.search('mario')[0], self.mario.pk)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Substring matching needs the trigram indexes')
+    def test_substring(self):
+        self.assertEqual(self.search('elgad'), [self.maria.pk])
+        self.assertEqual(self.search('0002222'), [self.mario.pk])
+
+    def test_is_scoped_to_the_company(self):
+        self.assertNotIn('Marianne', [row['first_name'] for row in self.client.get('/api/users/search/?q=mari').data['results']])
+        self.assertEqual(self.search('dupont'), [])
+
+    def test_blank_query_matches_nothing_without_querying(self):
+        self.warm_auth()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search('   '), [])
+
+    def test_limit(self):
+        self.add_members(30)
+        response = self.client.get('/api/users/search/', {'q': 'first', 'limit': 5})
+        self.assertEqual(len(response.data['results']), 5)
+        response = self.client.get('/api/users/search/', {'q': 'first', 'limit': 500})
+        self.assertEqual(len(response.data['results']), 30)
+
+    def test_one_query_however_many_match(self):
+        self.warm_auth()
+        with self.assertNumQueries(1):
+            self.search('mari')
+        self.add_members(200)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.search('first')), 10)
+
+
+class AdminChangelistTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = CustomUser.objects.create_superuser(
+            username='root', password='x', email='root@example.com', role='admin',
+        )
+        company = Company.objects.create(name='Acme')
+        CustomUser.objects.bulk_create([
+            CustomUser(username=f'member{number}', company=company, last_name=f'Last{number:02}') for number in range(12)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.superuser)
+
+    def get_changelist(self, query=''):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(f'/admin/users/customuser/{query}')
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in captured]
+
+    def test_count_is_exact_below_the_limit(self):
+        response, _ = self.get_changelist('?role__exact=regular')
+        self.assertEqual(response.context['cl'].result_count, 12)
+
+    @mock.patch('apps.users.admin._plan_estimate', return_value=1_000_000)
+    @mock.patch('apps.users.admin.EXACT_COUNT_LIMIT', 5)
+    def test_count_stops_at_the_limit(self, plan_estimate):
+        response, queries = self.get_changelist('?role__exact=regular')
+        counts = [sql for sql in queries if 'COUNT(' in sql.upper()]
+        self.assertTrue(counts)
+        # Every count is cut off past the limit; none reads every matching row
+        for sql in counts:
+            self.assertIn('LIMIT 6', sql.upper())
+        # The limit itself, or PostgreSQL's estimate past it
+        self.assertGreaterEqual(response.context['cl'].result_count, 5)
+        self.assertEqual(len(response.context['cl'].result_list), 12)
+
+    @mock.patch('apps.users.admin._plan_estimate', return_value=1_000_000)
+    @mock.patch('apps.users.admin.EXACT_COUNT_LIMIT', 5)
+    def test_page_queries_do_not_grow_with_the_table(self, plan_estimate):
+        # Session, user, the bounded count, the page with its companies
+        # joined, and the company filter's choices
+        with self.assertNumQueries(6):
+            self.get_changelist('?role__exact=regular')
+        CustomUser.objects.bulk_create([CustomUser(username=f'extra{number}') for number in range(300)])
+        with self.assertNumQueries(6):
+            self.get_changelist('?role__exact=regular')
+
+
+class DeltaSyncTests(TeamAPITestCase):
+
+    def sync(self, since=None):
+        response = self.client.get('/api/users/changes/', {'since': since} if since else {})
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_first_sync_of_a_long_unchanged_roster_completes(self):
+        members = self.add_members(600)
+        long_ago = timezone.now() - timedelta(days=90)
+        CustomUser.objects.filter(pk__in=[member.pk for member in members]).update(updated_at=long_ago)
+        Company.objects.filter(pk=self.company.pk).update(updated_at=long_ago)
+
+        first = self.sync()
+        self.assertTrue(first['has_more'])
+        second = self.sync(first['next'])
+        self.assertFalse(second['has_more'])
+        self.assertEqual(len(first['users']) + len(second['users']), 601)
+
+    def test_token_expires_with_its_deletions_position(self):
+        token = self.sync()['next']
+        with mock.patch('apps.users.sync.timezone.now', return_value=timezone.now() + timedelta(days=31)):
+            response = self.client.get('/api/users/changes/', {'since': token})
+        self.assertEqual(response.status_code, 410)
+
+    def test_bulk_delete_reports_deletions_with_one_tombstone_insert(self):
+        token = self.sync()['next']
+        members = self.add_members(30)
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.delete('/api/users/bulk/', {'ids': [member.pk for member in members]}, format='json')
+        self.assertEqual(response.status_code, 204)
+        inserts = [query for query in captured if query['sql'].startswith('INSERT INTO "users_usertombstone"')]
+        self.assertEqual(len(inserts), 1)
+
+        later = timezone.now() + SYNC_OVERLAP + timedelta(seconds=1)
+        with mock.patch('apps.users.sync.timezone.now', return_value=later):
+            changes = self.sync(token)
+        self.assertEqual(sorted(changes['deleted']), sorted(member.pk for member in members))
+
+
+class BulkTests(TeamAPITestCase):
+
+    def test_update_rejects_rows_that_are_not_objects(self):
+        response = self.client.patch(
+            '/api/users/bulk/', [self.admin.pk, {'id': self.admin.pk, 'first_name': 'Ann'}], format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['errors'], [{'index': 0, 'errors': {'detail': 'Expected an object.'}}])
+
+    def test_weak_passwords_are_row_errors(self):
+        response = self.client.post(
+            '/api/users/bulk/', [{'username': 'ok', 'password': 'Hard-to-guess-91'}, {'username': 'weak', 'password': '1234'}],
+            format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1])
+        self.assertIn('password', response.data['errors'][0]['errors'])
+        self.assertFalse(CustomUser.objects.filter(username='ok').exists())
+
+    def test_single_updates_validate_passwords(self):
+        response = self.client.patch(f'/api/users/{self.admin.pk}/', {'password': 'admin123'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', response.data)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], PASSWORD_HASHING_WORKERS=1)
+class BackgroundBulkTests(TeamAPITestCase):
+
+    def test_passwords_are_queued_as_secrets_and_cleared(self):
+        rows = [{'username': f'new{number}', 'password': f'Hard-to-guess-{number}'} for number in range(10)]
+        response = self.client.post('/api/users/bulk/?background=true', rows, format='json')
+        self.assertEqual(response.status_code, 202)
+        job = Job.objects.get(pk=response.data['id'])
+        self.assertNotIn('password', json.dumps(job.payload))
+
+        progress = []
+        with mock.patch('apps.users.background.report_progress', side_effect=lambda job, done, **kwargs: progress.append(done)):
+            run_job(claim_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertIsNone(job.secrets)
+        self.assertTrue(CustomUser.objects.get(username='new7').check_password('Hard-to-guess-7'))
+        # The lease is renewed after each chunk of hashes, not only at the ends
+        self.assertGreater(len(progress), 3)
+
+    def test_a_worker_failing_after_the_commit_does_not_run_the_job_again(self):
+        rows = [{'username': f'new{number}'} for number in range(3)]
+        self.client.post('/api/users/bulk/?background=true', rows, format='json')
+        handler = import_string(JOB_HANDLERS['users.bulk_create'])
+
+        def handler_then_lose_connection(job):
+            handler(job)
+            raise DatabaseError('server closed the connection unexpectedly')
+
+        with mock.patch('apps.users.jobs.import_string', return_value=handler_then_lose_connection):
+            job = run_job(claim_job())
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(len(job.result), 3)
+        self.assertIsNone(claim_job())
+        self.assertEqual(CustomUser.objects.filter(username__startswith='new').count(), 3)
+
+
+class CompanySaveTests(TeamAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.staff = CustomUser.objects.create_user(username='staff', password='x', is_staff=True, role='admin')
+        self.authenticate(self.staff)
+
+    def test_rename_keeps_a_member_added_concurrently(self):
+        member_count = Company.objects.get(pk=self.company.pk).member_count
+        update = CompanyViewSet.perform_update
+
+        def add_member_then_update(view, serializer):
+            # Another request adds a member after this one loaded the company
+            CustomUser.objects.create_user(username='joiner', company=self.company)
+            update(view, serializer)
+
+        with mock.patch.object(CompanyViewSet, 'perform_update', add_member_then_update):
+            response = self.client.patch(f'/api/companies/{self.company.pk}/', {'name': 'Acme Ltd'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        company = Company.objects.get(pk=self.company.pk)
+        self.assertEqual(company.name, 'Acme Ltd')
+        self.assertEqual(company.member_count, member_count + 1)
+
+    def test_saving_a_stale_copy_keeps_the_deletion_flag(self):
+        stale = Company.objects.get(pk=self.company.pk)
+        Company.objects.filter(pk=self.company.pk).update(deleting=True)
+        stale.name = 'Renamed'
+        stale.save()
+        company = Company.objects.get(pk=self.company.pk)
+        self.assertEqual(company.name, 'Renamed')
+        self.assertTrue(company.deleting)
+
+    def test_insert_writes_the_counters(self):
+        company = Company.objects.create(name='Fresh', member_count=3)
+        self.assertEqual(Company.objects.get(pk=company.pk).member_count, 3)
+
+
+class WorkerCheckTests(TestCase):
+
+    @override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        ROSTER_EVENT_BROKER='apps.users.events.InProcessBroker',
+    )
+    def test_per_process_cache_and_broker_are_errors_for_the_worker(self):
+        errors = check_worker_shares_state(None)
+        self.assertEqual([error.id for error in errors], ['users.E001', 'users.E002'])
+
+    @override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://redis:6379/0'}},
+        ROSTER_EVENT_BROKER='apps.users.events.RedisBroker',
+    )
+    def test_shared_cache_and_broker_pass(self):
+        self.assertEqual(check_worker_shares_state(None), [])
+
+
+class ServerTimingTests(TeamAPITestCase):
+
+    def test_hidden_from_members(self):
+        response = self.client.get('/api/users/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+
+    def test_sent_to_staff(self):
+        self.authenticate(CustomUser.objects.create_user(username='staff', password='x', is_staff=True))
+        response = self.client.get('/api/users/')
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    @override_settings(PERF_SERVER_TIMING=True)
+    def test_sent_to_everyone_when_enabled(self):
+        self.assertIn('db;dur=', self.client.get('/api/users/')['Server-Timing'])
+
+    def test_histogram_is_fed_either_way(self):
+        histogram.reset()
+        self.client.get('/api/users/')
+        self.assertEqual(sum(route['count'] for route in histogram.snapshot().values()), 1)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class TokenRevocationTests(TeamAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.member = CustomUser.objects.create_user(username='member', password='Old-password-1', company=self.company)
+        self.authenticate(self.member)
+        # Caches the member's auth state, as any client's first request does
+        self.assertEqual(self.client.get('/api/users/current_user_role/').status_code, 200)
+
+    def change_member(self, **fields):
+        member = CustomUser.objects.get(pk=self.member.pk)
+        for name, value in fields.items():
+            setattr(member, name, value)
+        with self.captureOnCommitCallbacks(execute=True):
+            member.save()
+
+    def as_admin(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {TeamRefreshToken.for_user(self.admin).access_token}')
+        return client
+
+    def assert_revoked(self):
+        self.assertEqual(self.client.get('/api/users/current_user_role/').status_code, 401)
+        member = CustomUser.objects.get(pk=self.member.pk)
+        if member.is_active:
+            # A token issued after the change works
+            self.authenticate(member)
+            self.assertEqual(self.client.get('/api/users/current_user_role/').status_code, 200)
+
+    def test_role_change_revokes_tokens(self):
+        self.change_member(role='admin')
+        self.assert_revoked()
+
+    def test_company_change_revokes_tokens(self):
+        self.change_member(company=Company.objects.create(name='Other'))
+        self.assert_revoked()
+
+    def test_deactivation_revokes_tokens(self):
+        self.change_member(is_active=False)
+        self.assert_revoked()
+
+    def test_role_change_in_a_bulk_update_revokes_tokens(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.as_admin().patch('/api/users/bulk/', [{'id': self.member.pk, 'role': 'admin'}], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assert_revoked()
+
+    def test_deletion_revokes_tokens(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.as_admin().delete(f'/api/users/{self.member.pk}/').status_code, 204)
+        self.assertEqual(self.client.get('/api/users/current_user_role/').status_code, 401)
+
+    def test_password_change_revokes_tokens(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.as_admin().patch(
+                f'/api/users/{self.member.pk}/', {'password': 'New-password-2'}, format='json',
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assert_revoked()
+
+    def test_password_change_in_a_bulk_update_revokes_tokens(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.as_admin().patch(
+                '/api/users/bulk/', [{'id': self.member.pk, 'password': 'New-password-2'}], format='json',
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assert_revoked()
+
+    def test_other_changes_keep_tokens(self):
+        self.change_member(first_name='Renamed', phone_number='+15550001111')
+        self.assertEqual(self.client.get('/api/users/current_user_role/').status_code, 200)
+
+    def test_staff_and_superusers_keep_their_access(self):
+        self.authenticate(CustomUser.objects.create_user(username='staff', password='x', is_staff=True))
+        self.assertEqual(self.client.get('/api/companies/').status_code, 200)
+
+        self.add_members(2, company=Company.objects.create(name='Other'))
+        self.authenticate(CustomUser.objects.create_user(
+            username='root', password='x', is_staff=True, is_superuser=True, role='admin',
+        ))
+        response = self.client.get('/api/users/')
+        self.assertEqual(response.status_code, 200)
+        # Every company's members, not just one
+        self.assertEqual(len(response.data['results']), CustomUser.objects.count())
+        self.assertEqual(self.client.get('/api/companies/').status_code, 200)
+
+
+class AuthStateCacheTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='member', company=Company.objects.create(name='Acme'))
+
+    def test_cleared_on_commit_and_kept_on_rollback(self):
+        state = get_auth_state(self.user.pk)
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            user = CustomUser.objects.get(pk=self.user.pk)
+            user.role = 'admin'
+            user.save()
+            raise RuntimeError
+        with self.assertNumQueries(0):
+            self.assertEqual(get_auth_state(self.user.pk), state)
+
+        user = CustomUser.objects.get(pk=self.user.pk)
+        user.role = 'admin'
+        user.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_auth_state(self.user.pk), (state[0] + 1, True))
+
+
+class BatchTests(TeamAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.member = CustomUser.objects.create_user(username='member', company=cls.company, first_name='Mia')
+
+    def batch(self, requests, atomic=False):
+        return self.client.post('/api/batch/', {'requests': requests, 'atomic': atomic}, format='json')
+
+    def test_atomic_batch_rolls_back_earlier_requests_when_one_fails(self):
+        response = self.batch([
+            {'method': 'PATCH', 'path': f'/api/users/{self.member.pk}/', 'body': {'first_name': 'Changed'}},
+            {'method': 'POST', 'path': '/api/users/bulk/', 'body': [{'username': 'new1'}, {'email': 'not an email'}]},
+            {'method': 'DELETE', 'path': f'/api/users/{self.member.pk}/'},
+        ], atomic=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['responses']], [200, 400, 424])
+        self.assertFalse(response.data['committed'])
+        self.assertEqual(CustomUser.objects.get(pk=self.member.pk).first_name, 'Mia')
+        self.assertFalse(CustomUser.objects.filter(username='new1').exists())
+
+    def test_batch_that_is_not_atomic_keeps_what_succeeded(self):
+        response = self.batch([
+            {'method': 'PATCH', 'path': f'/api/users/{self.member.pk}/', 'body': {'first_name': 'Changed'}},
+            {'method': 'PATCH', 'path': '/api/users/0/', 'body': {'first_name': 'Nobody'}},
+        ])
+        self.assertEqual([result['status'] for result in response.data['responses']], [200, 404])
+        self.assertEqual(CustomUser.objects.get(pk=self.member.pk).first_name, 'Changed')
+
+    def test_limits_are_checked_before_anything_runs(self):
+        patch = {'method': 'PATCH', 'path': f'/api/users/{self.member.pk}/', 'body': {'first_name': 'Changed'}}
+        too_many = [patch] + [{'method': 'GET', 'path': '/api/users/'}] * BATCH_MAX_REQUESTS
+        # Each write costs BATCH_WRITE_COST, and the rows of a bulk call add to it
+        rows = [{'username': f'new{number}'} for number in range(BATCH_ROWS_PER_COST * 2)]
+        too_costly = [patch] * (BATCH_MAX_COST // BATCH_WRITE_COST - 1) + [
+            {'method': 'POST', 'path': '/api/users/bulk/', 'body': rows},
+        ]
+        for requests in (too_many, too_costly):
+            with mock.patch('apps.users.batch.run_request') as run_request:
+                response = self.batch(requests)
+            self.assertEqual(response.status_code, 400)
+            run_request.assert_not_called()
+        self.assertEqual(CustomUser.objects.get(pk=self.member.pk).first_name, 'Mia')
+
+    def test_batches_cannot_be_nested(self):
+        for path in ('/api/batch/', '/api/batch/?atomic=true'):
+            response = self.batch([
+                {'method': 'GET', 'path': '/api/users/'},
+                {'method': 'POST', 'path': path, 'body': {'requests': [{'method': 'GET', 'path': '/api/users/'}]}},
+            ])
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data['errors'][0]['index'], 1)
+
+    def test_each_request_keeps_the_permissions_of_its_route(self):
+        self.authenticate(self.member)
+        response = self.batch([
+            {'method': 'GET', 'path': '/api/users/'},
+            {'method': 'PATCH', 'path': f'/api/users/{self.admin.pk}/', 'body': {'role': 'regular'}},
+            {'method': 'DELETE', 'path': f'/api/users/{self.admin.pk}/'},
+            {'method': 'POST', 'path': '/api/users/bulk/', 'body': [{'username': 'new1'}]},
+            {'method': 'GET', 'path': '/api/companies/'},
+        ])
+        self.assertEqual([result['status'] for result in response.data['responses']], [200, 403, 403, 403, 403])
+        self.assertEqual(CustomUser.objects.get(pk=self.admin.pk).role, 'admin')
+        self.assertFalse(CustomUser.objects.filter(username='new1').exists())
+
+
+class AuditLogTests(TestCase):
+    """A private AuditLog writing to a temporary directory, flushed by hand rather than by its thread."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name='Acme')
+        cls.member = CustomUser.objects.create_user(username='member', company=cls.company)
+
+    def setUp(self):
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(AUDIT_LOG_DIR=self.directory, AUDIT_FLUSH_SECONDS=3600, AUDIT_FLUSH_SIZE=1000))
+        # Nothing to flush at exit; the directory is gone by then
+        self.enterContext(mock.patch('apps.users.audit.atexit.register'))
+
+    def segments(self):
+        segments = {}
+        for name in os.listdir(self.directory):
+            with open(os.path.join(self.directory, name)) as segment:
+                segments[name] = segment.read().splitlines()
+        return segments
+
+    def record(self, log, count):
+        for number in range(count):
+            log.record('user.updated', None, self.member, {'first_name': ['Mia', f'Mia{number}']})
+
+    def test_events_reach_the_table_after_a_flush(self):
+        log = AuditLog()
+        self.record(log, 3)
+        self.assertFalse(AuditEvent.objects.exists())
+        self.assertEqual(sum(map(len, self.segments().values())), 3)
+
+        log.flush()
+        self.assertEqual(AuditEvent.objects.filter(target_id=self.member.pk).count(), 3)
+        # Only the fresh, empty segment is left
+        self.assertEqual(list(self.segments().values()), [[]])
+
+    def test_replay_after_a_crash_inserts_each_event_once(self):
+        crashed = AuditLog()
+        self.record(crashed, 2)
+        # The process dies: its lock goes, its segment and buffer are never flushed
+        crashed._segment.close()
+        (name, lines), = self.segments().items()
+        # A copy, as if an earlier replay inserted it but died before removing it
+        with open(os.path.join(self.directory, f'copy-{name}'), 'w') as copy:
+            copy.write('\n'.join(lines) + '\n')
+
+        survivor = AuditLog()
+        self.record(survivor, 1)
+        survivor.replay()
+        self.assertEqual(AuditEvent.objects.count(), 2)
+        # Only the survivor's own segment, still in use, is left
+        self.assertEqual(len(self.segments()), 1)
+        survivor.replay()
+        survivor.flush()
+        self.assertEqual(AuditEvent.objects.count(), 3)
+
+    def test_a_failed_insert_keeps_the_segment(self):
+        log = AuditLog()
+        self.record(log, 2)
+        with mock.patch('apps.users.audit._insert', side_effect=DatabaseError('connection refused')):
+            log.flush()
+        self.assertFalse(AuditEvent.objects.exists())
+        self.assertEqual(sorted(map(len, self.segments().values())), [0, 2])
+
+        # Unlocked once the flush gave up, so the next pass replays it
+        log.replay()
+        self.assertEqual(AuditEvent.objects.count(), 2)
+        self.assertEqual(list(self.segments().values()), [[]])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Routes reads to replica_0, a second alias over the default connection's database.
+
+    As with a TEST MIRROR, both aliases see the same rows; the queries are
+    told apart by the connection wrapper they ran on. A TransactionTestCase,
+    since the router keeps every read inside a transaction on the primary.
+    """
+    client_class = APIClient
+
+    def setUp(self):
+        cache.clear()
+        self.company = Company.objects.create(name='Acme')
+        self.admin = CustomUser.objects.create_user(username='admin', password='x', company=self.company, role='admin')
+        self.member = CustomUser.objects.create_user(username='member', password='x', company=self.company)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {TeamRefreshToken.for_user(self.admin).access_token}')
+
+        primary = connections['default']
+        primary.ensure_connection()
+        self.replica = connections.create_connection('default')
+        self.replica.alias = 'replica_0'
+        self.replica.connection = primary.connection
+        connections['replica_0'] = self.replica
+        self.addCleanup(connections.__delitem__, 'replica_0')
+        self.enterContext(mock.patch('apps.users.routers.REPLICA_ALIASES', ['replica_0']))
+        self.enterContext(mock.patch('apps.users.cache.REPLICA_ALIASES', ['replica_0']))
+        self.enterContext(mock.patch('apps.users.routers.replicas', ReplicaPool(['replica_0'])))
+
+    def queries(self, method, path, **kwargs):
+        """Send the request; returns it with the SQL run on the primary and on the replica."""
+        with CaptureQueriesContext(connections['default']) as primary, CaptureQueriesContext(self.replica) as replica:
+            response = getattr(self.client, method)(path, format='json', **kwargs)
+        return response, [query['sql'] for query in primary], [query['sql'] for query in replica]
+
+    def test_roster_reads_go_to_the_replica(self):
+        response, primary, replica = self.queries('get', '/api/users/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertTrue(replica)
+
+    def test_writes_go_to_the_primary_and_pin_the_client(self):
+        response, primary, replica = self.queries('patch', f'/api/users/{self.member.pk}/', data={'first_name': 'Changed'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(replica, [])
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+    def test_pinned_client_reads_from_the_primary_until_the_pin_expires(self):
+        self.client.patch(f'/api/users/{self.member.pk}/', {'first_name': 'Changed'}, format='json')
+        # Search, as the list would come from the response cache
+        response, primary, replica = self.queries('get', '/api/users/search/?q=changed')
+        self.assertEqual(replica, [])
+        self.assertEqual([row['id'] for row in response.data['results']], [self.member.pk])
+
+        with mock.patch('apps.users.routers.time.time', return_value=time.time() + settings.REPLICA_PIN_SECONDS + 1):
+            response, primary, replica = self.queries('get', '/api/users/search/?q=changed')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(replica)
+
+    def test_reads_inside_a_transaction_go_to_the_primary(self):
+        request = RequestFactory().get('/api/users/')
+        request.resolver_match = resolve('/api/users/')
+        token = _current_request.set(request)
+        self.addCleanup(_current_request.reset, token)
+        self.assertEqual(ReplicaRouter().db_for_read(CustomUser), 'replica_0')
+        with transaction.atomic():
+            self.assertIsNone(ReplicaRouter().db_for_read(CustomUser))
+
+    def test_auth_state_is_never_read_from_a_replica(self):
+        response, primary, replica = self.queries('get', '/api/users/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue([sql for sql in primary if 'token_version' in sql])
+        self.assertFalse([sql for sql in replica if 'token_version' in sql])
+
+
+class RendererTests(TestCase):
+
+    DATA = {
+        'created_at': datetime(2024, 3, 1, 12, 30, 45, 123456, tzinfo=dt_timezone.utc),
+        'offset': datetime(2024, 3, 1, 12, 30, 45, tzinfo=dt_timezone(timedelta(hours=-5))),
+        'naive': datetime(2024, 3, 1, 12, 30),
+        'day': date(2024, 3, 1),
+        'at': dt_time(9, 15, 30, 500000),
+        'amount': Decimal('1234.50'),
+        'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'name': 'Zoë Ødegaard 東京 \U0001f600',
+        'separators': 'a\u2028b\u2029c',
+        'nested': [{'on': True, 'off': False, 'none': None, 'ratio': 0.25}],
+    }
+
+    def test_bytes_match_json_renderer(self):
+        for data in (self.DATA, [self.DATA, self.DATA], 'plain', []):
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_bytes_match_json_renderer_without_orjson(self):
+        with mock.patch('apps.users.renderers.orjson', None):
+            self.assertEqual(FastJSONRenderer().render(self.DATA), JSONRenderer().render(self.DATA))
+
+
+class CompressionTests(TeamAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Comfortably over COMPRESSION_MIN_BYTES
+        cls.add_members(40)
+
+    def test_encoding_follows_q_values(self):
+        cases = {
+            'gzip': 'gzip',
+            'br': 'br',
+            'gzip, br': 'br',
+            'gzip;q=1.0, br;q=0.5': 'gzip',
+            'br;q=0.8, gzip;q=0.8': 'br',
+            'BR;Q=1': 'br',
+            'gzip;q=0, br;q=0': None,
+            'br;q=0, gzip;q=0.1': 'gzip',
+            'identity': None,
+            'gzip;q=nonsense, br;q=0.2': 'br',
+            '': None,
+        }
+        for header, encoding in cases.items():
+            with self.subTest(header=header):
+                self.assertEqual(choose_encoding(header), encoding)
+
+    def test_gzip_without_brotli(self):
+        with mock.patch('apps.users.compression.brotli', None):
+            self.assertEqual(choose_encoding('br'), None)
+            self.assertEqual(choose_encoding('br, gzip;q=0.1'), 'gzip')
+
+    def test_responses_are_compressed_as_negotiated(self):
+        for header, encoding in (('br;q=0.5, gzip', 'gzip'), ('gzip, br', 'br'), ('identity', None)):
+            with self.subTest(header=header):
+                response = self.client.get('/api/users/?limit=100', HTTP_ACCEPT_ENCODING=header)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.get('Content-Encoding'), encoding)
+                self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_event_streams_are_never_compressed(self):
+        events = [b'event: user.updated\ndata: {"id": %d}\n\n' % number for number in range(200)]
+        request = RequestFactory().get('/api/users/events/', HTTP_ACCEPT_ENCODING='gzip, br')
+        for response in (
+            StreamingHttpResponse(iter(events), content_type='text/event-stream'),
+            HttpResponse(b''.join(events), content_type='text/event-stream; charset=utf-8'),
+        ):
+            response = CompressionMiddleware(lambda request: response)(request)
+            self.assertFalse(response.has_header('Content-Encoding'))
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+            self.assertEqual(content, b''.join(events))
+
+
+@override_settings(COMPANY_DELETE_BATCH_SIZE=3)
+class CompanyDeletionTests(TeamAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.add_members(7, role='admin')
+        cls.staff = CustomUser.objects.create_user(username='staff', password='x', is_staff=True)
+        cls.bystander = Company.objects.create(name='Bystander')
+        cls.add_members(2, company=cls.bystander)
+        # add_members() bulk-creates, which leaves the counters alone
+        recount_company_stats()
+
+    def schedule(self):
+        self.authenticate(self.staff)
+        response = self.client.delete(f'/api/companies/{self.company.pk}/?async=true')
+        self.assertEqual(response.status_code, 202)
+        self.authenticate(self.admin)
+        return Job.objects.get(pk=response.data['id'])
+
+    def test_resumes_after_a_partial_run(self):
+        member_ids = set(CustomUser.objects.filter(company=self.company).values_list('pk', flat=True))
+        self.schedule()
+        calls = []
+
+        def fail_in_the_second_batch(job, progress, total=None):
+            calls.append(progress)
+            report_progress(job, progress, total)
+            if len(calls) == 2:
+                raise DatabaseError('server closed the connection unexpectedly')
+
+        with mock.patch('apps.users.deletion.report_progress', fail_in_the_second_batch):
+            job = run_job(claim_job())
+        self.assertEqual(job.status, Job.QUEUED)
+        # The second batch rolled back along with its progress
+        self.assertEqual(Job.objects.get(pk=job.pk).progress, 3)
+        self.assertEqual(CustomUser.objects.filter(company=self.company).count(), len(member_ids) - 3)
+        # Mid-deletion the counters still match the members left
+        self.assertEqual(recount_company_stats([self.company.pk], dry_run=True), [])
+
+        Job.objects.filter(pk=job.pk).update(run_after=None)
+        job = run_job(claim_job())
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.progress, len(member_ids))
+        self.assertFalse(Company.objects.filter(pk=self.company.pk).exists())
+        self.assertFalse(CustomUser.objects.filter(pk__in=member_ids).exists())
+        # One tombstone per member, none twice for the batch that was retried
+        tombstones = list(UserTombstone.objects.filter(company_id=self.company.pk).values_list('user_id', flat=True))
+        self.assertCountEqual(tombstones, member_ids)
+        # The other company is untouched
+        self.assertEqual(Company.objects.get(pk=self.bystander.pk).member_count, 2)
+        self.assertEqual(recount_company_stats(dry_run=True), [])
+
+    def test_writes_to_a_company_being_deleted_are_rejected(self):
+        self.schedule()
+        self.assertTrue(Company.objects.get(pk=self.company.pk).deleting)
+
+        self.authenticate(self.staff)
+        self.assertEqual(self.client.patch(f'/api/companies/{self.company.pk}/', {'name': 'Back'}, format='json').status_code, 404)
+        self.assertEqual(self.client.delete(f'/api/companies/{self.company.pk}/').status_code, 404)
+
+        self.authenticate(self.admin)
+        self.assertEqual(self.client.post('/api/users/', {'username': 'late'}, format='json').status_code, 400)
+        self.assertEqual(self.client.post('/api/users/bulk/', [{'username': 'late'}], format='json').status_code, 400)
+        self.assertFalse(CustomUser.objects.filter(username='late').exists())
+        self.assertEqual(Company.objects.get(pk=self.company.pk).name, 'Acme')
+
+    def test_scheduling_twice_queues_one_job(self):
+        first = self.schedule()
+        self.assertEqual(schedule_company_deletion(Company.objects.get(pk=self.company.pk)), first)
+        self.assertEqual(Job.objects.filter(kind='company.delete').count(), 1)
@@ -1,11 +1,16 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CustomUserViewSet, CompanyViewSet
+from .instrumentation import RequestMetricsView
+from .views import AuditEventViewSet, BatchView, CustomUserViewSet, CompanyViewSet, JobViewSet
 
 router = DefaultRouter()
 router.register(r'users', CustomUserViewSet)
 router.register(r'companies', CompanyViewSet)
+router.register(r'jobs', JobViewSet)
+router.register(r'audit-events', AuditEventViewSet)
 
 urlpatterns = [
+    path('metrics/requests/', RequestMetricsView.as_view(), name='request-metrics'),
+    path('batch/', BatchView.as_view(), name='batch'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
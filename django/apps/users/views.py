@@ -1,9 +1,37 @@
 import logging
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
+from django.contrib.auth.password_validation import validate_password
+from django.contrib.auth.tokens import default_token_generator
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils.encoding import force_str
+from django.utils.http import urlsafe_base64_decode
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from .models import CustomUser, Company
-from .serializers import CustomUserSerializer, CompanySerializer
+from rest_framework.exceptions import ValidationError
+from rest_framework.views import APIView
+from .async_views import AsyncReadMixin
+from .audit import member_values, record_member_events
+from .authentication import TeamRefreshToken
+from .batch import run_batch, validate_batch
+from .bulk import bulk_create_users, bulk_delete_users, bulk_update_users, created_users_data
+from .cache import RosterCacheMixin
+from .deletion import check_company_accepts_members, schedule_company_deletion
+from .events import publish_roster_events
+from .instrumentation import InstrumentedViewMixin
+from .jobs import enqueue_job, split_rows
+from .export import EXPORT_FORMATS, aiter_roster, stream_roster
+from .models import AuditEvent, CustomUser, Company, Job, UserTombstone
+from .pagination import AuditEventCursorPagination, KeysetCursorPagination, TeamMemberCursorPagination
+from .search import SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT, search_team_members
+from .serializers import (
+    AuditEventSerializer, CustomUserSerializer, CompanySerializer, CompanyStatsSerializer, JobSerializer,
+)
+from .sparse import SparseFieldsMixin
+from .sync import collect_changes
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
@@ -32,7 +60,7 @@ class CanManageCompanyUsers(permissions.BasePermission):
             return True
         
         # Company admins can manage users within their company
-        if request.user.is_company_admin and obj.company == request.user.company:
+        if request.user.is_company_admin and obj.company_id == request.user.company_id:
             # For DELETE and PATCH methods (delete user or change role)
             if request.method in ['DELETE', 'PATCH']:
                 return True
@@ -41,27 +69,37 @@ class CanManageCompanyUsers(permissions.BasePermission):
         
         return request.method in permissions.SAFE_METHODS
 
-class CustomUserViewSet(viewsets.ModelViewSet):
+class CustomUserViewSet(InstrumentedViewMixin, RosterCacheMixin, SparseFieldsMixin, AsyncReadMixin, viewsets.ModelViewSet):
     queryset = CustomUser.objects.all()
     serializer_class = CustomUserSerializer
     permission_classes = [permissions.IsAuthenticated, CanManageCompanyUsers]
+    pagination_class = TeamMemberCursorPagination
+    async_actions = ('list', 'retrieve', 'current_user_role')
+    # Delta sync stays on the primary: its watermarks assume no replication lag
+    replica_actions = ('list', 'retrieve', 'search', 'export')
 
     def get_queryset(self):
         user = self.request.user
+        # Join the company in the same query so the nested CompanySerializer
+        # never issues a per-row lookup
+        queryset = CustomUser.objects.select_related('company')
         if user.is_superuser:
-            return CustomUser.objects.all()
+            return queryset
         else:
-            return CustomUser.objects.filter(company=user.company)
+            return queryset.filter(company_id=user.company_id)
 
     def perform_create(self, serializer):
         # Assign the new user to the same company as the requesting user
         company = self.request.user.company
-        serializer.save(company=company)
+        check_company_accepts_members(company)
+        user = serializer.save(company=company)
+        publish_roster_events('user.created', [user])
+        record_member_events('user.created', self.request.user.pk, [(user, member_values(user))])
 
     @action(detail=True, methods=['patch'])
     def update_own_profile(self, request, pk=None):
         user = self.get_object()
-        if request.user != user:
+        if request.user.pk != user.pk:
             return Response({"detail": "You can only update your own profile."}, status=status.HTTP_403_FORBIDDEN)
         
         serializer = self.get_serializer(user, data=request.data, partial=True)
@@ -81,7 +119,147 @@ class CustomUserViewSet(viewsets.ModelViewSet):
 
     def perform_update(self, serializer):
         logger.info(f"Performing update for user {serializer.instance.username}")
-        serializer.save()
+        user = serializer.save()
+        publish_roster_events('user.updated', [user])
+
+    def perform_destroy(self, instance):
+        user_id = instance.pk
+        instance.delete()
+        # delete() clears the pk, so announce the id it had
+        instance.pk = user_id
+        publish_roster_events('user.deleted', [instance])
+        record_member_events('user.deleted', self.request.user.pk, [(instance, member_values(instance, created=False))])
+
+    @action(detail=False, methods=['post', 'patch', 'delete'])
+    def bulk(self, request):
+        # POST creates a list of members, PATCH applies a list of partial
+        # updates (each with an "id") and DELETE removes {"ids": [...]}.
+        # Every row is checked before anything is written; any failure
+        # rejects the whole batch with per-row errors.
+        if not request.user.is_superuser and not request.user.is_company_admin:
+            return Response({"detail": "You don't have permission to perform this action."}, status=status.HTTP_403_FORBIDDEN)
+
+        context = self.get_serializer_context()
+        permission = CanManageCompanyUsers()
+
+        def can_manage(user):
+            return permission.has_object_permission(request, self, user)
+
+        # With ?background=true the batch runs as a job instead; the
+        # response is the job, whose result is what this would have returned.
+        # Passwords are queued as the job's secrets, never in its payload.
+        background = request.query_params.get('background') in ('1', 'true')
+
+        if request.method == 'POST':
+            invite = request.query_params.get('invite') in ('1', 'true')
+            if background:
+                rows, passwords = split_rows(request.data)
+                return self.enqueue('users.bulk_create', {'rows': rows, 'invite': invite}, {'passwords': passwords})
+            users = bulk_create_users(request.data, request.user.company, context, invite=invite)
+            return Response(created_users_data(users, context, invite), status=status.HTTP_201_CREATED)
+
+        if request.method == 'PATCH':
+            if background:
+                rows, passwords = split_rows(request.data)
+                return self.enqueue('users.bulk_update', {'rows': rows}, {'passwords': passwords})
+            users = bulk_update_users(self.get_queryset(), request.data, can_manage, context)
+            return Response(self.get_serializer(users, many=True).data)
+
+        if 'ids' in request.query_params:
+            ids = request.query_params['ids'].split(',')
+        elif isinstance(request.data, dict):
+            ids = request.data.get('ids')
+        else:
+            ids = request.data
+        if background:
+            return self.enqueue('users.bulk_delete', {'ids': ids})
+        bulk_delete_users(self.get_queryset(), ids, can_manage, actor_id=request.user.pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def enqueue(self, kind, payload, secrets=None):
+        job = enqueue_job(kind, payload, created_by_id=self.request.user.pk, secrets=secrets)
+        return Response(JobSerializer(job, context=self.get_serializer_context()).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        # Typeahead over names, email and phone within the caller's company:
+        # ?q=<text>&limit=<n>, best matches first
+        try:
+            limit = int(request.query_params.get('limit', SEARCH_DEFAULT_LIMIT))
+        except ValueError:
+            limit = SEARCH_DEFAULT_LIMIT
+        limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+        users = search_team_members(self.get_queryset(), request.query_params.get('q', ''), limit)
+        return Response({'results': self.get_serializer(users, many=True).data})
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        # Delta sync: ?since=<token from the previous call> returns members
+        # created or changed, ids deleted and companies renamed since then,
+        # plus the token to use next time. Accepts ?fields= like the list.
+        user = request.user
+        tombstones = UserTombstone.objects.all()
+        companies = Company.objects.all()
+        if not user.is_superuser:
+            tombstones = tombstones.filter(company_id=user.company_id)
+            companies = companies.filter(pk=user.company_id)
+        return Response(collect_changes(
+            request.query_params.get('since'),
+            self.get_queryset(),
+            tombstones,
+            companies,
+            self.get_values_serializer(),
+        ))
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        # Streams the full roster visible to the caller as CSV (default),
+        # NDJSON with ?file_format=ndjson or a JSON array with
+        # ?file_format=json. Rows are read in chunks and written as they
+        # arrive, so nothing is paginated or held in memory.
+        export_format = request.query_params.get('file_format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {"detail": f"file_format must be one of: {', '.join(EXPORT_FORMATS)}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if request.query_params.get('background') in ('1', 'true'):
+            # Written to storage by a worker; download it from the job once done
+            return self.enqueue('users.export', {'file_format': export_format})
+
+        # Fix the database now; the rows are read after the request has
+        # left the routing middleware
+        queryset = self.get_queryset()
+        queryset = queryset.using(queryset.db)
+        content = stream_roster(queryset, export_format)
+        if isinstance(request._request, ASGIRequest):
+            content = aiter_roster(content)
+        response = StreamingHttpResponse(content, content_type=EXPORT_FORMATS[export_format])
+        response['Content-Disposition'] = f'attachment; filename="roster.{export_format}"'
+        return response
+
+    @action(detail=False, methods=['post'], permission_classes=[permissions.AllowAny])
+    def activate(self, request):
+        # First login for invited members: exchange the invitation for a
+        # password, which is hashed only now rather than at import time
+        try:
+            user_id = force_str(urlsafe_base64_decode(request.data.get('uid', '')))
+            user = CustomUser.objects.get(pk=user_id, is_active=True)
+        except (TypeError, ValueError, OverflowError, CustomUser.DoesNotExist):
+            user = None
+        if user is None or user.has_usable_password() or not default_token_generator.check_token(user, request.data.get('token', '')):
+            return Response({"detail": "Invalid or expired invitation."}, status=status.HTTP_400_BAD_REQUEST)
+
+        password = request.data.get('password', '')
+        try:
+            validate_password(password, user)
+        except DjangoValidationError as e:
+            return Response({"password": list(e.messages)}, status=status.HTTP_400_BAD_REQUEST)
+        user.set_password(password)
+        user.save(update_fields=['password'])
+
+        refresh = TeamRefreshToken.for_user(user)
+        return Response({'refresh': str(refresh), 'access': str(refresh.access_token)})
 
     @action(detail=False, methods=['get'])
     def current_user_role(self, request):
@@ -93,7 +271,106 @@ class CustomUserViewSet(viewsets.ModelViewSet):
             'role': role
         })
 
-class CompanyViewSet(viewsets.ModelViewSet):
+    async def acurrent_user_role(self, request):
+        # Answered from the token claims alone, nothing to await
+        return self.current_user_role(request)
+
+class CompanyViewSet(InstrumentedViewMixin, AsyncReadMixin, viewsets.ModelViewSet):
     queryset = Company.objects.all()
     serializer_class = CompanySerializer
     permission_classes = [permissions.IsAuthenticated, permissions.IsAdminUser]
+    async_actions = ('list',)
+    replica_actions = ('list', 'retrieve', 'stats')
+
+    def get_queryset(self):
+        # A company being deleted in the background is already gone as far
+        # as the API is concerned
+        return Company.objects.filter(deleting=False)
+
+    def destroy(self, request, *args, **kwargs):
+        # Large companies, or any with ?async=true, are deleted by a
+        # background job in batches; the response is the job to follow
+        company = self.get_object()
+        run_async = request.query_params.get('async') in ('1', 'true')
+        if not run_async and company.member_count <= settings.COMPANY_SYNC_DELETE_MAX_MEMBERS:
+            return super().destroy(request, *args, **kwargs)
+        job = schedule_company_deletion(company, created_by_id=request.user.pk)
+        return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(
+        detail=False, methods=['get'],
+        permission_classes=[permissions.IsAuthenticated, permissions.IsAdminUser | IsSuperuserOrCompanyAdmin],
+    )
+    def stats(self, request):
+        # Headcount by role for every company (staff) or the caller's own
+        # (company admins), read from the counters on Company in one query
+        companies = self.get_queryset().only(*CompanyStatsSerializer.Meta.fields).order_by('pk')
+        if not (request.user.is_staff or request.user.is_superuser):
+            companies = companies.filter(pk=request.user.company_id)
+        return Response(CompanyStatsSerializer(companies, many=True).data)
+
+class JobViewSet(InstrumentedViewMixin, viewsets.ReadOnlyModelViewSet):
+    # Status and progress of background jobs: a user sees the jobs they
+    # started, superusers see every job
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetCursorPagination
+
+    def get_queryset(self):
+        user = self.request.user
+        if user.is_superuser:
+            return Job.objects.all()
+        return Job.objects.filter(created_by_id=user.pk)
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.kind != 'users.export' or job.status != Job.SUCCEEDED:
+            return Response({"detail": "This job has no file to download."}, status=status.HTTP_404_NOT_FOUND)
+        result = job.result
+        return FileResponse(
+            default_storage.open(result['file']),
+            as_attachment=True,
+            filename=f"roster.{result['file_format']}",
+            content_type=result['content_type'],
+        )
+
+class AuditEventViewSet(InstrumentedViewMixin, viewsets.ReadOnlyModelViewSet):
+    # Who changed which member and how, newest first. Company admins see
+    # their company's history; staff see every company's and can narrow it
+    # to one with ?company=<id>. Events show up once the audit log flushes.
+    queryset = AuditEvent.objects.all()
+    serializer_class = AuditEventSerializer
+    permission_classes = [permissions.IsAuthenticated, permissions.IsAdminUser | IsSuperuserOrCompanyAdmin]
+    pagination_class = AuditEventCursorPagination
+    replica_actions = ('list', 'retrieve')
+
+    def get_queryset(self):
+        user = self.request.user
+        if not (user.is_staff or user.is_superuser):
+            return AuditEvent.objects.filter(company_id=user.company_id)
+        company = self.request.query_params.get('company', '')
+        if company.isdigit():
+            return AuditEvent.objects.filter(company_id=company)
+        return AuditEvent.objects.all()
+
+class BatchView(InstrumentedViewMixin, APIView):
+    # Runs {"requests": [{"method": ..., "path": "/api/...", "body": ...}],
+    # "atomic": false} in order in one round trip and answers
+    # {"responses": [{"status": ..., "body": ...}]}, one per request. The
+    # caller is authenticated once for the whole batch. With "atomic": true
+    # the requests share one transaction, the first failure rolls them all
+    # back, and "committed" says whether they took effect.
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        if not isinstance(request.data, dict):
+            raise ValidationError({'detail': 'Expected an object with a list of requests.'})
+        requests = validate_batch(request.data.get('requests'), type(self))
+        atomic = request.data.get('atomic') is True
+        responses = run_batch(request, requests, atomic=atomic)
+        data = {'responses': responses}
+        if atomic:
+            data['committed'] = all(response['status'] < 400 for response in responses)
+        return Response(data)
@@ -13,4 +13,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once get_asgi_application() has set Django up
+from django.conf import settings  # noqa: E402
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler  # noqa: E402
+
+from apps.users.streams import route_roster_events  # noqa: E402
+
+if settings.DEBUG:
+    # Serve static files (the admin's) in development, as runserver would
+    django_application = ASGIStaticFilesHandler(django_application)
+
+application = route_roster_events(django_application)
@@ -45,6 +45,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'apps.users.instrumentation.PerformanceMiddleware',
+    'apps.users.compression.CompressionMiddleware',
+    'apps.users.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -96,6 +99,122 @@ DATABASES = {
     }
 }
 
+# Read replicas as a comma-separated list of host[:port], reached with the
+# primary's name and credentials. Roster reads go to a healthy replica unless
+# the client wrote within REPLICA_PIN_SECONDS (see apps.users.routers).
+for index, replica in enumerate(filter(None, config('DB_REPLICA_HOSTS', default='').split(','))):
+    host, _, port = replica.strip().partition(':')
+    DATABASES[f'replica_{index}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# Seconds to keep database connections open between requests (0 closes them
+# after each request). Under ASGI every request runs on its own thread, so
+# keep this 0 there and pool with PgBouncer instead.
+for database in DATABASES.values():
+    database['CONN_MAX_AGE'] = config('DB_CONN_MAX_AGE', default=0, cast=int)
+    database['CONN_HEALTH_CHECKS'] = database['CONN_MAX_AGE'] != 0
+
+DATABASE_ROUTERS = ['apps.users.routers.ReplicaRouter']
+
+# Seconds a client's reads stay on the primary after it writes, long enough
+# to cover replication lag
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=5, cast=int)
+
+# Seconds between health checks of each replica (connectivity and lag)
+REPLICA_CHECK_SECONDS = config('REPLICA_CHECK_SECONDS', default=10, cast=int)
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Local memory (LRU culled) by default; set REDIS_URL to share the cache
+# between workers, with maxmemory-policy allkeys-lru on the Redis side.
+
+REDIS_URL = config('REDIS_URL', default='')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# Seconds a serialized roster response stays cached. Entries are keyed by the
+# company's roster version, so writes invalidate them regardless.
+ROSTER_CACHE_TIMEOUT = config('ROSTER_CACHE_TIMEOUT', default=86400, cast=int)
+
+# Broker behind the live roster event stream. The in-process broker only
+# reaches clients connected to the same worker; with REDIS_URL set, events go
+# through Redis pub/sub so every node sees them.
+ROSTER_EVENT_BROKER = config(
+    'ROSTER_EVENT_BROKER',
+    default='apps.users.events.RedisBroker' if REDIS_URL else 'apps.users.events.InProcessBroker',
+)
+
+# Serve the hot read endpoints (users list and detail, current_user_role,
+# companies list) as async views. Off by default: with the synchronous
+# database driver the async ORM still runs each query on a thread, and
+# benchmark_async has not shown them faster under the shipped ASGI server.
+# Only turn on under ASGI, after benchmark_async shows a gain there; never
+# over WSGI, where each async view would run through its own event loop.
+ASYNC_READ_VIEWS = config('ASYNC_READ_VIEWS', default=False, cast=bool)
+
+# Days deleted members are remembered for delta sync; older sync tokens get
+# 410 Gone and the client refetches the whole roster
+SYNC_TOMBSTONE_RETENTION_DAYS = config('SYNC_TOMBSTONE_RETENTION_DAYS', default=30, cast=int)
+
+# Companies with more members than this are deleted by a background job
+# (manage.py run_jobs), this many members per transaction at a time
+COMPANY_SYNC_DELETE_MAX_MEMBERS = config('COMPANY_SYNC_DELETE_MAX_MEMBERS', default=1000, cast=int)
+COMPANY_DELETE_BATCH_SIZE = config('COMPANY_DELETE_BATCH_SIZE', default=500, cast=int)
+
+# Seconds a worker may go without reporting progress before another worker
+# takes its job over
+JOB_LEASE_SECONDS = config('JOB_LEASE_SECONDS', default=300, cast=int)
+# Attempts a failing job gets, the first retry waiting JOB_RETRY_BACKOFF_SECONDS
+# and each later one twice as long as the last
+JOB_MAX_ATTEMPTS = config('JOB_MAX_ATTEMPTS', default=5, cast=int)
+JOB_RETRY_BACKOFF_SECONDS = config('JOB_RETRY_BACKOFF_SECONDS', default=10, cast=int)
+# Jobs each run_jobs process runs at once, one thread each
+JOB_WORKERS = config('JOB_WORKERS', default=2, cast=int)
+
+# Files written by background jobs, such as roster exports. The web and
+# worker processes must share this storage.
+MEDIA_ROOT = config('MEDIA_ROOT', default=str(BASE_DIR / 'media'))
+
+# Audit events are appended to a write-ahead file in this directory, one per
+# process, and inserted in batches of AUDIT_FLUSH_SIZE or every
+# AUDIT_FLUSH_SECONDS, whichever comes first. Files left by a process that
+# died are replayed by the next one. Keep it on a local, persistent disk.
+AUDIT_LOG_DIR = config('AUDIT_LOG_DIR', default=str(BASE_DIR / 'audit-log'))
+AUDIT_FLUSH_SIZE = config('AUDIT_FLUSH_SIZE', default=500, cast=int)
+AUDIT_FLUSH_SECONDS = config('AUDIT_FLUSH_SECONDS', default=2.0, cast=float)
+# Also sync each event to disk, so it survives a power loss and not just a
+# crashed process, at the cost of a disk sync per change
+AUDIT_LOG_FSYNC = config('AUDIT_LOG_FSYNC', default=False, cast=bool)
+
+# Responses smaller than this many bytes are sent uncompressed; below about
+# a kilobyte compression saves less than it costs
+COMPRESSION_MIN_BYTES = config('COMPRESSION_MIN_BYTES', default=1024, cast=int)
+
+# Requests slower than this many milliseconds are logged with their slowest
+# queries by PerformanceMiddleware
+SLOW_REQUEST_THRESHOLD_MS = config('SLOW_REQUEST_THRESHOLD_MS', default=500, cast=int)
+
+# Send the Server-Timing header to every client, not only to staff; for
+# load tests and local profiling, as it exposes query counts and timings
+PERF_SERVER_TIMING = config('PERF_SERVER_TIMING', default=False, cast=bool)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -114,12 +233,38 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Number of processes used to hash passwords for bulk imports and seeding.
+# 0 uses every available core.
+PASSWORD_HASHING_WORKERS = config('PASSWORD_HASHING_WORKERS', default=0, cast=int)
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+        'apps.users.authentication.ClaimsJWTAuthentication',
+    ),
+    # orjson-backed when it is installed, DRF's stdlib JSON otherwise
+    'DEFAULT_RENDERER_CLASSES': (
+        'apps.users.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'apps.users.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+}
+
+SIMPLE_JWT = {
+    'TOKEN_OBTAIN_SERIALIZER': 'apps.users.serializers.TeamTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'apps.users.serializers.TeamTokenRefreshSerializer',
 }
 
+# Seconds a user's token version and active flag are cached for JWT checks.
+# Role and status changes clear the entry at once, but only in the cache of
+# the process that made them: with the local-memory cache (no REDIS_URL),
+# every other worker keeps accepting revoked tokens for up to this long, so
+# the default is short there. Set REDIS_URL in any multi-process deployment.
+AUTH_STATE_CACHE_TIMEOUT = config('AUTH_STATE_CACHE_TIMEOUT', default=60 if REDIS_URL else 5, cast=int)
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
@@ -61,6 +61,7 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({
 
   async function signIn(username: string, password: string) {
     const tokenResponse = await api.login(username, password);
+    api.resetTeamMembersCache();
     const userData = await api.fetchCurrentUserRole();
     setUser(userData);
     await AsyncStorage.setItem("user", JSON.stringify(userData));
@@ -70,6 +71,7 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({
     await AsyncStorage.removeItem("user");
     await AsyncStorage.removeItem("accessToken");
     await AsyncStorage.removeItem("refreshToken");
+    api.resetTeamMembersCache();
     setUser(null);
   }
 
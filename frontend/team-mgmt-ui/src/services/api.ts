@@ -38,6 +38,31 @@ async function fetchWithAuth(
   return response;
 }
 
+// Last body and ETag per GET path; the server answers 304 while the
+// company's roster is unchanged, so the body is reused without a download
+const etagCache = new Map<string, { etag: string; body: any }>();
+
+async function fetchJsonWithETag(
+  url: string
+): Promise<{ ok: boolean; body: any }> {
+  const cached = etagCache.get(url);
+  const response = await fetchWithAuth(url, {
+    headers: cached ? { "If-None-Match": cached.etag } : {},
+  });
+  if (response.status === 304 && cached) {
+    return { ok: true, body: cached.body };
+  }
+  if (!response.ok) {
+    return { ok: false, body: null };
+  }
+  const body = await response.json();
+  const etag = response.headers.get("ETag");
+  if (etag) {
+    etagCache.set(url, { etag, body });
+  }
+  return { ok: true, body };
+}
+
 export const login = async (
   username: string,
   password: string
@@ -101,20 +126,63 @@ export const verifyToken = async (token: string): Promise<boolean> => {
   }
 };
 
+// Local copy of the roster kept current with delta sync: the first fetch
+// downloads every member, later ones only what changed since `token`
+const ROSTER_FIELDS = "id,first_name,last_name,role,email,phone_number";
+let rosterToken: string | null = null;
+let rosterMembers = new Map<number, any>();
+
+export const resetTeamMembersCache = () => {
+  rosterToken = null;
+  rosterMembers = new Map();
+};
+
 export const fetchTeamMembers = async () => {
-  const response = await fetchWithAuth("/api/users/");
-  if (!response.ok) {
-    throw new Error("Failed to fetch team members");
+  let hasMore = true;
+  let resynced = false;
+  while (hasMore) {
+    const params = new URLSearchParams({ fields: ROSTER_FIELDS });
+    if (rosterToken) {
+      params.set("since", rosterToken);
+    }
+    const response = await fetchWithAuth(`/api/users/changes/?${params}`);
+    if (response.status === 410 && rosterToken) {
+      // Token too old for the server's tombstones; start over, but only once
+      // per call so a server that keeps answering 410 can't loop us forever
+      resetTeamMembersCache();
+      if (resynced) {
+        throw new Error("Failed to fetch team members: sync token expired again during a full resync");
+      }
+      resynced = true;
+      continue;
+    }
+    if (!response.ok) {
+      throw new Error("Failed to fetch team members");
+    }
+    const changes = await response.json();
+    for (const member of changes.users) {
+      rosterMembers.set(member.id, member);
+    }
+    for (const id of changes.deleted) {
+      rosterMembers.delete(id);
+    }
+    rosterToken = changes.next;
+    hasMore = changes.has_more;
   }
-  return response.json();
+  return [...rosterMembers.values()].sort(
+    (a, b) =>
+      a.last_name.localeCompare(b.last_name) ||
+      a.first_name.localeCompare(b.first_name) ||
+      a.id - b.id
+  );
 };
 
 export const fetchTeamMember = async (id: string) => {
-  const response = await fetchWithAuth(`/api/users/${id}/`);
-  if (!response.ok) {
+  const { ok, body } = await fetchJsonWithETag(`/api/users/${id}/`);
+  if (!ok) {
     throw new Error("Failed to fetch team member");
   }
-  return response.json();
+  return body;
 };
 
 export const updateTeamMember = async (id: string, data: any) => {